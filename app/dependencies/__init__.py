@@ -1,6 +1,11 @@
 from .logger import logger
-from .repos import get_users_repo, get_institution_repo, get_portfolio_repo
+from .repos import (
+    get_users_repo,
+    get_institution_repo,
+    get_portfolio_repo,
+    get_sync_run_repo,
+)
 from .event_loop import get_event_loop
 from .http_client import get_client_session
-from .auth import get_current_active_user
+from .auth import get_current_active_user, get_current_active_superuser
 from .institution_services import get_institution_service, get_all_institution_services
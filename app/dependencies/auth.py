@@ -1,9 +1,16 @@
+import asyncio
+from hashlib import sha256
+from time import time
+from typing import Optional
+
+import asyncpg
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 
-from app.dependencies import get_users_repo  # pylint: disable = cyclic-import
+from app.dependencies import get_users_repo, logger  # pylint: disable = cyclic-import
 from app.libraries import pelleum_errors
+from app.libraries.ttl_cache import TTLCache
 from app.settings import settings
 from app.usecases.interfaces.user_repo import IUserRepo
 from app.usecases.schemas import auth
@@ -11,9 +18,102 @@ from app.usecases.schemas.users import UserInDB
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=settings.token_url)
 
+# Hash of an already validated token -> its username, until the token expires
+TOKEN_CACHE = TTLCache(
+    max_size=settings.auth_cache_max_size, ttl=settings.auth_user_cache_ttl
+)
+# Username -> UserInDB, for a short while so is_active changes are picked up
+USER_CACHE = TTLCache(
+    max_size=settings.auth_cache_max_size, ttl=settings.auth_user_cache_ttl
+)
+
+
+def invalidate_cached_user(username: str) -> None:
+    """Drop a cached user, e.g. when its is_active changes"""
+
+    USER_CACHE.pop(username)
+
+
+USER_CHANGES_TASK: Optional[asyncio.Task] = None
+
+
+async def start_user_changes_listener() -> None:
+    global USER_CHANGES_TASK
+    if not settings.user_changes_channel or USER_CHANGES_TASK is not None:
+        return
+
+    USER_CHANGES_TASK = asyncio.create_task(listen_for_user_changes())
+
+
+async def stop_user_changes_listener() -> None:
+    global USER_CHANGES_TASK
+    if USER_CHANGES_TASK is None:
+        return
+
+    USER_CHANGES_TASK.cancel()
+    await asyncio.gather(USER_CHANGES_TASK, return_exceptions=True)
+    USER_CHANGES_TASK = None
+
+
+async def listen_for_user_changes() -> None:
+    """LISTEN for usernames on settings.user_changes_channel and drop them from the cache,
+    reconnecting with exponential backoff whenever the connection is lost"""
+
+    retry_interval = settings.user_changes_retry_interval
+    while True:
+        terminated = asyncio.Event()
+        try:
+            # LISTEN holds its connection for good, so it gets its own rather than a pooled one
+            connection = await asyncpg.connect(settings.db_url)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            logger.warning(
+                "[UserChangesListener]: Could not connect, retrying in %s seconds. Detail: %s"
+                % (retry_interval, e)
+            )
+        else:
+            try:
+                connection.add_termination_listener(lambda connection: terminated.set())
+                await connection.add_listener(
+                    settings.user_changes_channel,
+                    lambda connection, pid, channel, username: invalidate_cached_user(
+                        username
+                    ),
+                )
+                # Changes notified while no connection was listening were missed
+                USER_CACHE.clear()
+                logger.info(
+                    "[UserChangesListener]: Listening for user changes on channel %s"
+                    % settings.user_changes_channel
+                )
+                retry_interval = settings.user_changes_retry_interval
+
+                await terminated.wait()
+                logger.warning(
+                    "[UserChangesListener]: Connection lost, reconnecting in %s seconds."
+                    % retry_interval
+                )
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                logger.warning(
+                    "[UserChangesListener]: Could not listen, retrying in %s seconds. Detail: %s"
+                    % (retry_interval, e)
+                )
+            finally:
+                connection.terminate()
+
+        await asyncio.sleep(retry_interval)
+        retry_interval = min(
+            retry_interval * 2, settings.user_changes_max_retry_interval
+        )
+
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     """Validates token sent in"""
+
+    token_hash = sha256(token.encode()).hexdigest()
+    cached_username = TOKEN_CACHE.get(token_hash)
+    if cached_username:
+        return await verify_user_exists(username=cached_username)
+
     try:
         payload = jwt.decode(
             token,
@@ -27,14 +127,25 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise pelleum_errors.invalid_credentials  # pylint: disable = raise-missing-from
 
+    # Skip decoding this token again until it expires
+    expires_at = payload.get("exp")
+    if isinstance(expires_at, (int, float)) and expires_at > time():
+        TOKEN_CACHE.set(token_hash, token_data.username, ttl=expires_at - time())
+
     return await verify_user_exists(username=token_data.username)
 
 
 async def verify_user_exists(username: str):
+    cached_user = USER_CACHE.get(username)
+    if cached_user:
+        return cached_user
+
     users_repo: IUserRepo = await get_users_repo()
     user: UserInDB = await users_repo.retrieve_user_with_filter(username=username)
     if user is None:
         raise pelleum_errors.invalid_credentials
+
+    USER_CACHE.set(username, user)
     return user
 
 
@@ -42,3 +153,11 @@ async def get_current_active_user(current_user: UserInDB = Depends(get_current_u
     if not current_user.is_active:
         raise pelleum_errors.inactive_user_error
     return current_user
+
+
+async def get_current_active_superuser(
+    current_user: UserInDB = Depends(get_current_active_user),
+):
+    if not current_user.is_superuser:
+        raise pelleum_errors.insufficient_privileges_error
+    return current_user
@@ -1,11 +1,31 @@
+import logging
+from time import perf_counter
 from typing import Any, Mapping, Optional
 
 import aiohttp
 
+from app.libraries.metrics import BYTES_BUCKETS, METRICS
+from app.settings import settings
 from app.usecases.interfaces.clients.robinhood import IRobinhoodClient
 from app.usecases.schemas import robinhood
 from app.usecases.schemas.institutions import UnauthorizedException
 
+# app.dependencies builds the institution services from this client, so the app's
+# logger is looked up by name rather than imported from there
+logger = logging.getLogger(settings.application_name)
+
+REQUEST_DURATION = METRICS.histogram(
+    "robinhood_request_duration_seconds",
+    "How long each Robinhood request took, including reading the response body.",
+    label_names=("method", "endpoint", "status"),
+)
+RESPONSE_SIZE = METRICS.histogram(
+    "robinhood_response_size_bytes",
+    "How large each Robinhood response body was.",
+    buckets=BYTES_BUCKETS,
+    label_names=("method", "endpoint"),
+)
+
 
 class RobinhoodClient(IRobinhoodClient):
     def __init__(self, client_session: aiohttp.client.ClientSession):
@@ -18,44 +38,69 @@ class RobinhoodClient(IRobinhoodClient):
         endpoint: str,
         headers: Optional[Mapping[str, str]] = None,
         json_body: Optional[Mapping[str, Any]] = None,
+        endpoint_template: Optional[str] = None,
     ) -> Mapping[str, Any]:
-        """Facilitate actual API call"""
+        """Facilitate actual API call. The call is timed under endpoint_template, or
+        endpoint without its query string."""
 
-        async with self.client_session.request(
-            method,
-            self.robinhood_base_url + endpoint,
-            headers=headers,
-            json=json_body,
-            verify_ssl=False,
-        ) as response:
+        endpoint_template = endpoint_template or endpoint.split("?", 1)[0]
+        status = "error"
+        response_size = None
+        started_at = perf_counter()
+        try:
+            async with self.client_session.request(
+                method,
+                self.robinhood_base_url + endpoint,
+                headers=headers,
+                json=json_body,
+                verify_ssl=False,
+            ) as response:
+                status = response.status
+                response_size = len(await response.read())
+        finally:
+            duration = perf_counter() - started_at
+            REQUEST_DURATION.observe(
+                duration, method=method, endpoint=endpoint_template, status=status
+            )
+            if response_size is not None:
+                RESPONSE_SIZE.observe(
+                    response_size, method=method, endpoint=endpoint_template
+                )
+            if duration >= settings.robinhood_slow_request_threshold:
+                logger.warning(
+                    "[RobinhoodClient]: Slow request took %.3f seconds. Detail: method: %s, endpoint: %s, status: %s, bytes: %s"
+                    % (duration, method, endpoint_template, status, response_size)
+                )
+
+        # The body has been read, so parsing it needs no further I/O
+        try:
+            response_json = await response.json()
+        except Exception:
+            response_text = await response.text()
+            raise robinhood.RobinhoodException(  # pylint: disable=raise-missing-from
+                f"RobinhoodClient Error: Response status: {response.status}, Response Text: {response_text}"
+            )
+
+        if response.status >= 300:
+            if response.status == 401:
+                raise UnauthorizedException()
+
+            if "challenge" in response_json:
+                return response_json
+
+            # if neither of the above are true, raise error
             try:
-                response_json = await response.json()
+                error = robinhood.APIErrorBody(**response_json)
             except Exception:
-                response_text = await response.text()
                 raise robinhood.RobinhoodException(  # pylint: disable=raise-missing-from
-                    f"RobinhoodClient Error: Response status: {response.status}, Response Text: {response_text}"
-                )
-
-            if response.status >= 300:
-                if response.status == 401:
-                    raise UnauthorizedException()
-
-                if "challenge" in response_json:
-                    return response_json
-
-                # if neither of the above are true, raise error
-                try:
-                    error = robinhood.APIErrorBody(**response_json)
-                except Exception:
-                    raise robinhood.RobinhoodException(  # pylint: disable=raise-missing-from
-                        f"RobinhoodClient Error: Response status: {response.status}, Response JSON: {response_json}"
-                    )
-                raise robinhood.RobinhoodApiError(
-                    status=response.status,
-                    detail=error.detail,
+                    f"RobinhoodClient Error: Response status: {response.status}, Response JSON: {response_json}"
                 )
+            raise robinhood.RobinhoodApiError(
+                status=response.status,
+                detail=error.detail,
+            )
 
-            return response_json
+        return response_json
 
     async def login(
         self, payload: robinhood.LoginPayload, challenge_id: Optional[str] = None
@@ -88,6 +133,7 @@ class RobinhoodClient(IRobinhoodClient):
         await self.api_call(
             method="POST",
             endpoint=f"/challenge/{challenge_id}/respond/",
+            endpoint_template="/challenge/{challenge_id}/respond/",
             json_body={"response": challenge_code},
         )
 
@@ -118,7 +164,10 @@ class RobinhoodClient(IRobinhoodClient):
         headers = {"Authorization": f"Bearer {access_token}"}
 
         instrument_response_json = await self.api_call(
-            method="GET", endpoint=endpoint, headers=headers
+            method="GET",
+            endpoint=endpoint,
+            headers=headers,
+            endpoint_template="/instruments/{instrument_id}/",
         )
 
         try:
@@ -136,7 +185,10 @@ class RobinhoodClient(IRobinhoodClient):
         headers = {"Authorization": f"Bearer {access_token}"}
 
         name_response_json = await self.api_call(
-            method="GET", endpoint=f"/instruments/?symbol={symbol}", headers=headers
+            method="GET",
+            endpoint=f"/instruments/?symbol={symbol}",
+            headers=headers,
+            endpoint_template="/instruments/?symbol={symbol}",
         )
 
         try:
@@ -7,6 +7,22 @@ from app.dependencies import logger
 from app.settings import settings
 
 DATABASE: Optional[Database] = None
+REPLICA_DATABASE: Optional[Database] = None
+
+
+async def create_database(url: str) -> Database:
+    # These options are passed straight through to asyncpg.create_pool()
+    database = databases.Database(
+        url,
+        min_size=settings.db_pool_min_size,
+        max_size=settings.db_pool_max_size,
+        statement_cache_size=settings.db_statement_cache_size,
+        command_timeout=settings.db_command_timeout,
+        max_inactive_connection_lifetime=settings.db_max_inactive_connection_lifetime,
+    )
+
+    await database.connect()
+    return database
 
 
 async def get_or_create_database() -> Database:
@@ -14,8 +30,31 @@ async def get_or_create_database() -> Database:
     if DATABASE is not None:
         return DATABASE
 
-    DATABASE = databases.Database(settings.db_url, min_size=5)
-
-    await DATABASE.connect()
-    logger.info("Connected to Database!")
+    DATABASE = await create_database(settings.db_url)
+    logger.info(
+        "Connected to Database! Pool: min_size=%s, max_size=%s, statement_cache_size=%s, command_timeout=%s, max_inactive_connection_lifetime=%s"
+        % (
+            settings.db_pool_min_size,
+            settings.db_pool_max_size,
+            settings.db_statement_cache_size,
+            settings.db_command_timeout,
+            settings.db_max_inactive_connection_lifetime,
+        )
+    )
     return DATABASE
+
+
+async def get_or_create_replica_database() -> Database:
+    """The read replica, or the primary when no replica is configured"""
+
+    global REPLICA_DATABASE
+    if REPLICA_DATABASE is not None:
+        return REPLICA_DATABASE
+
+    if not settings.db_replica_url:
+        REPLICA_DATABASE = await get_or_create_database()
+        return REPLICA_DATABASE
+
+    REPLICA_DATABASE = await create_database(settings.db_replica_url)
+    logger.info("Connected to Replica Database!")
+    return REPLICA_DATABASE
@@ -40,6 +40,7 @@ INSTITUTION_CONNECTIONS = sa.Table(
     sa.Column("password", sa.String, nullable=True),
     sa.Column("json_web_token", sa.String, nullable=True),
     sa.Column("refresh_token", sa.String, nullable=True),
+    sa.Column("token_expires_at", sa.DateTime, nullable=True),
     sa.Column("is_active", sa.Boolean, nullable=False),
     sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
     sa.Column(
@@ -69,9 +70,70 @@ ROBINHOOD_INSTRUMENTS = sa.Table(
     schema="account_connections",
 )
 
+LOGIN_JOBS = sa.Table(
+    "login_jobs",
+    METADATA,
+    sa.Column("job_id", sa.String, primary_key=True),
+    sa.Column(
+        "user_id",
+        sa.Integer,
+        sa.ForeignKey(USERS.c.user_id),
+        nullable=False,
+        index=True,
+    ),
+    sa.Column(
+        "institution_id",
+        sa.String,
+        sa.ForeignKey("account_connections.institutions.institution_id"),
+        nullable=False,
+    ),
+    sa.Column("status", sa.String, nullable=False),
+    sa.Column("imported_assets", sa.Integer, nullable=True),
+    sa.Column("error", sa.String, nullable=True),
+    sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    sa.Column(
+        "updated_at",
+        sa.DateTime,
+        nullable=False,
+        server_default=sa.func.now(),
+        onupdate=sa.func.now(),
+    ),
+    schema="account_connections",
+)
+
 sa.Index(
     "ix_user_id_institution_id",
     INSTITUTION_CONNECTIONS.c.user_id,
     INSTITUTION_CONNECTIONS.c.institution_id,
     unique=True,
 )
+
+sa.Index(
+    "ix_institution_connections_active_created_at",
+    INSTITUTION_CONNECTIONS.c.created_at.desc(),
+    postgresql_where=INSTITUTION_CONNECTIONS.c.is_active,
+)
+
+sa.Index(
+    "ix_institution_connections_refreshable_created_at",
+    INSTITUTION_CONNECTIONS.c.created_at.desc(),
+    postgresql_where=sa.and_(
+        INSTITUTION_CONNECTIONS.c.is_active,
+        INSTITUTION_CONNECTIONS.c.refresh_token.isnot(None),
+    ),
+)
+
+sa.Index(
+    "ix_institution_connections_active_connection_id",
+    INSTITUTION_CONNECTIONS.c.connection_id,
+    postgresql_where=INSTITUTION_CONNECTIONS.c.is_active,
+)
+
+sa.Index(
+    "ix_institution_connections_token_expires_at",
+    INSTITUTION_CONNECTIONS.c.token_expires_at.asc().nullsfirst(),
+    postgresql_where=sa.and_(
+        INSTITUTION_CONNECTIONS.c.is_active,
+        INSTITUTION_CONNECTIONS.c.refresh_token.isnot(None),
+    ),
+)
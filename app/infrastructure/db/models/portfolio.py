@@ -30,7 +30,7 @@ ASSETS = sa.Table(
     sa.Column("asset_symbol", sa.String, nullable=False),
     sa.Column("name", sa.String, nullable=False),
     sa.Column("quantity", sa.Float, nullable=False),
-    sa.Column("position_value", sa.Float, nullable=False),
+    sa.Column("position_value", sa.Float, nullable=True),
     sa.Column("skin_rating", sa.Float, nullable=True),
     sa.Column("average_buy_price", sa.Float, nullable=True),
     sa.Column("total_contribution", sa.Float, nullable=True),
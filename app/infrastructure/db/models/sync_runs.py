@@ -0,0 +1,28 @@
+import sqlalchemy as sa
+
+from app.infrastructure.db.metadata import METADATA
+
+SYNC_RUNS = sa.Table(
+    "sync_runs",
+    METADATA,
+    sa.Column("run_id", sa.Integer, primary_key=True, autoincrement=True),
+    sa.Column("task_name", sa.String, nullable=False),
+    sa.Column("last_connection_id", sa.Integer, nullable=False, server_default="0"),
+    sa.Column("processed_connections", sa.Integer, nullable=False, server_default="0"),
+    sa.Column("completed_at", sa.DateTime, nullable=True),
+    sa.Column("created_at", sa.DateTime, nullable=False, server_default=sa.func.now()),
+    sa.Column(
+        "updated_at",
+        sa.DateTime,
+        nullable=False,
+        server_default=sa.func.now(),
+        onupdate=sa.func.now(),
+    ),
+    schema="account_connections",
+)
+
+sa.Index(
+    "ix_sync_runs_task_name_created_at",
+    SYNC_RUNS.c.task_name,
+    SYNC_RUNS.c.created_at.desc(),
+)
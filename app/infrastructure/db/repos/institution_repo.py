@@ -1,85 +1,304 @@
-from typing import List, Optional
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
 
 from databases import Database
-from sqlalchemy import and_, delete, desc, select
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import (
+    DateTime,
+    Integer,
+    Interval,
+    String,
+    and_,
+    any_,
+    asc,
+    bindparam,
+    case,
+    cast,
+    delete,
+    desc,
+    func,
+    or_,
+    select,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 
 from app.infrastructure.db.models.institutions import (
     INSTITUTION_CONNECTIONS,
     INSTITUTIONS,
+    LOGIN_JOBS,
     ROBINHOOD_INSTRUMENTS,
 )
+from app.infrastructure.db.models.portfolio import ASSETS
+from app.infrastructure.db.statement_cache import StatementCache
 from app.usecases.interfaces.repos.institution_repo import IInstitutionRepo
 from app.usecases.schemas import institutions
 
+# Statements are compiled once per query shape and reused by every InstitutionRepo
+STATEMENTS = StatementCache(name="institution_repo")
+
+CONNECTION_COLUMNS = (
+    "username",
+    "password",
+    "json_web_token",
+    "refresh_token",
+    "token_expires_at",
+    "is_active",
+)
+
+# The columns holding ciphertexts
+SECRET_COLUMNS = ("username", "password", "json_web_token", "refresh_token")
+
+
+def build_upsert_connection_statement():
+    create_connection_statement = insert(INSTITUTION_CONNECTIONS).values(
+        institution_id=bindparam("new_institution_id"),
+        user_id=bindparam("new_user_id"),
+        **{column: bindparam(f"new_{column}") for column in CONNECTION_COLUMNS},
+    )
+
+    return create_connection_statement.on_conflict_do_update(
+        index_elements=[
+            INSTITUTION_CONNECTIONS.c.user_id,
+            INSTITUTION_CONNECTIONS.c.institution_id,
+        ],
+        set_={column: bindparam(f"new_{column}") for column in CONNECTION_COLUMNS},
+    ).returning(INSTITUTION_CONNECTIONS)
+
+
+def build_connection_join_query():
+    j = INSTITUTION_CONNECTIONS.join(
+        INSTITUTIONS,
+        INSTITUTION_CONNECTIONS.c.institution_id == INSTITUTIONS.c.institution_id,
+    )
+
+    return select(
+        [
+            INSTITUTION_CONNECTIONS,
+            INSTITUTIONS.c.name,
+        ]
+    ).select_from(j)
+
+
+def build_update_connection_tokens_statement():
+    # Each column travels as one array parameter, so the statement has the
+    # same shape no matter how many rows are in the batch
+    refreshed_tokens = (
+        func.unnest(
+            cast(bindparam("connection_ids"), ARRAY(Integer)),
+            cast(bindparam("json_web_tokens"), ARRAY(String)),
+            cast(bindparam("refresh_tokens"), ARRAY(String)),
+            cast(bindparam("token_expires_ats"), ARRAY(DateTime)),
+        )
+        .table_valued(
+            "connection_id",
+            "json_web_token",
+            "refresh_token",
+            "token_expires_at",
+        )
+        .render_derived(name="refreshed_tokens")
+    )
+
+    return (
+        INSTITUTION_CONNECTIONS.update()
+        .where(
+            INSTITUTION_CONNECTIONS.c.connection_id == refreshed_tokens.c.connection_id
+        )
+        .values(
+            json_web_token=refreshed_tokens.c.json_web_token,
+            refresh_token=refreshed_tokens.c.refresh_token,
+            # A refresh that reported no expiry keeps the one already stored
+            token_expires_at=func.coalesce(
+                refreshed_tokens.c.token_expires_at,
+                INSTITUTION_CONNECTIONS.c.token_expires_at,
+            ),
+        )
+    )
+
+
+def build_update_connection_secrets_statement():
+    rotated_secrets = (
+        func.unnest(
+            cast(bindparam("connection_ids"), ARRAY(Integer)),
+            *[
+                cast(bindparam(f"{prefix}{column}s"), ARRAY(String))
+                for prefix in ("", "previous_")
+                for column in SECRET_COLUMNS
+            ],
+        )
+        .table_valued(
+            "connection_id",
+            *[
+                f"{prefix}{column}"
+                for prefix in ("", "previous_")
+                for column in SECRET_COLUMNS
+            ],
+        )
+        .render_derived(name="rotated_secrets")
+    )
+
+    # A column refreshed since it was read no longer equals its previous value, so it keeps
+    # the newer ciphertext; NULL columns compare as unknown and stay NULL
+    return (
+        INSTITUTION_CONNECTIONS.update()
+        .where(
+            INSTITUTION_CONNECTIONS.c.connection_id == rotated_secrets.c.connection_id
+        )
+        .values(
+            {
+                column: case(
+                    (
+                        INSTITUTION_CONNECTIONS.c[column]
+                        == rotated_secrets.c[f"previous_{column}"],
+                        rotated_secrets.c[column],
+                    ),
+                    else_=INSTITUTION_CONNECTIONS.c[column],
+                )
+                for column in SECRET_COLUMNS
+            }
+        )
+    )
+
+
+def build_connection_conditions(filters: Tuple[str, ...], has_refresh_token: bool):
+    # is_active is only ever filtered on as true. It is rendered as that literal rather
+    # than bound, so even a generic plan can use the partial indexes WHERE is_active
+    conditions = [
+        INSTITUTION_CONNECTIONS.c.is_active == True
+        if column == "is_active"
+        else INSTITUTION_CONNECTIONS.c[column] == bindparam(column)
+        for column in filters
+    ]
+
+    if has_refresh_token:
+        conditions.append(INSTITUTION_CONNECTIONS.c.refresh_token != None)
+
+    return conditions
+
+
+def build_delete_connections_with_assets_statement(filters: Tuple[str, ...]):
+    conditions = []
+    if "institution_id" in filters:
+        conditions.append(
+            INSTITUTION_CONNECTIONS.c.institution_id == bindparam("institution_id")
+        )
+    if "user_ids" in filters:
+        conditions.append(
+            INSTITUTION_CONNECTIONS.c.user_id
+            == any_(cast(bindparam("user_ids"), ARRAY(Integer)))
+        )
+
+    connections_to_delete = (
+        select([INSTITUTION_CONNECTIONS.c.connection_id])
+        .where(and_(*conditions))
+        .order_by(INSTITUTION_CONNECTIONS.c.connection_id)
+        .limit(bindparam("limit"))
+    )
+
+    # Both deletes are CTEs of one statement, so they commit or fail together
+    deleted_connections = (
+        delete(INSTITUTION_CONNECTIONS)
+        .where(INSTITUTION_CONNECTIONS.c.connection_id.in_(connections_to_delete))
+        .returning(
+            INSTITUTION_CONNECTIONS.c.user_id, INSTITUTION_CONNECTIONS.c.institution_id
+        )
+        .cte("deleted_connections")
+    )
+    deleted_assets = (
+        delete(ASSETS)
+        .where(
+            and_(
+                ASSETS.c.user_id == deleted_connections.c.user_id,
+                ASSETS.c.institution_id == deleted_connections.c.institution_id,
+            )
+        )
+        .returning(ASSETS.c.asset_id)
+        .cte("deleted_assets")
+    )
+
+    return select(
+        [
+            select([func.count()])
+            .select_from(deleted_connections)
+            .scalar_subquery()
+            .label("deleted_connections"),
+            select([func.count()])
+            .select_from(deleted_assets)
+            .scalar_subquery()
+            .label("deleted_assets"),
+        ]
+    )
+
 
 class InstitutionRepo(IInstitutionRepo):
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, replica_db: Optional[Database] = None):
         self.db = db
+        # Read-only queries go to the replica unless the caller passes use_primary
+        self.replica_db = replica_db or db
 
     async def upsert(
         self, connection_data: institutions.CreateConnectionRepoAdapter
     ) -> institutions.InstitutionConnection:
         """Creates connection data"""
 
-        create_connection_statement = insert(INSTITUTION_CONNECTIONS).values(
-            institution_id=connection_data.institution_id,
-            user_id=connection_data.user_id,
-            username=connection_data.username,
-            password=connection_data.password,
-            json_web_token=connection_data.json_web_token,
-            refresh_token=connection_data.refresh_token,
-            is_active=connection_data.is_active,
+        upsert_stmt = STATEMENTS.get(
+            key="upsert", build=build_upsert_connection_statement
         )
 
-        upsert_stmt = create_connection_statement.on_conflict_do_update(
-            index_elements=[
-                INSTITUTION_CONNECTIONS.c.user_id,
-                INSTITUTION_CONNECTIONS.c.institution_id,
-            ],
-            set_=dict(
-                username=connection_data.username,
-                password=connection_data.password,
-                json_web_token=connection_data.json_web_token,
-                refresh_token=connection_data.refresh_token,
-                is_active=connection_data.is_active,
-            ),
+        result = await upsert_stmt.fetch_one(
+            self.db,
+            {
+                f"new_{column}": value
+                for column, value in connection_data.dict(
+                    include={"institution_id", "user_id", *CONNECTION_COLUMNS}
+                ).items()
+            },
         )
 
-        new_connection_id = await self.db.execute(upsert_stmt)
-
-        return await self.retrieve_institution_connection(
-            connection_id=new_connection_id
-        )
+        return institutions.InstitutionConnection(**result)
 
     async def retrieve_institution(
-        self, name: str = None, institution_id: str = None
+        self,
+        name: str = None,
+        institution_id: str = None,
+        use_primary: bool = False,
     ) -> Optional[institutions.Institution]:
         """Retrieve Pelleum supported institution by name or institution_id"""
 
-        conditions = []
-
-        if name:
-            conditions.append(INSTITUTIONS.c.name == name)
+        filters = {"name": name, "institution_id": institution_id}
+        filters = {column: value for column, value in filters.items() if value}
 
-        if institution_id:
-            conditions.append(INSTITUTIONS.c.institution_id == institution_id)
-
-        if len(conditions) == 0:
+        if len(filters) == 0:
             raise Exception(
                 "Please pass a condition parameter to query by to the function, retrieve_institution()"
             )
 
-        query = INSTITUTIONS.select().where(and_(*conditions))
-        result = await self.db.fetch_one(query)
+        query = STATEMENTS.get(
+            key=("retrieve_institution", tuple(filters)),
+            build=lambda: INSTITUTIONS.select().where(
+                and_(
+                    *[INSTITUTIONS.c[column] == bindparam(column) for column in filters]
+                )
+            ),
+        )
+        result = await query.fetch_one(
+            self.db if use_primary else self.replica_db, filters
+        )
         return institutions.Institution(**result) if result else None
 
-    async def retrieve_all_institutions(self) -> List[institutions.Institution]:
+    async def retrieve_all_institutions(
+        self, use_primary: bool = False
+    ) -> List[institutions.Institution]:
         """Retrieve all Pelleum supported institutions"""
 
-        query = INSTITUTIONS.select().order_by(desc(INSTITUTIONS.c.created_at))
+        query = STATEMENTS.get(
+            key="retrieve_all_institutions",
+            build=lambda: INSTITUTIONS.select().order_by(
+                desc(INSTITUTIONS.c.created_at)
+            ),
+        )
 
-        query_results = await self.db.fetch_all(query)
+        query_results = await query.fetch_all(
+            self.db if use_primary else self.replica_db
+        )
         return [institutions.Institution(**result) for result in query_results]
 
     async def retrieve_institution_connection(
@@ -88,43 +307,46 @@ class InstitutionRepo(IInstitutionRepo):
         user_id: str = None,
         institution_id: str = None,
         is_active: bool = None,
+        use_primary: bool = False,
     ) -> Optional[institutions.InstitutionConnection]:
         """Retrieve signle user-institution connection"""
 
-        conditions = []
-
-        if connection_id:
-            conditions.append(INSTITUTION_CONNECTIONS.c.connection_id == connection_id)
-
-        if user_id:
-            conditions.append(INSTITUTION_CONNECTIONS.c.user_id == user_id)
-
-        if institution_id:
-            conditions.append(
-                INSTITUTION_CONNECTIONS.c.institution_id == institution_id
-            )
-
-        if is_active:
-            conditions.append(INSTITUTION_CONNECTIONS.c.is_active == is_active)
+        filters = {
+            "connection_id": connection_id,
+            "user_id": user_id,
+            "institution_id": institution_id,
+            "is_active": is_active,
+        }
+        filters = {column: value for column, value in filters.items() if value}
 
-        if len(conditions) == 0:
+        if len(filters) == 0:
             raise Exception(
                 "Please pass a condition parameter to query by to the function, retrieve_institution_connection()"
             )
 
-        query = INSTITUTION_CONNECTIONS.select().where(and_(*conditions))
-        result = await self.db.fetch_one(query)
+        query = STATEMENTS.get(
+            key=("retrieve_institution_connection", tuple(filters)),
+            build=lambda: INSTITUTION_CONNECTIONS.select().where(
+                and_(
+                    *[
+                        INSTITUTION_CONNECTIONS.c[column] == bindparam(column)
+                        for column in filters
+                    ]
+                )
+            ),
+        )
+        result = await query.fetch_one(
+            self.db if use_primary else self.replica_db, filters
+        )
         return institutions.InstitutionConnection(**result) if result else None
 
     async def update_institution_connection(
         self,
         connection_id: int,
         updated_connection: institutions.UpdateConnectionRepoAdapter,
-    ) -> institutions.InstitutionConnection:
+    ) -> Optional[institutions.InstitutionConnection]:
         """Update a signle user-institution connection by connection_id"""
 
-        query = INSTITUTION_CONNECTIONS.update()
-
         updated_connection_raw = updated_connection.dict()
         update_connection_dict = {}
 
@@ -132,15 +354,84 @@ class InstitutionRepo(IInstitutionRepo):
             if value is not None:
                 update_connection_dict[key] = value
 
-        query = query.values(update_connection_dict)
+        connection_update_statemnent = STATEMENTS.get(
+            key=("update_institution_connection", tuple(update_connection_dict)),
+            build=lambda: INSTITUTION_CONNECTIONS.update()
+            .values(
+                {
+                    column: bindparam(f"updated_{column}")
+                    for column in update_connection_dict
+                }
+            )
+            .where(
+                INSTITUTION_CONNECTIONS.c.connection_id == bindparam("connection_id")
+            )
+            .returning(INSTITUTION_CONNECTIONS),
+        )
+
+        result = await connection_update_statemnent.fetch_one(
+            self.db,
+            {
+                "connection_id": connection_id,
+                **{
+                    f"updated_{column}": value
+                    for column, value in update_connection_dict.items()
+                },
+            },
+        )
+        return institutions.InstitutionConnection(**result) if result else None
+
+    async def update_many_connection_tokens(
+        self,
+        updated_tokens: List[institutions.UpdateConnectionTokensRepoAdapter],
+        batch_size: int = 500,
+    ) -> None:
+        """Store refreshed tokens for many connections, one statement per batch,
+        without reading the connections back"""
 
-        connection_update_statemnent = query.where(
-            INSTITUTION_CONNECTIONS.c.connection_id == connection_id
+        update_tokens_statement = STATEMENTS.get(
+            key="update_many_connection_tokens",
+            build=build_update_connection_tokens_statement,
         )
 
-        await self.db.execute(connection_update_statemnent)
+        for batch_start in range(0, len(updated_tokens), batch_size):
+            batch = updated_tokens[batch_start : batch_start + batch_size]
+
+            await update_tokens_statement.execute(
+                self.db,
+                {
+                    "connection_ids": [tokens.connection_id for tokens in batch],
+                    "json_web_tokens": [tokens.json_web_token for tokens in batch],
+                    "refresh_tokens": [tokens.refresh_token for tokens in batch],
+                    "token_expires_ats": [tokens.token_expires_at for tokens in batch],
+                },
+            )
+
+    async def deactivate_many_institution_connections(
+        self, connection_ids: List[int], batch_size: int = 5000
+    ) -> None:
+        """Set is_active to False for many connections, one statement per batch,
+        without reading the connections back"""
+
+        deactivate_statement = STATEMENTS.get(
+            key="deactivate_many_institution_connections",
+            build=lambda: INSTITUTION_CONNECTIONS.update()
+            .where(
+                INSTITUTION_CONNECTIONS.c.connection_id
+                == any_(cast(bindparam("connection_ids"), ARRAY(Integer)))
+            )
+            .values(is_active=False),
+        )
 
-        return await self.retrieve_institution_connection(connection_id=connection_id)
+        for batch_start in range(0, len(connection_ids), batch_size):
+            await deactivate_statement.execute(
+                self.db,
+                {
+                    "connection_ids": connection_ids[
+                        batch_start : batch_start + batch_size
+                    ]
+                },
+            )
 
     async def retrieve_many_institution_connections(
         self,
@@ -148,91 +439,500 @@ class InstitutionRepo(IInstitutionRepo):
         skip_locked: int = False,
         page_number: int = 1,
         page_size: int = 10000,
+        use_primary: bool = False,
     ) -> List[institutions.ConnectionJoinInstitutionJoinPortfolio]:
         """Retrieve many institution connections"""
 
-        conditions = []
-
-        if query_params.user_id:
-            conditions.append(INSTITUTION_CONNECTIONS.c.user_id == query_params.user_id)
+        filters = {
+            "user_id": query_params.user_id,
+            "institution_id": query_params.institution_id,
+            "is_active": query_params.is_active,
+        }
+        filters = {column: value for column, value in filters.items() if value}
+        has_refresh_token = bool(query_params.has_refresh_token)
 
-        if query_params.institution_id:
-            conditions.append(
-                INSTITUTION_CONNECTIONS.c.institution_id == query_params.institution_id
+        if len(filters) == 0 and not has_refresh_token:
+            raise Exception(
+                "Please supply query parameters to retrieve_many_institution_connections()"
             )
 
-        if query_params.is_active:
-            conditions.append(
-                INSTITUTION_CONNECTIONS.c.is_active == query_params.is_active
+        def build():
+            conditions = build_connection_conditions(tuple(filters), has_refresh_token)
+
+            query = (
+                build_connection_join_query()
+                .where(and_(*conditions))
+                .limit(bindparam("page_size"))
+                .offset(bindparam("page_offset"))
+                .order_by(desc(INSTITUTION_CONNECTIONS.c.created_at))
             )
 
-        if query_params.has_refresh_token:
-            conditions.append(INSTITUTION_CONNECTIONS.c.refresh_token != None)
+            if skip_locked:
+                query = query.with_for_update(skip_locked=True)
+
+            return query
+
+        query = STATEMENTS.get(
+            key=(
+                "retrieve_many_institution_connections",
+                tuple(filters),
+                has_refresh_token,
+                bool(skip_locked),
+            ),
+            build=build,
+        )
 
-        if len(conditions) == 0:
+        # Row locks are only possible on the primary; a hot standby rejects them
+        query_results = await query.fetch_all(
+            self.db if use_primary or skip_locked else self.replica_db,
+            {
+                **filters,
+                "page_size": page_size,
+                "page_offset": (page_number - 1) * page_size,
+            },
+        )
+
+        return [
+            institutions.ConnectionJoinInstitutionJoinPortfolio(**result)
+            for result in query_results
+        ]
+
+    async def stream_institution_connections(
+        self,
+        query_params: institutions.RetrieveManyConnectionsRepoAdapter,
+        page_size: int = 1000,
+        after_connection_id: int = 0,
+    ) -> AsyncIterator[institutions.ConnectionJoinInstitutionJoinPortfolio]:
+        """Yield many institution connections in connection_id order, starting after
+        after_connection_id and fetching page_size at a time"""
+
+        filters = {
+            "user_id": query_params.user_id,
+            "institution_id": query_params.institution_id,
+            "is_active": query_params.is_active,
+        }
+        filters = {column: value for column, value in filters.items() if value}
+        has_refresh_token = bool(query_params.has_refresh_token)
+
+        if len(filters) == 0 and not has_refresh_token:
             raise Exception(
-                "Please supply query parameters to retrieve_many_institution_connections()"
+                "Please supply query parameters to stream_institution_connections()"
+            )
+
+        def build():
+            conditions = build_connection_conditions(tuple(filters), has_refresh_token)
+
+            # Keyset pagination: each page starts after the last connection_id seen,
+            # so no connection is skipped or repeated while rows are being deactivated
+            return (
+                build_connection_join_query()
+                .where(
+                    and_(
+                        INSTITUTION_CONNECTIONS.c.connection_id
+                        > bindparam("after_connection_id"),
+                        *conditions,
+                    )
+                )
+                .order_by(asc(INSTITUTION_CONNECTIONS.c.connection_id))
+                .limit(bindparam("page_size"))
             )
 
-        j = INSTITUTION_CONNECTIONS.join(
-            INSTITUTIONS,
-            INSTITUTION_CONNECTIONS.c.institution_id == INSTITUTIONS.c.institution_id,
+        query = STATEMENTS.get(
+            key=(
+                "stream_institution_connections",
+                tuple(filters),
+                has_refresh_token,
+            ),
+            build=build,
         )
 
-        query = (
-            select(
+        while True:
+            query_results = await query.fetch_all(
+                self.db,
+                {
+                    **filters,
+                    "after_connection_id": after_connection_id,
+                    "page_size": page_size,
+                },
+            )
+
+            for result in query_results:
+                yield institutions.ConnectionJoinInstitutionJoinPortfolio(**result)
+
+            if len(query_results) < page_size:
+                return
+
+            after_connection_id = query_results[-1]["connection_id"]
+
+    async def stream_connection_secrets(
+        self, page_size: int = 1000, after_connection_id: int = 0
+    ) -> AsyncIterator[institutions.ConnectionSecrets]:
+        """Yield every connection's encrypted columns, active or not, in connection_id
+        order, starting after after_connection_id and fetching page_size at a time"""
+
+        query = STATEMENTS.get(
+            key="stream_connection_secrets",
+            build=lambda: select(
                 [
-                    INSTITUTION_CONNECTIONS,
-                    INSTITUTIONS.c.name,
+                    INSTITUTION_CONNECTIONS.c.connection_id,
+                    *[INSTITUTION_CONNECTIONS.c[column] for column in SECRET_COLUMNS],
                 ]
             )
-            .select_from(j)
-            .where(and_(*conditions))
-            .limit(page_size)
-            .offset((page_number - 1) * page_size)
-            .order_by(desc(INSTITUTION_CONNECTIONS.c.created_at))
+            .where(
+                INSTITUTION_CONNECTIONS.c.connection_id
+                > bindparam("after_connection_id")
+            )
+            .order_by(asc(INSTITUTION_CONNECTIONS.c.connection_id))
+            .limit(bindparam("page_size")),
+        )
+
+        while True:
+            query_results = await query.fetch_all(
+                self.db,
+                {"after_connection_id": after_connection_id, "page_size": page_size},
+            )
+
+            for result in query_results:
+                yield institutions.ConnectionSecrets(**result)
+
+            if len(query_results) < page_size:
+                return
+
+            after_connection_id = query_results[-1]["connection_id"]
+
+    async def update_many_connection_secrets(
+        self, rotated_secrets: List[institutions.RotatedConnectionSecretsRepoAdapter]
+    ) -> None:
+        """Store re-encrypted columns for many connections in one statement, leaving
+        any column that changed since it was read untouched"""
+
+        update_secrets_statement = STATEMENTS.get(
+            key="update_many_connection_secrets",
+            build=build_update_connection_secrets_statement,
+        )
+
+        await update_secrets_statement.execute(
+            self.db,
+            {
+                "connection_ids": [
+                    secrets.connection_id for secrets in rotated_secrets
+                ],
+                **{
+                    f"{prefix}{column}s": [
+                        getattr(secrets, f"{prefix}{column}")
+                        for secrets in rotated_secrets
+                    ]
+                    for prefix in ("", "previous_")
+                    for column in SECRET_COLUMNS
+                },
+            },
+        )
+
+    async def retrieve_users_institution_connections(
+        self, user_ids: List[int], use_primary: bool = False
+    ) -> List[institutions.ConnectionJoinInstitutionJoinPortfolio]:
+        """Retrieve every institution connection belonging to any of user_ids"""
+
+        # = ANY(array) keeps one statement shape for any number of user_ids
+        query = STATEMENTS.get(
+            key="retrieve_users_institution_connections",
+            build=lambda: build_connection_join_query()
+            .where(
+                INSTITUTION_CONNECTIONS.c.user_id
+                == any_(cast(bindparam("user_ids"), ARRAY(Integer)))
+            )
+            .order_by(
+                asc(INSTITUTION_CONNECTIONS.c.user_id),
+                desc(INSTITUTION_CONNECTIONS.c.created_at),
+            ),
         )
 
-        if skip_locked:
-            query = query.with_for_update(skip_locked=True)
+        query_results = await query.fetch_all(
+            self.db if use_primary else self.replica_db, {"user_ids": user_ids}
+        )
 
-        query_results = await self.db.fetch_all(query)
+        return [
+            institutions.ConnectionJoinInstitutionJoinPortfolio(**result)
+            for result in query_results
+        ]
+
+    async def retrieve_connections_due_for_refresh(
+        self, expires_before: datetime, limit: int = 10000
+    ) -> List[institutions.ConnectionJoinInstitutionJoinPortfolio]:
+        """Retrieve active, refreshable connections whose JSON web token expires
+        before expires_before, soonest first (unknown expiry counts as due)"""
+
+        query = STATEMENTS.get(
+            key="retrieve_connections_due_for_refresh",
+            build=lambda: build_connection_join_query()
+            .where(
+                and_(
+                    INSTITUTION_CONNECTIONS.c.is_active == True,
+                    INSTITUTION_CONNECTIONS.c.refresh_token != None,
+                    or_(
+                        INSTITUTION_CONNECTIONS.c.token_expires_at == None,
+                        INSTITUTION_CONNECTIONS.c.token_expires_at
+                        <= bindparam("expires_before"),
+                    ),
+                )
+            )
+            .order_by(asc(INSTITUTION_CONNECTIONS.c.token_expires_at).nullsfirst())
+            .limit(bindparam("limit")),
+        )
+
+        query_results = await query.fetch_all(
+            self.db, {"expires_before": expires_before, "limit": limit}
+        )
 
         return [
             institutions.ConnectionJoinInstitutionJoinPortfolio(**result)
             for result in query_results
         ]
 
+    async def retrieve_next_token_expiry(self) -> Optional[datetime]:
+        """Retrieve the soonest JSON web token expiry among active, refreshable connections"""
+
+        query = STATEMENTS.get(
+            key="retrieve_next_token_expiry",
+            build=lambda: select(
+                [func.min(INSTITUTION_CONNECTIONS.c.token_expires_at)]
+            ).where(
+                and_(
+                    INSTITUTION_CONNECTIONS.c.is_active == True,
+                    INSTITUTION_CONNECTIONS.c.refresh_token != None,
+                )
+            ),
+        )
+
+        return await query.fetch_val(self.db)
+
     async def create_robinhood_instrument(
         self, instrument_id: str, name: str, symbol: str
-    ) -> None:
+    ) -> institutions.RobinhoodInstrument:
         """Creates Robinhood instrument in our DB for future reference"""
 
-        create_instrument_statement = ROBINHOOD_INSTRUMENTS.insert().values(
-            instrument_id=instrument_id, name=name, symbol=symbol
+        create_instrument_statement = STATEMENTS.get(
+            key="create_robinhood_instrument",
+            build=lambda: ROBINHOOD_INSTRUMENTS.insert()
+            .values(
+                instrument_id=bindparam("new_instrument_id"),
+                name=bindparam("new_name"),
+                symbol=bindparam("new_symbol"),
+            )
+            .returning(ROBINHOOD_INSTRUMENTS),
         )
 
-        await self.db.execute(create_instrument_statement)
+        result = await create_instrument_statement.fetch_one(
+            self.db,
+            {
+                "new_instrument_id": instrument_id,
+                "new_name": name,
+                "new_symbol": symbol,
+            },
+        )
+        return institutions.RobinhoodInstrument(**result)
 
     async def retrieve_robinhood_instruments(
-        self, instrument_ids: list
+        self,
+        instrument_ids: list,
+        use_primary: bool = False,
     ) -> List[institutions.RobinhoodInstrument]:
         """Retrieve many instruments by supplied instrument_ids list"""
 
-        query = select(
-            [ROBINHOOD_INSTRUMENTS],
-            ROBINHOOD_INSTRUMENTS.c.instrument_id.in_(instrument_ids),
+        # = ANY(array) keeps one statement shape for any number of instrument_ids
+        query = STATEMENTS.get(
+            key="retrieve_robinhood_instruments",
+            build=lambda: select(
+                [ROBINHOOD_INSTRUMENTS],
+                ROBINHOOD_INSTRUMENTS.c.instrument_id
+                == any_(cast(bindparam("instrument_ids"), ARRAY(String))),
+            ),
         )
 
-        query_results = await self.db.fetch_all(query)
+        query_results = await query.fetch_all(
+            self.db if use_primary else self.replica_db,
+            {"instrument_ids": list(instrument_ids)},
+        )
 
         return [institutions.RobinhoodInstrument(**result) for result in query_results]
 
-    async def delete(self, connection_id: int) -> None:
+    async def create_login_job(
+        self, job_id: str, user_id: int, institution_id: str
+    ) -> institutions.LoginJob:
+        """Record that a login's holdings import has started"""
+
+        create_job_statement = STATEMENTS.get(
+            key="create_login_job",
+            build=lambda: LOGIN_JOBS.insert()
+            .values(
+                job_id=bindparam("new_job_id"),
+                user_id=bindparam("new_user_id"),
+                institution_id=bindparam("new_institution_id"),
+                status=bindparam("new_status"),
+            )
+            .returning(LOGIN_JOBS),
+        )
+
+        result = await create_job_statement.fetch_one(
+            self.db,
+            {
+                "new_job_id": job_id,
+                "new_user_id": user_id,
+                "new_institution_id": institution_id,
+                "new_status": institutions.LoginJobStatus.IMPORTING.value,
+            },
+        )
+        return institutions.LoginJob(**result)
+
+    async def update_login_job(
+        self,
+        job_id: str,
+        status: institutions.LoginJobStatus,
+        imported_assets: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """Record how a login's holdings import ended"""
+
+        update_job_statement = STATEMENTS.get(
+            key="update_login_job",
+            build=lambda: LOGIN_JOBS.update()
+            .where(LOGIN_JOBS.c.job_id == bindparam("job_id"))
+            .values(
+                status=bindparam("updated_status"),
+                imported_assets=bindparam("updated_imported_assets"),
+                error=bindparam("updated_error"),
+            ),
+        )
+
+        await update_job_statement.execute(
+            self.db,
+            {
+                "job_id": job_id,
+                "updated_status": status.value,
+                "updated_imported_assets": imported_assets,
+                "updated_error": error,
+            },
+        )
+
+    async def fail_stale_login_job(
+        self, job_id: str, started_before: timedelta, error: str
+    ) -> Optional[institutions.LoginJob]:
+        """Mark a login job failed if it is still importing more than started_before
+        after it was created, and return it; None if it is not stale"""
+
+        # Compared against the database's clock, which set created_at
+        fail_job_statement = STATEMENTS.get(
+            key="fail_stale_login_job",
+            build=lambda: LOGIN_JOBS.update()
+            .where(
+                and_(
+                    LOGIN_JOBS.c.job_id == bindparam("job_id"),
+                    LOGIN_JOBS.c.status == institutions.LoginJobStatus.IMPORTING.value,
+                    LOGIN_JOBS.c.created_at
+                    < func.now() - cast(bindparam("started_before"), Interval),
+                )
+            )
+            .values(
+                status=institutions.LoginJobStatus.FAILED.value,
+                error=bindparam("updated_error"),
+            )
+            .returning(LOGIN_JOBS),
+        )
+
+        result = await fail_job_statement.fetch_one(
+            self.db,
+            {
+                "job_id": job_id,
+                "started_before": started_before,
+                "updated_error": error,
+            },
+        )
+        return institutions.LoginJob(**result) if result else None
+
+    async def retrieve_login_job(
+        self, job_id: str, user_id: int
+    ) -> Optional[institutions.LoginJob]:
+        """Retrieve one of a user's login jobs"""
+
+        # Always the primary: clients poll right after the job is created
+        query = STATEMENTS.get(
+            key="retrieve_login_job",
+            build=lambda: LOGIN_JOBS.select().where(
+                and_(
+                    LOGIN_JOBS.c.job_id == bindparam("job_id"),
+                    LOGIN_JOBS.c.user_id == bindparam("user_id"),
+                )
+            ),
+        )
+
+        result = await query.fetch_one(self.db, {"job_id": job_id, "user_id": user_id})
+        return institutions.LoginJob(**result) if result else None
+
+    async def delete_connections_with_assets(
+        self,
+        institution_id: Optional[str] = None,
+        user_ids: Optional[List[int]] = None,
+        batch_size: int = 500,
+    ) -> institutions.ConnectionsTeardown:
+        """Delete the connections matching institution_id and/or user_ids, together with
+        their assets. Each batch of batch_size connections is deleted atomically."""
+
+        filters = {"institution_id": institution_id, "user_ids": user_ids}
+        filters = {name: value for name, value in filters.items() if value}
+
+        if len(filters) == 0:
+            raise Exception(
+                "Please pass a condition parameter to query by to the function, delete_connections_with_assets()"
+            )
+
+        delete_statement = STATEMENTS.get(
+            key=("delete_connections_with_assets", tuple(filters)),
+            build=lambda: build_delete_connections_with_assets_statement(
+                tuple(filters)
+            ),
+        )
+
+        # 1. Keep each batch's ANY(array) bounded too
+        user_id_batches = (
+            [
+                user_ids[batch_start : batch_start + batch_size]
+                for batch_start in range(0, len(user_ids), batch_size)
+            ]
+            if "user_ids" in filters
+            else [None]
+        )
+
+        teardown = institutions.ConnectionsTeardown()
+        for user_id_batch in user_id_batches:
+            values = {**filters, "limit": batch_size}
+            if user_id_batch is not None:
+                values["user_ids"] = user_id_batch
+
+            # 2. Users may have several connections, so repeat until a batch comes up short
+            while True:
+                result = await delete_statement.fetch_one(self.db, values)
+                teardown.deleted_connections += result["deleted_connections"]
+                teardown.deleted_assets += result["deleted_assets"]
+                if result["deleted_connections"] < batch_size:
+                    break
+
+        return teardown
+
+    async def delete(
+        self, connection_id: int
+    ) -> Optional[institutions.InstitutionConnection]:
         """Delete connection"""
 
-        delete_statement = delete(INSTITUTION_CONNECTIONS).where(
-            INSTITUTION_CONNECTIONS.c.connection_id == connection_id
+        delete_statement = STATEMENTS.get(
+            key="delete",
+            build=lambda: delete(INSTITUTION_CONNECTIONS)
+            .where(
+                INSTITUTION_CONNECTIONS.c.connection_id == bindparam("connection_id")
+            )
+            .returning(INSTITUTION_CONNECTIONS),
         )
 
-        await self.db.execute(delete_statement)
+        result = await delete_statement.fetch_one(
+            self.db, {"connection_id": connection_id}
+        )
+        return institutions.InstitutionConnection(**result) if result else None
@@ -1,50 +1,276 @@
-from typing import List, Optional
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
 
+import sqlalchemy as sa
 from databases import Database
-from sqlalchemy import and_, delete, insert
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import (
+    Integer,
+    String,
+    and_,
+    bindparam,
+    cast,
+    delete,
+    exists,
+    func,
+    insert,
+    literal_column,
+    select,
+    true,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 
 from app.infrastructure.db.models.portfolio import ASSETS
+from app.infrastructure.db.statement_cache import (
+    StatementCache,
+    execute_from_staging_table,
+)
 from app.usecases.interfaces.repos.portfolio_repo import IPortfolioRepo
 from app.usecases.schemas import portfolios
 
+# Statements are compiled once per query shape and reused by every PortfolioRepo
+STATEMENTS = StatementCache(name="portfolio_repo")
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_PAYLOAD_BYTES = 7999
+
+ASSET_COLUMNS = (
+    "user_id",
+    "institution_id",
+    "thesis_id",
+    "asset_symbol",
+    "name",
+    "position_value",
+    "quantity",
+    "skin_rating",
+    "average_buy_price",
+    "total_contribution",
+)
+
+# Temporary table that large batches are binary COPY'd into before upserting
+ASSET_UPSERTS = sa.table("asset_upserts", *[sa.column(name) for name in ASSET_COLUMNS])
+
+ASSET_UPSERT_SET_COLUMNS = (
+    "position_value",
+    "quantity",
+    "average_buy_price",
+    "total_contribution",
+)
+
+
+def build_upsert_asset_statement():
+    asset_insert_statement = insert(ASSETS).values(
+        is_up_to_date=True,
+        **{name: bindparam(f"new_{name}") for name in ASSET_COLUMNS},
+    )
+
+    return asset_insert_statement.on_conflict_do_update(
+        index_elements=[
+            ASSETS.c.user_id,
+            ASSETS.c.asset_symbol,
+            ASSETS.c.institution_id,
+        ],
+        set_={
+            column_name: bindparam(f"new_{column_name}")
+            for column_name in ASSET_UPSERT_SET_COLUMNS
+        },
+    ).returning(ASSETS)
+
+
+def build_upsert_staged_assets_statement():
+    staged_assets = select(
+        [*[ASSET_UPSERTS.c[name] for name in ASSET_COLUMNS], true()]
+    ).select_from(ASSET_UPSERTS)
+
+    return (
+        insert(ASSETS)
+        .from_select([*ASSET_COLUMNS, "is_up_to_date"], staged_assets)
+        .on_conflict_do_update(
+            index_elements=[
+                ASSETS.c.user_id,
+                ASSETS.c.asset_symbol,
+                ASSETS.c.institution_id,
+            ],
+            set_={
+                column_name: literal_column(f"excluded.{column_name}")
+                for column_name in ASSET_UPSERT_SET_COLUMNS
+            },
+        )
+    )
+
+
+def build_delete_unstaged_assets_statement():
+    brokerages = (
+        func.unnest(
+            cast(bindparam("user_ids"), ARRAY(Integer)),
+            cast(bindparam("institution_ids"), ARRAY(String)),
+        )
+        .table_valued("user_id", "institution_id")
+        .render_derived(name="brokerages")
+    )
+
+    return delete(ASSETS).where(
+        and_(
+            ASSETS.c.user_id == brokerages.c.user_id,
+            ASSETS.c.institution_id == brokerages.c.institution_id,
+            ~exists().where(
+                and_(
+                    ASSET_UPSERTS.c.user_id == ASSETS.c.user_id,
+                    ASSET_UPSERTS.c.institution_id == ASSETS.c.institution_id,
+                    ASSET_UPSERTS.c.asset_symbol == ASSETS.c.asset_symbol,
+                )
+            ),
+        )
+    )
+
 
 class PortfolioRepo(IPortfolioRepo):
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, replica_db: Optional[Database] = None):
         self.db = db
+        # Read-only queries go to the replica unless the caller passes use_primary
+        self.replica_db = replica_db or db
 
-    async def upsert_asset(self, new_asset: portfolios.UpsertAssetRepoAdapter) -> None:
+    async def upsert_asset(
+        self, new_asset: portfolios.UpsertAssetRepoAdapter
+    ) -> portfolios.AssetInDB:
         """Creates or updates new asset"""
 
-        asset_insert_statement = insert(ASSETS).values(
-            user_id=new_asset.user_id,
-            institution_id=new_asset.institution_id,
-            thesis_id=new_asset.thesis_id,
-            asset_symbol=new_asset.asset_symbol,
-            name=new_asset.name,
-            position_value=new_asset.position_value,
-            quantity=new_asset.quantity,
-            skin_rating=new_asset.skin_rating,
-            average_buy_price=new_asset.average_buy_price,
-            total_contribution=new_asset.total_contribution,
-            is_up_to_date=True,
-        )
-
-        upsert_stmt = asset_insert_statement.on_conflict_do_update(
-            index_elements=[
-                ASSETS.c.user_id,
-                ASSETS.c.asset_symbol,
-                ASSETS.c.institution_id,
+        upsert_stmt = STATEMENTS.get(
+            key="upsert_asset", build=build_upsert_asset_statement
+        )
+
+        result = await upsert_stmt.fetch_one(
+            self.db,
+            {
+                f"new_{column}": value
+                for column, value in new_asset.dict(include=set(ASSET_COLUMNS)).items()
+            },
+        )
+        return portfolios.AssetInDB(**result)
+
+    async def upsert_many_assets(
+        self,
+        new_assets: List[portfolios.UpsertAssetRepoAdapter],
+        copy_threshold: int = 1000,
+    ) -> None:
+        """Creates or updates many assets. Batches smaller than copy_threshold are sent
+        with executemany(); larger ones are binary COPY'd into a staging table first."""
+
+        # 1. One row per (user_id, asset_symbol, institution_id), or ON CONFLICT would touch a row twice
+        unique_assets = {
+            (asset.user_id, asset.asset_symbol, asset.institution_id): asset.dict(
+                include=set(ASSET_COLUMNS)
+            )
+            for asset in new_assets
+        }
+
+        if not unique_assets:
+            return
+
+        # 2. Small batches reuse the single-row upsert statement
+        if len(unique_assets) < copy_threshold:
+            upsert_stmt = STATEMENTS.get(
+                key="upsert_asset", build=build_upsert_asset_statement
+            )
+            await upsert_stmt.execute_many(
+                self.db,
+                [
+                    {f"new_{name}": value for name, value in asset.items()}
+                    for asset in unique_assets.values()
+                ],
+            )
+            return
+
+        # 3. Large batches are staged with COPY and upserted in one statement
+        upsert_staged_stmt = STATEMENTS.get(
+            key="upsert_staged_assets", build=build_upsert_staged_assets_statement
+        )
+        await execute_from_staging_table(
+            db=self.db,
+            staging_table_name=ASSET_UPSERTS.name,
+            like_table=ASSETS,
+            columns=ASSET_COLUMNS,
+            records=[
+                tuple(asset[name] for name in ASSET_COLUMNS)
+                for asset in unique_assets.values()
+            ],
+            statements=[(upsert_staged_stmt, None)],
+        )
+
+    async def replace_brokerage_assets(
+        self,
+        users_institutions: List[portfolios.UsersInstitutionRepoAdapter],
+        new_assets: List[portfolios.UpsertAssetRepoAdapter],
+    ) -> None:
+        """Make new_assets the complete holdings of each of users_institutions. Assets are
+        binary COPY'd into a staging table, then merged in two set-based statements."""
+
+        if not users_institutions:
+            return
+
+        unique_assets = {
+            (asset.user_id, asset.asset_symbol, asset.institution_id): asset.dict(
+                include=set(ASSET_COLUMNS)
+            )
+            for asset in new_assets
+        }
+
+        delete_unstaged_stmt = STATEMENTS.get(
+            key="delete_unstaged_assets", build=build_delete_unstaged_assets_statement
+        )
+        upsert_staged_stmt = STATEMENTS.get(
+            key="upsert_staged_assets", build=build_upsert_staged_assets_statement
+        )
+
+        # 1. Delete holdings the brokerages no longer report, then 2. upsert the rest
+        await execute_from_staging_table(
+            db=self.db,
+            staging_table_name=ASSET_UPSERTS.name,
+            like_table=ASSETS,
+            columns=ASSET_COLUMNS,
+            records=[
+                tuple(asset[name] for name in ASSET_COLUMNS)
+                for asset in unique_assets.values()
+            ],
+            statements=[
+                (
+                    delete_unstaged_stmt,
+                    {
+                        "user_ids": [
+                            users_institution.user_id
+                            for users_institution in users_institutions
+                        ],
+                        "institution_ids": [
+                            users_institution.institution_id
+                            for users_institution in users_institutions
+                        ],
+                    },
+                ),
+                (upsert_staged_stmt, None),
             ],
-            set_=dict(
-                position_value=new_asset.position_value,
-                quantity=new_asset.quantity,
-                average_buy_price=new_asset.average_buy_price,
-                total_contribution=new_asset.total_contribution,
-            ),
         )
 
-        await self.db.execute(upsert_stmt)
+    async def publish_portfolio_change(
+        self, portfolio_change: portfolios.PortfolioChange, channel: str
+    ) -> None:
+        """NOTIFY listeners on channel that a user's holdings changed"""
+
+        payload = portfolio_change.json()
+
+        # 1. Too many symbols for one notification, so tell listeners to re-read everything
+        if len(payload.encode()) > MAX_NOTIFY_PAYLOAD_BYTES:
+            payload = portfolios.PortfolioChange(
+                user_id=portfolio_change.user_id,
+                institution_id=portfolio_change.institution_id,
+                truncated=True,
+            ).json()
+
+        notify_stmt = STATEMENTS.get(
+            key="publish_portfolio_change",
+            build=lambda: select(
+                [func.pg_notify(bindparam("channel"), bindparam("payload"))]
+            ),
+        )
+        await notify_stmt.fetch_val(self.db, {"channel": channel, "payload": payload})
 
     async def update_asset(
         self,
@@ -52,20 +278,12 @@ class PortfolioRepo(IPortfolioRepo):
         asset_symbol: str,
         institution_id: int,
         updated_asset: portfolios.UpdateAssetRepoAdapter,
-    ) -> None:
+    ) -> Optional[portfolios.AssetInDB]:
         """
         Update an individual asset holding by the composite index, (user_id,
         asset_symbol, and institution_id)
         """
 
-        conditions = [
-            ASSETS.c.user_id == user_id,
-            ASSETS.c.asset_symbol == asset_symbol,
-            ASSETS.c.institution_id == institution_id,
-        ]
-
-        query = ASSETS.update()
-
         updated_asset_raw = updated_asset.dict()
         update_asset_dict = {}
 
@@ -73,11 +291,35 @@ class PortfolioRepo(IPortfolioRepo):
             if value is not None:
                 update_asset_dict[key] = value
 
-        query = query.values(update_asset_dict)
-
-        asset_update_statemnent = query.where(and_(*conditions))
+        asset_update_statemnent = STATEMENTS.get(
+            key=("update_asset", tuple(update_asset_dict)),
+            build=lambda: ASSETS.update()
+            .values(
+                {column: bindparam(f"updated_{column}") for column in update_asset_dict}
+            )
+            .where(
+                and_(
+                    ASSETS.c.user_id == bindparam("user_id"),
+                    ASSETS.c.asset_symbol == bindparam("asset_symbol"),
+                    ASSETS.c.institution_id == bindparam("institution_id"),
+                )
+            )
+            .returning(ASSETS),
+        )
 
-        await self.db.execute(asset_update_statemnent)
+        result = await asset_update_statemnent.fetch_one(
+            self.db,
+            {
+                "user_id": user_id,
+                "asset_symbol": asset_symbol,
+                "institution_id": institution_id,
+                **{
+                    f"updated_{column}": value
+                    for column, value in update_asset_dict.items()
+                },
+            },
+        )
+        return portfolios.AssetInDB(**result) if result else None
 
     async def retrieve_asset(
         self,
@@ -85,72 +327,109 @@ class PortfolioRepo(IPortfolioRepo):
         user_id: int = None,
         institution_id: str = None,
         asset_symbol: str = None,
+        use_primary: bool = False,
     ) -> Optional[portfolios.AssetInDB]:
         """Retrieve signle asset"""
         # TODO: Might not need this function... It's here just in case
 
-        conditions = []
-
-        if asset_id:
-            conditions.append(ASSETS.c.asset_id == asset_id)
-
-        if user_id:
-            conditions.append(ASSETS.c.user_id == user_id)
-
-        if asset_symbol:
-            conditions.append(ASSETS.c.asset_symbol == asset_symbol)
-
-        if institution_id:
-            conditions.append(ASSETS.c.institution_id == institution_id)
+        filters = {
+            "asset_id": asset_id,
+            "user_id": user_id,
+            "asset_symbol": asset_symbol,
+            "institution_id": institution_id,
+        }
+        filters = {column: value for column, value in filters.items() if value}
 
-        if len(conditions) == 0:
+        if len(filters) == 0:
             raise Exception(
                 "Please pass a condition parameter to query by to the function, retrieve_asset()"
             )
 
-        query = ASSETS.select().where(and_(*conditions))
-        result = await self.db.fetch_one(query)
+        query = STATEMENTS.get(
+            key=("retrieve_asset", tuple(filters)),
+            build=lambda: ASSETS.select().where(
+                and_(*[ASSETS.c[column] == bindparam(column) for column in filters])
+            ),
+        )
+        result = await query.fetch_one(
+            self.db if use_primary else self.replica_db, filters
+        )
         return portfolios.AssetInDB(**result) if result else None
 
     async def retrieve_brokerage_assets(
         self,
         user_id: int,
         institution_id: str,
+        use_primary: bool = False,
     ) -> List[portfolios.AssetInDB]:
         """Retrieve all assets in a linked brokerage by user_id"""
 
-        conditions = []
-
-        if user_id:
-            conditions.append(ASSETS.c.user_id == user_id)
-
-        if institution_id:
-            conditions.append(ASSETS.c.institution_id == institution_id)
+        filters = {"user_id": user_id, "institution_id": institution_id}
+        filters = {column: value for column, value in filters.items() if value}
 
-        query = ASSETS.select().where(and_(*conditions))
-        results = await self.db.fetch_all(query)
+        query = STATEMENTS.get(
+            key=("retrieve_brokerage_assets", tuple(filters)),
+            build=lambda: ASSETS.select().where(
+                and_(*[ASSETS.c[column] == bindparam(column) for column in filters])
+            ),
+        )
+        results = await query.fetch_all(
+            self.db if use_primary else self.replica_db, filters
+        )
         return [portfolios.AssetInDB(**result) for result in results]
 
+    async def stream_assets(
+        self,
+        institution_id: Optional[str] = None,
+        updated_since: Optional[datetime] = None,
+        prefetch: int = 1000,
+    ) -> AsyncIterator[portfolios.AssetInDB]:
+        """Yield every asset, optionally only one institution's or only those updated
+        at or after updated_since, in asset_id order, fetching prefetch at a time"""
+
+        filters = {"institution_id": institution_id, "updated_since": updated_since}
+        filters = {name: value for name, value in filters.items() if value}
+
+        def build():
+            conditions = []
+            if "institution_id" in filters:
+                conditions.append(
+                    ASSETS.c.institution_id == bindparam("institution_id")
+                )
+            if "updated_since" in filters:
+                conditions.append(ASSETS.c.updated_at >= bindparam("updated_since"))
+
+            query = ASSETS.select().order_by(ASSETS.c.asset_id)
+            return query.where(and_(*conditions)) if conditions else query
+
+        query = STATEMENTS.get(key=("stream_assets", tuple(filters)), build=build)
+
+        # Exports are read from the replica, through a server-side cursor
+        async for result in query.iterate(self.replica_db, filters, prefetch=prefetch):
+            yield portfolios.AssetInDB(**result)
+
     async def delete(
         self,
         asset_id: Optional[int] = None,
         users_institution: Optional[portfolios.UsersInstitutionRepoAdapter] = None,
-    ) -> None:
+    ) -> List[portfolios.AssetInDB]:
         """Delete asset(s)"""
 
-        conditions = []
+        filters = {}
 
         if asset_id:
-            conditions.append(ASSETS.c.asset_id == asset_id)
+            filters["asset_id"] = asset_id
 
         if users_institution:
-            conditions.extend(
-                [
-                    ASSETS.c.user_id == users_institution.user_id,
-                    ASSETS.c.institution_id == users_institution.institution_id,
-                ]
-            )
-
-        delete_statement = delete(ASSETS).where(and_(*conditions))
+            filters["user_id"] = users_institution.user_id
+            filters["institution_id"] = users_institution.institution_id
+
+        delete_statement = STATEMENTS.get(
+            key=("delete", tuple(filters)),
+            build=lambda: delete(ASSETS)
+            .where(and_(*[ASSETS.c[column] == bindparam(column) for column in filters]))
+            .returning(ASSETS),
+        )
 
-        await self.db.execute(delete_statement)
+        results = await delete_statement.fetch_all(self.db, filters)
+        return [portfolios.AssetInDB(**result) for result in results]
@@ -0,0 +1,93 @@
+from datetime import datetime
+from typing import Optional
+
+from databases import Database
+from sqlalchemy import bindparam, desc
+
+from app.infrastructure.db.models.sync_runs import SYNC_RUNS
+from app.infrastructure.db.statement_cache import StatementCache
+from app.usecases.interfaces.repos.sync_run_repo import ISyncRunRepo
+from app.usecases.schemas import sync_runs
+
+# Statements are compiled once per query shape and reused by every SyncRunRepo
+STATEMENTS = StatementCache(name="sync_run_repo")
+
+
+class SyncRunRepo(ISyncRunRepo):
+    def __init__(self, db: Database):
+        # Runs are read back right after being written, so everything uses the primary
+        self.db = db
+
+    async def create(self, task_name: str) -> sync_runs.SyncRun:
+        """Start a new run of task_name"""
+
+        create_statement = STATEMENTS.get(
+            key="create",
+            build=lambda: SYNC_RUNS.insert()
+            .values(task_name=bindparam("new_task_name"))
+            .returning(SYNC_RUNS),
+        )
+
+        result = await create_statement.fetch_one(self.db, {"new_task_name": task_name})
+        return sync_runs.SyncRun(**result)
+
+    async def retrieve_latest_run(self, task_name: str) -> Optional[sync_runs.SyncRun]:
+        """Retrieve task_name's most recent run, finished or not"""
+
+        query = STATEMENTS.get(
+            key="retrieve_latest_run",
+            build=lambda: SYNC_RUNS.select()
+            .where(SYNC_RUNS.c.task_name == bindparam("task_name"))
+            .order_by(desc(SYNC_RUNS.c.created_at))
+            .limit(1),
+        )
+
+        result = await query.fetch_one(self.db, {"task_name": task_name})
+        return sync_runs.SyncRun(**result) if result else None
+
+    async def checkpoint(
+        self, run_id: int, last_connection_id: int, processed_connections: int
+    ) -> None:
+        """Save how far a run has got"""
+
+        checkpoint_statement = STATEMENTS.get(
+            key="checkpoint",
+            build=lambda: SYNC_RUNS.update()
+            .where(SYNC_RUNS.c.run_id == bindparam("run_id"))
+            .values(
+                last_connection_id=bindparam("updated_last_connection_id"),
+                processed_connections=bindparam("updated_processed_connections"),
+            ),
+        )
+
+        await checkpoint_statement.execute(
+            self.db,
+            {
+                "run_id": run_id,
+                "updated_last_connection_id": last_connection_id,
+                "updated_processed_connections": processed_connections,
+            },
+        )
+
+    async def complete(self, run_id: int, processed_connections: int) -> None:
+        """Mark a run as finished"""
+
+        complete_statement = STATEMENTS.get(
+            key="complete",
+            build=lambda: SYNC_RUNS.update()
+            .where(SYNC_RUNS.c.run_id == bindparam("run_id"))
+            .values(
+                processed_connections=bindparam("updated_processed_connections"),
+                completed_at=bindparam("updated_completed_at"),
+            ),
+        )
+
+        # UTC from here, like every other timestamp the tasks compare against
+        await complete_statement.execute(
+            self.db,
+            {
+                "run_id": run_id,
+                "updated_processed_connections": processed_connections,
+                "updated_completed_at": datetime.utcnow(),
+            },
+        )
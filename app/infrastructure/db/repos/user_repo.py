@@ -1,42 +1,48 @@
 from typing import Optional
 
 from databases import Database
-from sqlalchemy import and_
+from sqlalchemy import and_, bindparam
 
 from app.infrastructure.db.models.users import USERS
+from app.infrastructure.db.statement_cache import StatementCache
 from app.usecases.interfaces.user_repo import IUserRepo
 from app.usecases.schemas import users
 
+# Statements are compiled once per query shape and reused by every UsersRepo
+STATEMENTS = StatementCache(name="user_repo")
+
 
 class UsersRepo(IUserRepo):
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, replica_db: Optional[Database] = None):
         self.db = db
+        # Read-only queries go to the replica unless the caller passes use_primary
+        self.replica_db = replica_db or db
 
     async def retrieve_user_with_filter(
         self,
         user_id: str = None,
         email: str = None,
         username: str = None,
+        use_primary: bool = False,
     ) -> Optional[users.UserInDB]:
         """Retrieves user from database"""
 
-        conditions = []
-
-        if user_id:
-            conditions.append(USERS.c.user_id == user_id)
-
-        if email:
-            conditions.append(USERS.c.email == email)
-
-        if username:
-            conditions.append(USERS.c.username == username)
+        filters = {"user_id": user_id, "email": email, "username": username}
+        filters = {column: value for column, value in filters.items() if value}
 
-        if len(conditions) == 0:
+        if len(filters) == 0:
             raise Exception(
                 "Please pass a parameter to query by to the function, retrieve_user_with_filter()"
             )
 
-        query = USERS.select().where(and_(*conditions))
+        query = STATEMENTS.get(
+            key=("retrieve_user_with_filter", tuple(filters)),
+            build=lambda: USERS.select().where(
+                and_(*[USERS.c[column] == bindparam(column) for column in filters])
+            ),
+        )
 
-        result = await self.db.fetch_one(query)
+        result = await query.fetch_one(
+            self.db if use_primary else self.replica_db, filters
+        )
         return users.UserInDB(**result) if result else None
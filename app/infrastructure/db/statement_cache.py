@@ -0,0 +1,281 @@
+import logging
+from time import perf_counter
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from databases import Database
+from sqlalchemy import Table
+from sqlalchemy.dialects.postgresql import pypostgresql
+from sqlalchemy.engine.interfaces import Dialect
+from sqlalchemy.sql import ClauseElement
+
+from app.libraries.metrics import METRICS, ROWS_BUCKETS
+from app.settings import settings
+
+# app.dependencies imports the repos, which import this module, so the app's logger
+# is looked up by name rather than imported from there
+logger = logging.getLogger(settings.application_name)
+
+QUERY_DURATION = METRICS.histogram(
+    "db_query_duration_seconds",
+    "How long each repo query spent waiting on Postgres.",
+    label_names=("query",),
+)
+QUERY_ROWS = METRICS.histogram(
+    "db_query_rows",
+    "How many rows each repo query returned or changed.",
+    buckets=ROWS_BUCKETS,
+    label_names=("query",),
+)
+
+
+def get_postgres_dialect() -> Dialect:
+    """The dialect the databases asyncpg backend compiles queries with"""
+
+    dialect = pypostgresql.dialect(paramstyle="pyformat")
+
+    dialect.implicit_returning = True
+    dialect.supports_native_enum = True
+    dialect.supports_smallserial = True
+    dialect._backslash_escapes = False  # pylint: disable = protected-access
+    dialect.supports_sane_multi_rowcount = True
+    dialect._has_native_hstore = True  # pylint: disable = protected-access
+    dialect.supports_native_decimal = True
+
+    return dialect
+
+
+def record_query(name: str, duration: float, rows: Optional[int]) -> None:
+    """Add a query's latency and rows to the metrics, and log it if it was slow"""
+
+    QUERY_DURATION.observe(duration, query=name)
+    if rows is not None:
+        QUERY_ROWS.observe(rows, query=name)
+
+    if duration >= settings.db_slow_query_threshold:
+        logger.warning(
+            "[StatementCache]: Slow query took %.3f seconds. Detail: query: %s, rows: %s"
+            % (duration, name, rows)
+        )
+
+
+def get_status_rows(status: str) -> Optional[int]:
+    """Rows changed, from an asyncpg command status such as "UPDATE 12" """
+
+    count = status.rsplit(" ", 1)[-1]
+    return int(count) if count.isdigit() else None
+
+
+class CompiledStatement:
+    """A SQLAlchemy Core statement compiled to asyncpg SQL once. Values bound when
+    the statement was built are reused; bindparams left empty are supplied per call.
+    Every call is timed under name in the query metrics."""
+
+    def __init__(self, statement: ClauseElement, dialect: Dialect, name: str = ""):
+        self.name = name
+        compiled = statement.compile(
+            dialect=dialect, compile_kwargs={"render_postcompile": True}
+        )
+
+        self.parameter_names = sorted(compiled.params)
+        self.sql = compiled.string % {
+            name: f"${position}"
+            for position, name in enumerate(self.parameter_names, start=1)
+        }
+        self._bound_values = compiled.params
+        self._bind_processors = (
+            compiled._bind_processors  # pylint: disable = protected-access
+        )
+
+    def arguments(self, values: Optional[Mapping[str, Any]] = None) -> List[Any]:
+        """Positional asyncpg arguments for this call"""
+
+        values = {**self._bound_values, **values} if values else self._bound_values
+        arguments = []
+        for name in self.parameter_names:
+            value = values[name]
+            processor = self._bind_processors.get(name)
+            arguments.append(processor(value) if processor else value)
+        return arguments
+
+    async def fetch_one(
+        self, db: Database, values: Optional[Mapping[str, Any]] = None
+    ) -> Optional[Mapping[str, Any]]:
+        async with db.connection() as connection:
+            async with connection._query_lock:  # pylint: disable = protected-access
+                started_at = perf_counter()
+                row = await connection.raw_connection.fetchrow(
+                    self.sql, *self.arguments(values)
+                )
+                record_query(
+                    self.name, perf_counter() - started_at, int(row is not None)
+                )
+                return row
+
+    async def fetch_all(
+        self, db: Database, values: Optional[Mapping[str, Any]] = None
+    ) -> List[Mapping[str, Any]]:
+        async with db.connection() as connection:
+            async with connection._query_lock:  # pylint: disable = protected-access
+                started_at = perf_counter()
+                rows = await connection.raw_connection.fetch(
+                    self.sql, *self.arguments(values)
+                )
+                record_query(self.name, perf_counter() - started_at, len(rows))
+                return rows
+
+    async def fetch_val(
+        self, db: Database, values: Optional[Mapping[str, Any]] = None
+    ) -> Any:
+        async with db.connection() as connection:
+            async with connection._query_lock:  # pylint: disable = protected-access
+                started_at = perf_counter()
+                value = await connection.raw_connection.fetchval(
+                    self.sql, *self.arguments(values)
+                )
+                record_query(self.name, perf_counter() - started_at, None)
+                return value
+
+    async def iterate(
+        self,
+        db: Database,
+        values: Optional[Mapping[str, Any]] = None,
+        prefetch: int = 1000,
+    ) -> AsyncIterator[Mapping[str, Any]]:
+        """Yield rows from a server-side cursor, prefetch rows per round trip, inside
+        one read-only, repeatable-read transaction so every row comes from one snapshot.
+        Only time spent waiting on the cursor is recorded, not time spent by the caller."""
+
+        duration, rows = 0.0, 0
+        async with db.connection() as connection:
+            async with connection._query_lock:  # pylint: disable = protected-access
+                raw_connection = connection.raw_connection
+                async with raw_connection.transaction(
+                    isolation="repeatable_read", readonly=True
+                ):
+                    cursor = raw_connection.cursor(
+                        self.sql, *self.arguments(values), prefetch=prefetch
+                    ).__aiter__()
+                    try:
+                        while True:
+                            started_at = perf_counter()
+                            try:
+                                row = await cursor.__anext__()
+                            except StopAsyncIteration:
+                                break
+                            finally:
+                                duration += perf_counter() - started_at
+                            rows += 1
+                            yield row
+                    finally:
+                        record_query(self.name, duration, rows)
+
+    async def execute(
+        self, db: Database, values: Optional[Mapping[str, Any]] = None
+    ) -> None:
+        async with db.connection() as connection:
+            async with connection._query_lock:  # pylint: disable = protected-access
+                started_at = perf_counter()
+                status = await connection.raw_connection.execute(
+                    self.sql, *self.arguments(values)
+                )
+                record_query(
+                    self.name, perf_counter() - started_at, get_status_rows(status)
+                )
+
+    async def execute_many(
+        self, db: Database, values_list: Sequence[Mapping[str, Any]]
+    ) -> None:
+        """Run the statement once per values mapping in a single asyncpg executemany()"""
+
+        async with db.connection() as connection:
+            async with connection._query_lock:  # pylint: disable = protected-access
+                started_at = perf_counter()
+                await connection.raw_connection.executemany(
+                    self.sql, [self.arguments(values) for values in values_list]
+                )
+                record_query(self.name, perf_counter() - started_at, len(values_list))
+
+
+async def execute_from_staging_table(
+    db: Database,
+    staging_table_name: str,
+    like_table: Table,
+    columns: Sequence[str],
+    records: Iterable[Tuple[Any, ...]],
+    statements: Sequence[Tuple[CompiledStatement, Optional[Mapping[str, Any]]]],
+) -> None:
+    """Binary COPY records into a temporary table holding like_table's columns (with
+    their types, but none of its constraints), then run each (statement, values) pair,
+    in order, in the same transaction. The statements read from the temporary table.
+    The COPY is timed as "copy:<staging_table_name>"."""
+
+    async with db.connection() as connection:
+        async with connection._query_lock:  # pylint: disable = protected-access
+            raw_connection = connection.raw_connection
+            async with raw_connection.transaction():
+                # Only the copied columns: NOT NULL columns left out of records would
+                # reject every row, and the target table enforces its constraints anyway
+                await raw_connection.execute(
+                    f"CREATE TEMPORARY TABLE {staging_table_name} ON COMMIT DROP AS "
+                    f"SELECT {', '.join(columns)} FROM {like_table.fullname} WITH NO DATA"
+                )
+                started_at = perf_counter()
+                copy_status = await raw_connection.copy_records_to_table(
+                    staging_table_name, records=records, columns=list(columns)
+                )
+                record_query(
+                    f"copy:{staging_table_name}",
+                    perf_counter() - started_at,
+                    get_status_rows(copy_status),
+                )
+                for statement, values in statements:
+                    started_at = perf_counter()
+                    status = await raw_connection.execute(
+                        statement.sql, *statement.arguments(values)
+                    )
+                    record_query(
+                        statement.name,
+                        perf_counter() - started_at,
+                        get_status_rows(status),
+                    )
+
+
+class StatementCache:
+    """Compiled statements keyed by query shape. A shape is whatever decides the
+    SQL text (which filters or columns are present), never the values themselves.
+    asyncpg in turn keeps each connection's prepared statement for that SQL text."""
+
+    def __init__(self, name: str = ""):
+        # Prefixes the query names the statements are timed under, e.g. "institution_repo"
+        self.name = name
+        self._dialect = get_postgres_dialect()
+        self._statements: Dict[Hashable, CompiledStatement] = {}
+
+    def get(
+        self, key: Hashable, build: Callable[[], ClauseElement]
+    ) -> CompiledStatement:
+        """Return the compiled statement for key, building and compiling it on first use"""
+
+        statement = self._statements.get(key)
+        if statement is None:
+            # Every shape of one query is timed under the same name
+            query_name = key[0] if isinstance(key, tuple) else key
+            statement = CompiledStatement(
+                statement=build(),
+                dialect=self._dialect,
+                name=f"{self.name}.{query_name}" if self.name else str(query_name),
+            )
+            self._statements[key] = statement
+        return statement
@@ -0,0 +1,165 @@
+import asyncio
+from time import time
+from typing import List, Optional
+
+from databases import Database
+
+from app.dependencies import logger
+from app.usecases.interfaces.repos.institution_repo import IInstitutionRepo
+from app.usecases.interfaces.repos.portfolio_repo import IPortfolioRepo
+from app.usecases.interfaces.services.institution_service import IInstitutionService
+from app.usecases.schemas import institutions, portfolios
+
+
+class BackfillAssetsTask:
+    def __init__(
+        self,
+        db: Database,
+        institution_repo: IInstitutionRepo,
+        portfolio_repo: IPortfolioRepo,
+        institution_services: List[IInstitutionService],
+        batch_size: int = 500,
+        concurrency: int = 10,
+    ):
+        self.db = db
+        self._institution_repo = institution_repo
+        self._portfolio_repo = portfolio_repo
+        self.institution_services = institution_services
+        # Connections whose holdings are merged into assets together
+        self.batch_size = batch_size
+        # Brokerage requests in flight at once
+        self.concurrency = concurrency
+
+    async def task(self):
+        """Re-seed assets for every active connection from its brokerage."""
+
+        logger.info("[BackfillAssetsTask]: Beginning assets backfill.")
+        task_start_time = time()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        backfilled_connections = 0
+        skipped_connections = 0
+        batch: List[institutions.ConnectionJoinInstitutionJoinPortfolio] = []
+
+        # 1. Stream active connections and backfill them a batch at a time
+        async for account_connection in self._institution_repo.stream_institution_connections(
+            query_params=institutions.RetrieveManyConnectionsRepoAdapter(
+                is_active=True
+            ),
+            page_size=self.batch_size,
+        ):
+            batch.append(account_connection)
+            if len(batch) < self.batch_size:
+                continue
+
+            backfilled = await self.backfill_batch(batch=batch, semaphore=semaphore)
+            backfilled_connections += backfilled
+            skipped_connections += len(batch) - backfilled
+            batch = []
+
+        if batch:
+            backfilled = await self.backfill_batch(batch=batch, semaphore=semaphore)
+            backfilled_connections += backfilled
+            skipped_connections += len(batch) - backfilled
+
+        task_end_time = time()
+
+        logger.info(
+            "[BackfillAssetsTask]: Backfilled %s account connections (%s skipped) in %s seconds."
+            % (
+                backfilled_connections,
+                skipped_connections,
+                task_end_time - task_start_time,
+            )
+        )
+
+    async def backfill_batch(
+        self,
+        batch: List[institutions.ConnectionJoinInstitutionJoinPortfolio],
+        semaphore: asyncio.Semaphore,
+    ) -> int:
+        """Fetch holdings for a batch of connections and merge them into assets.
+        Returns how many connections were backfilled."""
+
+        # 1. Get each user's holdings from their brokerage, a bounded number at a time
+        brokerage_portfolios = await asyncio.gather(
+            *[
+                self.get_recent_holdings(
+                    account_connection=account_connection, semaphore=semaphore
+                )
+                for account_connection in batch
+            ]
+        )
+
+        users_institutions = []
+        new_assets = []
+        for account_connection, brokerage_portfolio in zip(batch, brokerage_portfolios):
+            if not brokerage_portfolio:
+                continue
+
+            users_institutions.append(
+                portfolios.UsersInstitutionRepoAdapter(
+                    user_id=account_connection.user_id,
+                    institution_id=account_connection.institution_id,
+                )
+            )
+            new_assets.extend(
+                portfolios.UpsertAssetRepoAdapter(
+                    average_buy_price=asset.average_buy_price
+                    if asset.average_buy_price
+                    else None,
+                    user_id=account_connection.user_id,
+                    institution_id=account_connection.institution_id,
+                    name=asset.asset_name,
+                    asset_symbol=asset.asset_symbol,
+                    quantity=asset.quantity,
+                )
+                for asset in brokerage_portfolio.holdings
+            )
+
+        # 2. COPY the batch's holdings into a staging table and merge them in one transaction
+        await self._portfolio_repo.replace_brokerage_assets(
+            users_institutions=users_institutions, new_assets=new_assets
+        )
+
+        logger.info(
+            "[BackfillAssetsTask]: Merged %s assets for %s account connections."
+            % (len(new_assets), len(users_institutions))
+        )
+        return len(users_institutions)
+
+    async def get_recent_holdings(
+        self,
+        account_connection: institutions.ConnectionJoinInstitutionJoinPortfolio,
+        semaphore: asyncio.Semaphore,
+    ) -> Optional[institutions.UserBrokerageHoldings]:
+        """Get a connection's holdings, or None if the brokerage could not be read"""
+
+        service = next(
+            (
+                service
+                for service in self.institution_services
+                if service.institution_name == account_connection.name
+            ),
+            None,
+        )
+
+        async with semaphore:
+            try:
+                return await service.get_recent_holdings(
+                    encrypted_json_web_token=account_connection.json_web_token
+                )
+            except institutions.UnauthorizedException:
+                # Deactivation is left to GetHoldingsTask; the backfill only skips the connection
+                logger.warning(
+                    "[BackfillAssetsTask]: Received a 401 Unauthorized when attempting to get holdings. Detail: connection_id: %s"
+                    % account_connection.connection_id
+                )
+            except (
+                institutions.InstitutionApiError,
+                institutions.InstitutionException,
+            ):
+                logger.warning(
+                    "[BackfillAssetsTask]: Could not get holdings. Detail: connection_id: %s"
+                    % account_connection.connection_id
+                )
+            return None
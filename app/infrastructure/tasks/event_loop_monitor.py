@@ -0,0 +1,71 @@
+import asyncio
+import sys
+import threading
+import traceback
+from time import monotonic
+
+from app.dependencies import logger
+from app.libraries.metrics import METRICS
+
+EVENT_LOOP_LAG = METRICS.summary(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a callback scheduled by the lag monitor.",
+)
+EVENT_LOOP_BLOCKS = METRICS.counter(
+    "event_loop_blocked_total",
+    "How many times the event loop was blocked for longer than the block threshold.",
+)
+
+
+class EventLoopMonitor:
+    def __init__(self, interval: float = 0.1, block_threshold: float = 0.25):
+        # How often the loop's scheduling delay is sampled
+        self.interval = interval
+        # A stall longer than this logs the stack of whatever is holding the loop
+        self.block_threshold = block_threshold
+        self.last_tick = monotonic()
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+
+    async def start_task(self):
+        self._loop_thread_id = threading.get_ident()
+        self.last_tick = monotonic()
+        self._stopped.clear()
+
+        # 1. The watchdog runs on its own thread, so it can see the loop while it is stuck
+        threading.Thread(
+            target=self.watch, name="event-loop-watchdog", daemon=True
+        ).start()
+
+        # 2. Measure how late each sleep wakes up
+        try:
+            while True:
+                expected_at = monotonic() + self.interval
+                await asyncio.sleep(self.interval)
+                self.last_tick = monotonic()
+                EVENT_LOOP_LAG.observe(max(self.last_tick - expected_at, 0))
+        finally:
+            self._stopped.set()
+
+    def watch(self):
+        """Log the loop thread's stack once per stall longer than block_threshold"""
+
+        reported_tick = None
+        while not self._stopped.wait(self.block_threshold / 2):
+            last_tick = self.last_tick
+            blocked_for = monotonic() - last_tick - self.interval
+            if blocked_for < self.block_threshold or last_tick == reported_tick:
+                continue
+
+            reported_tick = last_tick
+            EVENT_LOOP_BLOCKS.inc()
+            frame = sys._current_frames().get(  # pylint: disable = protected-access
+                self._loop_thread_id
+            )
+            logger.warning(
+                "[EventLoopMonitor]: Event loop blocked for over %.3f seconds. Stack:\n%s"
+                % (
+                    blocked_for,
+                    "".join(traceback.format_stack(frame)) if frame else "unavailable",
+                )
+            )
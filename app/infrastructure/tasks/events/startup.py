@@ -1,5 +1,6 @@
+import asyncio
 import time
-from typing import List
+from typing import List, Optional
 
 import uvloop
 from databases import Database
@@ -9,31 +10,127 @@ from app.dependencies import (
     get_event_loop,
     get_institution_repo,
     get_portfolio_repo,
+    get_sync_run_repo,
+    logger,
 )
 from app.infrastructure.db.core import get_or_create_database
+from app.infrastructure.tasks.backfill_assets import BackfillAssetsTask
+from app.infrastructure.tasks.event_loop_monitor import EventLoopMonitor
 from app.infrastructure.tasks.get_holdings import GetHoldingsTask
+from app.infrastructure.tasks.leader_election import LeaderElection
 from app.infrastructure.tasks.refresh_tokens import RefreshTokensTask
+from app.infrastructure.tasks.rotate_encryption_keys import RotateEncryptionKeysTask
+from app.settings import settings
+from app.usecases.services.encryption import EncryptionService
 
+BACKGROUND_TASKS: Optional[asyncio.Task] = None
+HOLDINGS_SYNC: Optional[GetHoldingsTask] = None
+EVENT_LOOP_MONITOR: Optional[asyncio.Task] = None
 
-async def start_ongoing_holdings_sync():
 
+async def start_event_loop_monitor():
+    """Sample this process's event loop lag and log whatever blocks it"""
+
+    global EVENT_LOOP_MONITOR
+    if not settings.event_loop_monitor_enabled or EVENT_LOOP_MONITOR is not None:
+        return
+
+    loop = await get_event_loop()
+    event_loop_monitor = EventLoopMonitor(
+        interval=settings.event_loop_monitor_interval,
+        block_threshold=settings.event_loop_block_threshold,
+    )
+    EVENT_LOOP_MONITOR = loop.create_task(event_loop_monitor.start_task())
+
+
+async def stop_event_loop_monitor():
+    global EVENT_LOOP_MONITOR
+    if EVENT_LOOP_MONITOR is None:
+        return
+
+    EVENT_LOOP_MONITOR.cancel()
+    await asyncio.gather(EVENT_LOOP_MONITOR, return_exceptions=True)
+    EVENT_LOOP_MONITOR = None
+
+
+async def start_background_tasks():
+    """Campaign for leadership; only the leader runs the ongoing background tasks"""
+
+    global BACKGROUND_TASKS
     loop = await get_event_loop()
+
+    leader_election = LeaderElection(
+        database_url=settings.db_url,
+        lock_key=settings.leader_election_lock_key,
+        lead=run_ongoing_tasks,
+        heartbeat_interval=settings.leader_election_heartbeat_interval,
+        heartbeat_timeout=settings.leader_election_heartbeat_timeout,
+        retry_interval=settings.leader_election_retry_interval,
+    )
+    BACKGROUND_TASKS = loop.create_task(leader_election.start_task())
+
+
+async def stop_background_tasks():
+    """Stop the background tasks, releasing leadership to another process"""
+
+    if BACKGROUND_TASKS is None:
+        return
+
+    # 1. Let the holdings sync finish its in-flight connection and checkpoint
+    if HOLDINGS_SYNC is not None:
+        try:
+            await asyncio.wait_for(
+                HOLDINGS_SYNC.drain(), timeout=settings.background_tasks_drain_timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                "[GetHoldingsTask]: Did not drain within %s seconds; the run will resume from its last checkpoint."
+                % settings.background_tasks_drain_timeout
+            )
+
+    # 2. Then stop everything else
+    BACKGROUND_TASKS.cancel()
+    await asyncio.gather(BACKGROUND_TASKS, return_exceptions=True)
+
+
+async def run_ongoing_tasks():
+    await asyncio.gather(
+        start_ongoing_holdings_sync(),
+        # In fused mode the holdings sync refreshes tokens itself
+        *([] if settings.fused_connection_sync else [start_ongoing_token_refresh()]),
+        *(
+            [run_encryption_key_rotation()]
+            if settings.encryption_rotation_enabled
+            else []
+        ),
+    )
+
+
+async def start_ongoing_holdings_sync():
+    global HOLDINGS_SYNC
+
     database = await get_or_create_database()
     institution_repo = await get_institution_repo()
     portfolio_repo = await get_portfolio_repo()
+    sync_run_repo = await get_sync_run_repo()
     institution_services = await get_all_institution_services()
 
     get_holdings_task = GetHoldingsTask(
         db=database,
         institution_repo=institution_repo,
         portfolio_repo=portfolio_repo,
+        sync_run_repo=sync_run_repo,
         institution_services=institution_services,
+        refresh_tokens=settings.fused_connection_sync,
     )
-    loop.create_task(get_holdings_task.start_task())
+    HOLDINGS_SYNC = get_holdings_task
+    try:
+        await get_holdings_task.start_task()
+    finally:
+        HOLDINGS_SYNC = None
 
 
 async def start_ongoing_token_refresh():
-    loop = await get_event_loop()
     database = await get_or_create_database()
     institution_repo = await get_institution_repo()
     institution_services = await get_all_institution_services()
@@ -42,5 +139,47 @@ async def start_ongoing_token_refresh():
         db=database,
         institution_repo=institution_repo,
         institution_services=institution_services,
+        encryption_service=EncryptionService(),
+    )
+    await refresh_tokens_task.start_task()
+
+
+async def run_encryption_key_rotation():
+    institution_repo = await get_institution_repo()
+
+    async def wait_for_holdings_sync():
+        if HOLDINGS_SYNC is not None:
+            await HOLDINGS_SYNC.idle.wait()
+
+    rotate_encryption_keys_task = RotateEncryptionKeysTask(
+        institution_repo=institution_repo,
+        encryption_service=EncryptionService(),
+        batch_size=settings.encryption_rotation_batch_size,
+        batch_interval=settings.encryption_rotation_batch_interval,
+        wait_for_sync=wait_for_holdings_sync,
+    )
+    try:
+        await rotate_encryption_keys_task.task()
+    except asyncio.CancelledError:  # pylint: disable = try-except-raise
+        raise
+    except Exception as e:  # pylint: disable = broad-except
+        # A failed rotation must not cost the other tasks their leadership; it
+        # picks up where it left off the next time leadership starts
+        logger.exception(e)
+
+
+async def run_assets_backfill(batch_size: int, concurrency: int):
+    database = await get_or_create_database()
+    institution_repo = await get_institution_repo()
+    portfolio_repo = await get_portfolio_repo()
+    institution_services = await get_all_institution_services()
+
+    backfill_assets_task = BackfillAssetsTask(
+        db=database,
+        institution_repo=institution_repo,
+        portfolio_repo=portfolio_repo,
+        institution_services=institution_services,
+        batch_size=batch_size,
+        concurrency=concurrency,
     )
-    loop.create_task(refresh_tokens_task.start_task())
+    await backfill_assets_task.task()
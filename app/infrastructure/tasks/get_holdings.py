@@ -1,6 +1,7 @@
 import asyncio
+from datetime import datetime, timedelta
 from time import time
-from typing import List
+from typing import List, Optional
 
 from databases import Database
 
@@ -8,11 +9,15 @@ from app.dependencies import logger
 from app.settings import settings
 from app.usecases.interfaces.repos.institution_repo import IInstitutionRepo
 from app.usecases.interfaces.repos.portfolio_repo import IPortfolioRepo
+from app.usecases.interfaces.repos.sync_run_repo import ISyncRunRepo
 from app.usecases.interfaces.services.institution_service import IInstitutionService
 from app.usecases.schemas import institutions, portfolios
 
 # import yfinance as yahoo_finance
 
+# Identifies this task's runs in sync_runs
+SYNC_RUN_TASK_NAME = "GetHoldingsTask"
+
 
 class GetHoldingsTask:
     def __init__(
@@ -20,116 +25,350 @@ class GetHoldingsTask:
         db: Database,
         institution_repo: IInstitutionRepo,
         portfolio_repo: IPortfolioRepo,
+        sync_run_repo: ISyncRunRepo,
         institution_services: List[IInstitutionService],
+        refresh_tokens: bool = False,
     ):
         self.db = db
         self._institution_repo = institution_repo
         self._portfolio_repo = portfolio_repo
+        self._sync_run_repo = sync_run_repo
         self.institution_services = institution_services
+        # When True, refresh tokens that would lapse before the next run as part of the sync
+        self.refresh_tokens = refresh_tokens
+        self.deactivated_connection_ids: List[int] = []
+        # Set by drain(): finish the in-flight connection, checkpoint, and stop
+        self.draining = asyncio.Event()
+        # Clear while a run is in progress
+        self.idle = asyncio.Event()
+        self.idle.set()
 
     async def start_task(self):
-        await asyncio.sleep(60 * 60 * 12)
-        while True:
+        while not self.draining.is_set():
             try:
+                await asyncio.sleep(await self.seconds_until_next_run())
+                self.idle.clear()
                 await self.task()
             except asyncio.CancelledError:  # pylint: disable = try-except-raise
                 raise
             except Exception as e:  # pylint: disable = broad-except
                 logger.exception(e)
+                # The run is left unfinished, so wait a little before resuming it
+                await asyncio.sleep(settings.holdings_sync_retry_interval)
+            finally:
+                self.idle.set()
+
+    async def drain(self):
+        """Stop after the in-flight connection, checkpointing the unfinished run"""
+
+        self.draining.set()
+        await self.idle.wait()
+
+    async def seconds_until_next_run(self) -> float:
+        """Zero if the last run was interrupted, otherwise the time left until it is
+        asset_update_task_frequency old"""
+
+        last_run = await self._sync_run_repo.retrieve_latest_run(
+            task_name=SYNC_RUN_TASK_NAME
+        )
 
-            await asyncio.sleep(settings.asset_update_task_frequency)
+        if not last_run:
+            # Leave room for RefreshTokensTask, which runs on its own
+            return 0 if self.refresh_tokens else 60 * 60 * 12
+
+        if not last_run.completed_at:
+            return 0
+
+        next_run_at = last_run.completed_at + timedelta(
+            seconds=settings.asset_update_task_frequency
+        )
+        return max((next_run_at - datetime.utcnow()).total_seconds(), 0)
 
     async def task(self):
         """Sync all Pelleum portfolios with linked brokerage portfolios."""
-        logger.info(
-            "[GetHoldingsTask]: Beginning periodic brokerage account sync task."
-        )
+
         task_start_time = time()
-        # 1. Get all account connenctions TODO: set this up for batches
-        account_connections = (
-            await self._institution_repo.retrieve_many_institution_connections(
-                query_params=institutions.RetrieveManyConnectionsRepoAdapter(
-                    is_active=True
-                ),
-                skip_locked=True,
+
+        # 1. Resume the unfinished run from its checkpoint, or start a new one
+        sync_run = await self._sync_run_repo.retrieve_latest_run(
+            task_name=SYNC_RUN_TASK_NAME
+        )
+        if sync_run and not sync_run.completed_at:
+            logger.info(
+                "[GetHoldingsTask]: Resuming brokerage account sync. Detail: run_id: %s, last_connection_id: %s"
+                % (sync_run.run_id, sync_run.last_connection_id)
+            )
+        else:
+            sync_run = await self._sync_run_repo.create(task_name=SYNC_RUN_TASK_NAME)
+            logger.info(
+                "[GetHoldingsTask]: Beginning periodic brokerage account sync task. Detail: run_id: %s"
+                % sync_run.run_id
+            )
+
+        processed_connections = sync_run.processed_connections
+        last_connection_id = sync_run.last_connection_id
+
+        # 2. Stream active account connenctions after the checkpoint, a page at a time
+        async for account_connection in self._institution_repo.stream_institution_connections(
+            query_params=institutions.RetrieveManyConnectionsRepoAdapter(
+                is_active=True
+            ),
+            page_size=settings.holdings_sync_page_size,
+            after_connection_id=sync_run.last_connection_id,
+        ):
+            if self.draining.is_set():
+                break
+
+            await self.sync_connection(account_connection=account_connection)
+
+            processed_connections += 1
+            last_connection_id = account_connection.connection_id
+            if processed_connections % settings.holdings_sync_checkpoint_interval == 0:
+                await self.checkpoint(
+                    run_id=sync_run.run_id,
+                    last_connection_id=last_connection_id,
+                    processed_connections=processed_connections,
+                )
+
+        # 3. Shutting down, so save progress for whichever process resumes the run
+        if self.draining.is_set():
+            await self.checkpoint(
+                run_id=sync_run.run_id,
+                last_connection_id=last_connection_id,
+                processed_connections=processed_connections,
             )
+            logger.info(
+                "[GetHoldingsTask]: Drained brokerage account sync. Detail: run_id: %s, last_connection_id: %s"
+                % (sync_run.run_id, last_connection_id)
+            )
+            return
+
+        await self.save_deactivated_connections()
+        await self._sync_run_repo.complete(
+            run_id=sync_run.run_id, processed_connections=processed_connections
         )
+
+        task_end_time = time()
+
         logger.info(
-            "[GetHoldingsTask]: Retrieved %s account connections to process. Processing now..."
-            % len(account_connections)
-        )
-
-        for account_connection in account_connections:
-            service = next(
-                (
-                    service
-                    for service in self.institution_services
-                    if service.institution_name == account_connection.name
-                ),
-                None,
-            )
+            "[GetHoldingsTask]: Periodic brokerage account sync of %s account connections completed in %s seconds. Sleeping now..."
+            % (processed_connections, task_end_time - task_start_time)
+        )
 
-            try:
-                # 2. For each account connection, get user's holdings from brokerage API
+    async def checkpoint(
+        self, run_id: int, last_connection_id: int, processed_connections: int
+    ) -> None:
+        """Save the run's progress, once every connection before it is fully written"""
+
+        await self.save_deactivated_connections()
+        await self._sync_run_repo.checkpoint(
+            run_id=run_id,
+            last_connection_id=last_connection_id,
+            processed_connections=processed_connections,
+        )
+
+    async def sync_connection(
+        self, account_connection: institutions.ConnectionJoinInstitutionJoinPortfolio
+    ) -> None:
+        """Sync one account connection's Pelleum portfolio with its brokerage portfolio"""
+
+        service = next(
+            (
+                service
+                for service in self.institution_services
+                if service.institution_name == account_connection.name
+            ),
+            None,
+        )
+
+        try:
+            if self.refresh_tokens and self.token_due_for_refresh(
+                account_connection=account_connection
+            ):
+                # 1. Refresh first, then get holdings with the fresh token still in memory
+                refreshed_tokens = await self.refresh_json_web_token(
+                    service=service, account_connection=account_connection
+                )
+                brokerage_portfolio = await service.get_recent_holdings(
+                    json_web_token=refreshed_tokens.json_web_token
+                )
+            elif self.refresh_tokens and account_connection.refresh_token:
+                # 1. The stored expiry already shows the token outlasts this run
                 brokerage_portfolio = await service.get_recent_holdings(
                     encrypted_json_web_token=account_connection.json_web_token
                 )
-
-                newly_created_asset_symbols = await self.sync_with_brokerage_data(
-                    user_id=account_connection.user_id,
-                    institution_id=account_connection.institution_id,
-                    brokerage_portfolio=brokerage_portfolio,
+            else:
+                # 1. Make sure the JSON web token has not expired before calling the brokerage
+                encrypted_json_web_token = await self.get_unexpired_json_web_token(
+                    service=service, account_connection=account_connection
                 )
+                if not encrypted_json_web_token:
+                    return
 
-                # 4. Only update asset in our database if NOT recently added (no need to update if it was just added)
-                for asset in brokerage_portfolio.holdings:
-                    if asset.asset_symbol not in newly_created_asset_symbols:
-
-                        await self._portfolio_repo.update_asset(
-                            user_id=account_connection.user_id,
-                            asset_symbol=asset.asset_symbol,
-                            institution_id=account_connection.institution_id,
-                            updated_asset=portfolios.UpdateAssetRepoAdapter(
-                                is_up_to_date=True,
-                                quantity=asset.quantity,
-                                average_buy_price=asset.average_buy_price,
-                            ),
-                        )
-            except institutions.UnauthorizedException:
-                # A 401 was returned, so update this connection's is_active column to False
-                await self._institution_repo.update_institution_connection(
-                    connection_id=account_connection.connection_id,
-                    updated_connection=institutions.UpdateConnectionRepoAdapter(
-                        is_active=False
-                    ),
-                )
-                logger.warning(
-                    "[GetHoldingsTask]: Received a 401 Unauthorized when attempting to update assets. Detail: connection_id: %s"
-                    % account_connection.connection_id
+                # 2. Get user's holdings from brokerage API
+                brokerage_portfolio = await service.get_recent_holdings(
+                    encrypted_json_web_token=encrypted_json_web_token
                 )
-            except (
-                institutions.InstitutionApiError,
-                institutions.InstitutionException,
+
+            portfolio_change = await self.sync_with_brokerage_data(
+                user_id=account_connection.user_id,
+                institution_id=account_connection.institution_id,
+                brokerage_portfolio=brokerage_portfolio,
+            )
+
+            # 3. Only update asset in our database if NOT recently added (no need to update if it was just added)
+            for asset in brokerage_portfolio.holdings:
+                if asset.asset_symbol not in portfolio_change.added:
+
+                    await self._portfolio_repo.update_asset(
+                        user_id=account_connection.user_id,
+                        asset_symbol=asset.asset_symbol,
+                        institution_id=account_connection.institution_id,
+                        updated_asset=portfolios.UpdateAssetRepoAdapter(
+                            is_up_to_date=True,
+                            quantity=asset.quantity,
+                            average_buy_price=asset.average_buy_price,
+                        ),
+                    )
+
+            # 4. Let listeners know exactly which of the user's holdings changed
+            if (
+                portfolio_change.added
+                or portfolio_change.removed
+                or portfolio_change.changed
             ):
-                continue
+                await self._portfolio_repo.publish_portfolio_change(
+                    portfolio_change=portfolio_change,
+                    channel=settings.portfolio_changes_channel,
+                )
+        except institutions.UnauthorizedException:
+            # A 401 was returned, so update this connection's is_active column to False
+            await self.deactivate_connection(
+                connection_id=account_connection.connection_id
+            )
+            logger.warning(
+                "[GetHoldingsTask]: Received a 401 Unauthorized when attempting to update assets. Detail: connection_id: %s"
+                % account_connection.connection_id
+            )
+        except (
+            institutions.InstitutionApiError,
+            institutions.InstitutionException,
+        ):
+            return
+        except asyncio.CancelledError:  # pylint: disable = try-except-raise
+            raise
+        except Exception:  # pylint: disable = broad-except
+            # Skip it: failing the run would resume it at this same connection every time
+            logger.exception(
+                "[GetHoldingsTask]: Could not sync account connection. Detail: connection_id: %s"
+                % account_connection.connection_id
+            )
 
-        task_end_time = time()
+    async def get_unexpired_json_web_token(
+        self,
+        service: IInstitutionService,
+        account_connection: institutions.ConnectionJoinInstitutionJoinPortfolio,
+    ) -> Optional[str]:
+        """Returns an encrypted JSON web token that has not expired, refreshing it
+        first if needed. Returns None if the connection had to be deactivated."""
+
+        if not await service.json_web_token_is_expired(
+            encrypted_json_web_token=account_connection.json_web_token
+        ):
+            return account_connection.json_web_token
+
+        # 1. Expired and nothing to refresh with, so the brokerage would only return a 401
+        if not account_connection.refresh_token:
+            await self.deactivate_connection(
+                connection_id=account_connection.connection_id
+            )
+            logger.warning(
+                "[GetHoldingsTask]: JSON web token expired and there is no refresh token. Detail: connection_id: %s"
+                % account_connection.connection_id
+            )
+            return None
+
+        # 2. Refresh now instead of sending a request that is bound to fail
+        refreshed_tokens = await self.refresh_json_web_token(
+            service=service, account_connection=account_connection
+        )
+
+        return refreshed_tokens.encrypted_json_web_token
+
+    def token_due_for_refresh(
+        self, account_connection: institutions.ConnectionJoinInstitutionJoinPortfolio
+    ) -> bool:
+        """Whether the connection's JSON web token would lapse before the next run"""
+
+        if not account_connection.refresh_token:
+            return False
 
+        if not account_connection.token_expires_at:
+            return True
+
+        refresh_before = datetime.utcnow() + timedelta(
+            seconds=settings.asset_update_task_frequency
+            + settings.refresh_tokens_lead_time
+        )
+        return account_connection.token_expires_at <= refresh_before
+
+    async def refresh_json_web_token(
+        self,
+        service: IInstitutionService,
+        account_connection: institutions.ConnectionJoinInstitutionJoinPortfolio,
+    ) -> institutions.SuccessfulTokenRefreshResponse:
+        """Request new tokens from the institution and save them in our database"""
+
+        refreshed_tokens = await service.refresh_token(
+            encrypted_refresh_token=account_connection.refresh_token
+        )
+        # Saved right away: the institution has already rotated the old refresh token
+        await self._institution_repo.update_many_connection_tokens(
+            updated_tokens=[
+                institutions.UpdateConnectionTokensRepoAdapter(
+                    connection_id=account_connection.connection_id,
+                    json_web_token=refreshed_tokens.encrypted_json_web_token,
+                    refresh_token=refreshed_tokens.encrypted_refresh_token,
+                    token_expires_at=refreshed_tokens.token_expires_at,
+                )
+            ]
+        )
         logger.info(
-            "[GetHoldingsTask]: Periodic brokerage account sync completed in %s seconds. Sleeping now..."
-            % (task_end_time - task_start_time)
+            "[GetHoldingsTask]: Refreshed JSON web token before syncing. Detail: connection_id: %s"
+            % account_connection.connection_id
         )
 
+        return refreshed_tokens
+
+    async def deactivate_connection(self, connection_id: int) -> None:
+        """Queues a connection to have its is_active column set to False"""
+
+        self.deactivated_connection_ids.append(connection_id)
+        if len(self.deactivated_connection_ids) >= settings.deactivation_batch_size:
+            await self.save_deactivated_connections()
+
+    async def save_deactivated_connections(self) -> None:
+        """Sets is_active to False for all queued connections in one go"""
+
+        if not self.deactivated_connection_ids:
+            return
+
+        await self._institution_repo.deactivate_many_institution_connections(
+            connection_ids=self.deactivated_connection_ids
+        )
+        self.deactivated_connection_ids = []
+
     async def sync_with_brokerage_data(
         self,
         user_id: int,
         institution_id: str,
         brokerage_portfolio: institutions.UserBrokerageHoldings,
-    ) -> List[str]:
-        """Adds new holdings and deletes old holdings"""
+    ) -> portfolios.PortfolioChange:
+        """Adds new holdings and deletes old holdings, returning what changed"""
 
+        # Primary, since the assets read here decide what is deleted and inserted
         tracked_assets = await self._portfolio_repo.retrieve_brokerage_assets(
-            user_id=user_id, institution_id=institution_id
+            user_id=user_id, institution_id=institution_id, use_primary=True
         )
 
         tracked_asset_symbols = [asset.asset_symbol for asset in tracked_assets]
@@ -155,10 +394,10 @@ class GetHoldingsTask:
         for asset in assets_to_delete_from_db:
             await self._portfolio_repo.delete(asset_id=asset.asset_id)
 
-        # 4. For each asset we're not tracking, insert asset into our database
-        for asset in assets_to_add_to_db:
-            await self._portfolio_repo.upsert_asset(
-                new_asset=portfolios.UpsertAssetRepoAdapter(
+        # 4. Insert every asset we're not tracking into our database in one round trip
+        await self._portfolio_repo.upsert_many_assets(
+            new_assets=[
+                portfolios.UpsertAssetRepoAdapter(
                     average_buy_price=asset.average_buy_price
                     if asset.average_buy_price
                     else None,
@@ -168,10 +407,32 @@ class GetHoldingsTask:
                     asset_symbol=asset.asset_symbol,
                     quantity=asset.quantity,
                 )
+                for asset in assets_to_add_to_db
+            ]
+        )
+
+        # 5. Return the inserted and deleted symbols, plus those whose position moved
+        tracked_assets_by_symbol = {
+            asset.asset_symbol: asset for asset in tracked_assets
+        }
+        changed_asset_symbols = [
+            asset.asset_symbol
+            for asset in brokerage_portfolio.holdings
+            if asset.asset_symbol in tracked_assets_by_symbol
+            and (
+                tracked_assets_by_symbol[asset.asset_symbol].quantity != asset.quantity
+                or tracked_assets_by_symbol[asset.asset_symbol].average_buy_price
+                != asset.average_buy_price
             )
+        ]
 
-        # 5. Return a list of the newly inserted asset symbols
-        return [asset.asset_symbol for asset in assets_to_add_to_db]
+        return portfolios.PortfolioChange(
+            user_id=user_id,
+            institution_id=institution_id,
+            added=[asset.asset_symbol for asset in assets_to_add_to_db],
+            removed=[asset.asset_symbol for asset in assets_to_delete_from_db],
+            changed=changed_asset_symbols,
+        )
 
     # async def get_asset_price(self, asset_symbol: str) -> float:
     #     """Retrieve current asset price"""
@@ -0,0 +1,70 @@
+from time import time
+
+from app.dependencies import logger
+from app.usecases.interfaces.repos.institution_repo import IInstitutionRepo
+from app.usecases.interfaces.services.institution_service import IInstitutionService
+from app.usecases.schemas import institutions
+
+
+class ImportHoldingsTask:
+    def __init__(
+        self,
+        institution_repo: IInstitutionRepo,
+        institution_service: IInstitutionService,
+        job_id: str,
+        connection: institutions.InstitutionConnection,
+    ):
+        self._institution_repo = institution_repo
+        self.institution_service = institution_service
+        self.job_id = job_id
+        self.connection = connection
+
+    async def task(self):
+        """Import a freshly logged in connection's holdings and record the outcome
+        on its login job."""
+
+        task_start_time = time()
+
+        try:
+            imported_assets = await self.institution_service.import_holdings(
+                connection=self.connection
+            )
+        except (
+            institutions.InstitutionApiError,
+            institutions.InstitutionException,
+        ) as error:
+            error = (
+                error.detail
+                if isinstance(error, institutions.InstitutionApiError)
+                else str(error)
+            )
+            logger.warning(
+                "[ImportHoldingsTask]: Could not import holdings. Detail: job_id: %s, connection_id: %s"
+                % (self.job_id, self.connection.connection_id)
+            )
+            await self._institution_repo.update_login_job(
+                job_id=self.job_id,
+                status=institutions.LoginJobStatus.FAILED,
+                error=f"{self.institution_service.institution_name} API Error: {error}",
+            )
+            return
+        except Exception as e:  # pylint: disable = broad-except
+            # Never leave the job importing forever
+            logger.exception(e)
+            await self._institution_repo.update_login_job(
+                job_id=self.job_id,
+                status=institutions.LoginJobStatus.FAILED,
+                error="There was an internal server error.",
+            )
+            return
+
+        await self._institution_repo.update_login_job(
+            job_id=self.job_id,
+            status=institutions.LoginJobStatus.SUCCEEDED,
+            imported_assets=imported_assets,
+        )
+
+        logger.info(
+            "[ImportHoldingsTask]: Imported %s holdings in %s seconds. Detail: job_id: %s"
+            % (imported_assets, time() - task_start_time, self.job_id)
+        )
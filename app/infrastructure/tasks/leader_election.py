@@ -0,0 +1,105 @@
+import asyncio
+from typing import Awaitable, Callable
+
+import asyncpg
+
+from app.dependencies import logger
+
+# Postgres drops a vanished leader's session, and so its lock, after about 25 seconds,
+# by which time the leader's own failed heartbeat has already stopped it leading
+KEEPALIVE_SERVER_SETTINGS = {
+    "tcp_keepalives_idle": "10",
+    "tcp_keepalives_interval": "5",
+    "tcp_keepalives_count": "3",
+}
+
+
+class LeaderElection:
+    def __init__(
+        self,
+        database_url: str,
+        lock_key: int,
+        lead: Callable[[], Awaitable[None]],
+        heartbeat_interval: float = 10,
+        heartbeat_timeout: float = 5,
+        retry_interval: float = 15,
+    ):
+        self.database_url = database_url
+        # Every process campaigning for the same lock_key competes for one leadership
+        self.lock_key = lock_key
+        # Runs for as long as this process leads; cancelled when leadership is lost
+        self.lead = lead
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.retry_interval = retry_interval
+        self.is_leader = False
+
+    async def start_task(self):
+        while True:
+            try:
+                await self.campaign()
+            except asyncio.CancelledError:  # pylint: disable = try-except-raise
+                raise
+            except Exception as e:  # pylint: disable = broad-except
+                logger.exception(e)
+
+            await asyncio.sleep(self.retry_interval)
+
+    async def campaign(self):
+        """Try to take the advisory lock. If it is taken, lead until the lock's session
+        stops answering heartbeats, then give up leadership."""
+
+        # 1. Session advisory locks belong to a connection, so the lock gets its own
+        connection = await asyncpg.connect(
+            self.database_url, server_settings=KEEPALIVE_SERVER_SETTINGS
+        )
+        try:
+            if not await connection.fetchval(
+                "SELECT pg_try_advisory_lock($1)", self.lock_key
+            ):
+                return
+
+            logger.info(
+                "[LeaderElection]: Acquired leadership. Detail: lock_key: %s"
+                % self.lock_key
+            )
+            self.is_leader = True
+            lead_task = asyncio.ensure_future(self.lead())
+
+            # 2. Lead for as long as the session holding the lock is alive
+            try:
+                while not lead_task.done():
+                    await asyncio.wait({lead_task}, timeout=self.heartbeat_interval)
+                    if lead_task.done():
+                        break
+
+                    try:
+                        await asyncio.wait_for(
+                            connection.fetchval("SELECT 1"),
+                            timeout=self.heartbeat_timeout,
+                        )
+                    except (
+                        asyncio.TimeoutError,
+                        asyncpg.PostgresError,
+                        asyncpg.InterfaceError,
+                        OSError,
+                    ):
+                        logger.warning(
+                            "[LeaderElection]: Heartbeat failed, so the lock may be lost. Detail: lock_key: %s"
+                            % self.lock_key
+                        )
+                        return
+            finally:
+                self.is_leader = False
+                lead_task.cancel()
+                await asyncio.gather(lead_task, return_exceptions=True)
+                logger.info(
+                    "[LeaderElection]: Gave up leadership. Detail: lock_key: %s"
+                    % self.lock_key
+                )
+
+            # 3. lead() stopped on its own, so surface why
+            lead_task.result()
+        finally:
+            # 4. Closing the session releases the lock for the next leader
+            connection.terminate()
@@ -1,12 +1,14 @@
 import asyncio
+from datetime import datetime, timedelta
 from time import time
-from typing import List
+from typing import Dict, List, Optional
 
 from databases import Database
 
 from app.dependencies import logger
 from app.settings import settings
 from app.usecases.interfaces.repos.institution_repo import IInstitutionRepo
+from app.usecases.interfaces.services.encryption_service import IEncryptionService
 from app.usecases.interfaces.services.institution_service import IInstitutionService
 from app.usecases.schemas import institutions
 
@@ -19,33 +21,56 @@ class RefreshTokensTask:
         db: Database,
         institution_repo: IInstitutionRepo,
         institution_services: List[IInstitutionService],
+        encryption_service: IEncryptionService,
     ):
         self.db = db
         self._institution_repo = institution_repo
         self.institution_services = institution_services
+        self.encryption_service = encryption_service
 
     async def start_task(self):
         while True:
+            sleep_seconds = settings.refresh_tokens_retry_interval
             try:
                 await self.task()
+                sleep_seconds = await self.seconds_until_next_refresh()
             except asyncio.CancelledError:  # pylint: disable = try-except-raise
                 raise
             except Exception as e:  # pylint: disable = broad-except
                 logger.exception(e)
 
-            await asyncio.sleep(settings.refresh_tokens_task_frequency)
+            await asyncio.sleep(sleep_seconds)
+
+    async def seconds_until_next_refresh(self) -> float:
+        """Seconds until the soonest JSON web token enters its refresh window,
+        bounded by the retry and poll intervals"""
+
+        next_token_expiry = await self._institution_repo.retrieve_next_token_expiry()
+        if not next_token_expiry:
+            return settings.refresh_tokens_poll_interval
+
+        next_refresh_at = next_token_expiry - timedelta(
+            seconds=settings.refresh_tokens_lead_time
+        )
+        seconds_until_next_refresh = (
+            next_refresh_at - datetime.utcnow()
+        ).total_seconds()
+
+        return min(
+            max(seconds_until_next_refresh, settings.refresh_tokens_retry_interval),
+            settings.refresh_tokens_poll_interval,
+        )
 
     async def task(self):
-        """Refresh tokens for all linked brokerages that require it."""
+        """Refresh tokens for all linked brokerages that are about to expire."""
 
-        logger.info("[RefreshTokenTask]: Beginning periodic token refresh task.")
+        logger.info("[RefreshTokenTask]: Beginning token refresh task.")
         task_start_time = time()
-        # 1. Get all active account connenctions that have refresh tokens
+        # 1. Get active account connenctions whose tokens expire within the lead time
         account_connections = (
-            await self._institution_repo.retrieve_many_institution_connections(
-                query_params=institutions.RetrieveManyConnectionsRepoAdapter(
-                    is_active=True, has_refresh_token=True
-                )
+            await self._institution_repo.retrieve_connections_due_for_refresh(
+                expires_before=datetime.utcnow()
+                + timedelta(seconds=settings.refresh_tokens_lead_time)
             )
         )
         logger.info(
@@ -53,33 +78,115 @@ class RefreshTokensTask:
             % len(account_connections)
         )
 
-        for account_connection in account_connections:
-            service = next(
-                (
-                    service
-                    for service in self.institution_services
-                    if service.institution_name == account_connection.name
-                ),
-                None,
+        semaphore = asyncio.Semaphore(settings.refresh_tokens_concurrency)
+        batch_size = settings.refresh_tokens_write_batch_size
+
+        for batch_start in range(0, len(account_connections), batch_size):
+            batch = account_connections[batch_start : batch_start + batch_size]
+
+            # 2. Decrypt the batch's refresh tokens together, off the event loop when large
+            refreshable_connections = [
+                (account_connection, refresh_token)
+                for account_connection, refresh_token in zip(
+                    batch, await self.decrypt_refresh_tokens(batch=batch)
+                )
+                if refresh_token is not None
+            ]
+
+            # 3. Request new tokens from the institutions, a bounded number at a time
+            updated_connections = await asyncio.gather(
+                *[
+                    self.refresh_connection(
+                        account_connection=account_connection,
+                        refresh_token=refresh_token,
+                        semaphore=semaphore,
+                    )
+                    for account_connection, refresh_token in refreshable_connections
+                ]
             )
 
+            # 4. Save the batch's new tokens and deactivations in database
+            await self.save_updated_connections(
+                updated_connections={
+                    account_connection.connection_id: updated_connection
+                    for (account_connection, _), updated_connection in zip(
+                        refreshable_connections, updated_connections
+                    )
+                    if updated_connection
+                }
+            )
+
+        task_end_time = time()
+
+        logger.info(
+            "[RefreshTokenTask]: Token refresh task completed in %s seconds. Sleeping now..."
+            % (task_end_time - task_start_time)
+        )
+
+    async def decrypt_refresh_tokens(
+        self, batch: List[institutions.ConnectionJoinInstitutionJoinPortfolio]
+    ) -> List[Optional[str]]:
+        """Decrypt a batch's refresh tokens, in order. A token that cannot be decrypted
+        (e.g. under a key that is no longer configured) is logged and returned as None,
+        so one bad row cannot stop every other connection's refresh."""
+
+        encrypted_refresh_tokens = [
+            account_connection.refresh_token for account_connection in batch
+        ]
+        try:
+            return await self.encryption_service.decrypt_many(
+                encrypted_secrets=encrypted_refresh_tokens
+            )
+        except ValueError:
+            pass
+
+        # 1. Something in the batch is undecryptable, so find out which one by one
+        refresh_tokens = []
+        for account_connection in batch:
+            try:
+                refresh_tokens.append(
+                    await self.encryption_service.decrypt(
+                        encrypted_secret=account_connection.refresh_token
+                    )
+                )
+            except ValueError as error:
+                logger.warning(
+                    "[RefreshTokenTask]: Could not decrypt refresh token, skipping. Detail: connection_id: %s, error: %s"
+                    % (account_connection.connection_id, error)
+                )
+                refresh_tokens.append(None)
+        return refresh_tokens
+
+    async def refresh_connection(
+        self,
+        account_connection: institutions.ConnectionJoinInstitutionJoinPortfolio,
+        refresh_token: str,
+        semaphore: asyncio.Semaphore,
+    ) -> Optional[institutions.UpdateConnectionRepoAdapter]:
+        """Request new tokens for a single connection and return the update to save,
+        or None if there is nothing to save"""
+
+        service = next(
+            (
+                service
+                for service in self.institution_services
+                if service.institution_name == account_connection.name
+            ),
+            None,
+        )
+
+        async with semaphore:
             try:
-                # 2. For each retrieved connection, request new tokens from institution
                 encrypted_refreshed_tokens = await service.refresh_token(
-                    encrypted_refresh_token=account_connection.refresh_token
+                    refresh_token=refresh_token
                 )
             except institutions.UnauthorizedException:
                 # A 401 was returned, so update this connection's is_active column to False
-                await self._institution_repo.update_institution_connection(
-                    connection_id=account_connection.connection_id,
-                    updated_connection=institutions.UpdateConnectionRepoAdapter(
-                        is_active=False
-                    ),
-                )
                 logger.warning(
                     "[RefreshTokenTask]: Received a 401 Unauthorized when attempting to refresh token. Detail: connection_id: %s"
                     % account_connection.connection_id
                 )
+                return institutions.UpdateConnectionRepoAdapter(is_active=False)
             except (
                 institutions.InstitutionApiError,
                 institutions.InstitutionException,
@@ -88,20 +195,45 @@ class RefreshTokensTask:
                     "[RefreshTokenTask]: Error refreshing JSON web token - Error: %s"
                     % error
                 )
-                continue
-            else:
-                # 3. Save new tokens in database
-                await self._institution_repo.update_institution_connection(
-                    connection_id=account_connection.connection_id,
-                    updated_connection=institutions.UpdateConnectionRepoAdapter(
-                        json_web_token=encrypted_refreshed_tokens.encrypted_json_web_token,
-                        refresh_token=encrypted_refreshed_tokens.encrypted_refresh_token,
-                    ),
-                )
-
-        task_end_time = time()
+                return None
+            except Exception as e:  # pylint: disable = broad-except
+                # Don't let one connection lose the rest of the batch's new tokens
+                logger.exception(e)
+                return None
 
-        logger.info(
-            "[RefreshTokenTask]: Periodic token refresh task completed in %s seconds. Sleeping now..."
-            % (task_end_time - task_start_time)
+        return institutions.UpdateConnectionRepoAdapter(
+            json_web_token=encrypted_refreshed_tokens.encrypted_json_web_token,
+            refresh_token=encrypted_refreshed_tokens.encrypted_refresh_token,
+            token_expires_at=encrypted_refreshed_tokens.token_expires_at,
         )
+
+    async def save_updated_connections(
+        self, updated_connections: Dict[int, institutions.UpdateConnectionRepoAdapter]
+    ) -> None:
+        """Write a batch of connection updates in a single transaction"""
+
+        deactivated_connection_ids = [
+            connection_id
+            for connection_id, updated_connection in updated_connections.items()
+            if updated_connection.is_active is False
+        ]
+        updated_tokens = [
+            institutions.UpdateConnectionTokensRepoAdapter(
+                connection_id=connection_id,
+                json_web_token=updated_connection.json_web_token,
+                refresh_token=updated_connection.refresh_token,
+                token_expires_at=updated_connection.token_expires_at,
+            )
+            for connection_id, updated_connection in updated_connections.items()
+            if updated_connection.is_active is not False
+        ]
+
+        async with self.db.transaction():
+            if updated_tokens:
+                await self._institution_repo.update_many_connection_tokens(
+                    updated_tokens=updated_tokens
+                )
+            if deactivated_connection_ids:
+                await self._institution_repo.deactivate_many_institution_connections(
+                    connection_ids=deactivated_connection_ids
+                )
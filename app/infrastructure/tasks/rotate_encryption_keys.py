@@ -0,0 +1,102 @@
+import asyncio
+from time import time
+from typing import Awaitable, Callable, List, Optional
+
+from app.dependencies import logger
+from app.usecases.interfaces.repos.institution_repo import IInstitutionRepo
+from app.usecases.interfaces.services.encryption_service import IEncryptionService
+from app.usecases.schemas import institutions
+
+SECRET_FIELDS = ("username", "password", "json_web_token", "refresh_token")
+
+
+class RotateEncryptionKeysTask:
+    def __init__(
+        self,
+        institution_repo: IInstitutionRepo,
+        encryption_service: IEncryptionService,
+        batch_size: int = 200,
+        batch_interval: float = 1.0,
+        wait_for_sync: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self._institution_repo = institution_repo
+        self.encryption_service = encryption_service
+        # Connections re-encrypted and written back together
+        self.batch_size = batch_size
+        # Pause after each batch that was written back
+        self.batch_interval = batch_interval
+        # Awaited before each batch, so the rotation only runs while the sync is idle
+        self.wait_for_sync = wait_for_sync
+
+    async def task(self):
+        """Re-encrypt every connection's secrets that are not yet under the current key."""
+
+        logger.info("[RotateEncryptionKeysTask]: Beginning encryption key rotation.")
+        task_start_time = time()
+        rotated_connections = 0
+        batch: List[institutions.ConnectionSecrets] = []
+
+        # 1. Stream every connection's ciphertexts and rotate them a batch at a time
+        async for connection_secrets in self._institution_repo.stream_connection_secrets(
+            page_size=self.batch_size
+        ):
+            batch.append(connection_secrets)
+            if len(batch) < self.batch_size:
+                continue
+
+            rotated_connections += await self.rotate_batch(batch=batch)
+            batch = []
+
+        if batch:
+            rotated_connections += await self.rotate_batch(batch=batch)
+
+        logger.info(
+            "[RotateEncryptionKeysTask]: Rotated %s account connections in %s seconds."
+            % (rotated_connections, time() - task_start_time)
+        )
+
+    async def rotate_batch(self, batch: List[institutions.ConnectionSecrets]) -> int:
+        """Re-encrypt a batch of connections' secrets and write back the ones that
+        changed. Returns how many connections were rotated."""
+
+        # 1. Yield to the sync before doing any work
+        if self.wait_for_sync:
+            await self.wait_for_sync()
+
+        # 2. Re-encrypt all of the batch's ciphertexts together, off the event loop when large
+        ciphertexts = [
+            getattr(connection_secrets, field)
+            for connection_secrets in batch
+            for field in SECRET_FIELDS
+            if getattr(connection_secrets, field)
+        ]
+        rotated_ciphertexts = iter(
+            await self.encryption_service.rotate_many(encrypted_secrets=ciphertexts)
+        )
+
+        rotated_secrets = []
+        for connection_secrets in batch:
+            previous = connection_secrets.dict()
+            rotated = {
+                field: next(rotated_ciphertexts) if previous[field] else None
+                for field in SECRET_FIELDS
+            }
+            if all(rotated[field] == previous[field] for field in SECRET_FIELDS):
+                continue
+
+            rotated_secrets.append(
+                institutions.RotatedConnectionSecretsRepoAdapter(
+                    connection_id=connection_secrets.connection_id,
+                    **rotated,
+                    **{f"previous_{field}": previous[field] for field in SECRET_FIELDS},
+                )
+            )
+
+        # 3. Write the batch back in one statement, then pause
+        if rotated_secrets:
+            await self._institution_repo.update_many_connection_secrets(
+                rotated_secrets=rotated_secrets
+            )
+            await asyncio.sleep(self.batch_interval)
+
+        return len(rotated_secrets)
@@ -1,6 +1,9 @@
 from datetime import datetime
 
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.libraries.metrics import METRICS
 
 health_router = APIRouter(tags=["health"])
 
@@ -9,3 +12,12 @@ health_router = APIRouter(tags=["health"])
 async def health_check():
 
     return {"status": "healthy", "datetime": datetime.now().isoformat()}
+
+
+@health_router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """This process's metrics in the Prometheus text format"""
+
+    return PlainTextResponse(
+        METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,23 +1,43 @@
-from datetime import datetime
-from typing import Any, Mapping, Union
+from datetime import datetime, timedelta
+from hashlib import sha256
+from typing import Any, Mapping, Optional, Union
+from uuid import uuid4
 
-from fastapi import APIRouter, Body, Depends, Path
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Body,
+    Depends,
+    Header,
+    Path,
+    Query,
+    Response,
+)
 from pydantic import constr
 
 from app.dependencies import (
+    get_current_active_superuser,
     get_current_active_user,
     get_institution_repo,
     get_institution_service,
-    get_portfolio_repo,
+    logger,
 )
+from app.infrastructure.tasks.import_holdings import ImportHoldingsTask
 from app.libraries import pelleum_errors
+from app.libraries.ttl_cache import TTLCache
+from app.settings import settings
 from app.usecases.interfaces.repos.institution_repo import IInstitutionRepo
-from app.usecases.interfaces.repos.portfolio_repo import IPortfolioRepo
 from app.usecases.interfaces.services.institution_service import IInstitutionService
-from app.usecases.schemas import institutions, portfolios, users
+from app.usecases.schemas import institutions, users
 
 institution_router = APIRouter(tags=["Institutions"])
 
+# The serialized supported institutions response and its ETag. Nothing in this service
+# writes institutions, so changes to the table show up once the TTL expires
+SUPPORTED_INSTITUTIONS = TTLCache(
+    max_size=1, ttl=settings.supported_institutions_cache_ttl
+)
+
 
 @institution_router.get(
     "",
@@ -25,18 +45,45 @@ institution_router = APIRouter(tags=["Institutions"])
     response_model=institutions.SupportedInstitutionsResponse,
 )
 async def get_all_supported_institutions(
+    if_none_match: Optional[str] = Header(None),
     institution_repo: IInstitutionRepo = Depends(get_institution_repo),
     authorized_user: users.UserInDB = Depends(get_current_active_user),
-) -> institutions.SupportedInstitutionsResponse:
+) -> Response:
     """Retrieve all Pelleum supported institutions"""
 
-    supported_institutions = await institution_repo.retrieve_all_institutions()
-
-    return institutions.SupportedInstitutionsResponse(
-        records=institutions.SupportedInstitutions(
-            supported_institutions=supported_institutions
+    # 1. Serialize the institutions once per cache lifetime
+    cached_response = SUPPORTED_INSTITUTIONS.get("response")
+    if cached_response is None:
+        supported_institutions = await institution_repo.retrieve_all_institutions()
+        body = (
+            institutions.SupportedInstitutionsResponse(
+                records=institutions.SupportedInstitutions(
+                    supported_institutions=supported_institutions
+                )
+            )
+            .json()
+            .encode()
         )
-    )
+        cached_response = (body, f'"{sha256(body).hexdigest()}"')
+        SUPPORTED_INSTITUTIONS.set("response", cached_response)
+
+    body, etag = cached_response
+    # The list is the same for every user, so shared caches may keep it too
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.supported_institutions_cache_ttl}",
+    }
+
+    # 2. The client already has this version
+    if if_none_match:
+        client_etags = {
+            client_etag.strip().replace("W/", "", 1)
+            for client_etag in if_none_match.split(",")
+        }
+        if etag in client_etags or "*" in client_etags:
+            return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @institution_router.get(
@@ -70,6 +117,48 @@ async def retrieve_active_institution_connections(
     )
 
 
+@institution_router.post(
+    "/connections/batch",
+    status_code=200,
+    response_model=institutions.UsersConnectionsResponse,
+)
+async def retrieve_users_institution_connections(
+    body: institutions.UsersConnectionsRequest = Body(...),
+    institution_repo: IInstitutionRepo = Depends(get_institution_repo),
+    authorized_user: users.UserInDB = Depends(get_current_active_superuser),
+) -> institutions.UsersConnectionsResponse:
+    """Retrieve many users' connected accounts at once. Superusers only."""
+
+    # 1. Keep the query and the response bounded
+    user_ids = list(dict.fromkeys(body.user_ids))
+    if len(user_ids) > settings.connections_batch_max_users:
+        raise await pelleum_errors.PelleumErrors(
+            detail=f"At most {settings.connections_batch_max_users} user_ids may be requested at once."
+        ).general_bad_request()
+
+    # 2. Retrieve every user's connections in one query
+    users_connections = {user_id: [] for user_id in user_ids}
+    if user_ids:
+        for connection in await institution_repo.retrieve_users_institution_connections(
+            user_ids=user_ids
+        ):
+            users_connections[connection.user_id].append(
+                institutions.ConnectionInResponse(**connection.dict())
+            )
+
+    # 3. Answer in the order the user_ids were requested, including users without connections
+    return institutions.UsersConnectionsResponse(
+        records=institutions.UsersConnections(
+            users_connections=[
+                institutions.UserConnections(
+                    user_id=user_id, active_connections=active_connections
+                )
+                for user_id, active_connections in users_connections.items()
+            ]
+        )
+    )
+
+
 @institution_router.delete(
     "/{institution_id}",
     status_code=200,
@@ -78,53 +167,119 @@ async def retrieve_active_institution_connections(
 async def delete_institution_connection(
     institution_id: constr(max_length=100) = Path(...),
     institution_repo: IInstitutionRepo = Depends(get_institution_repo),
-    portfolio_repo: IPortfolioRepo = Depends(get_portfolio_repo),
     authorized_user: users.UserInDB = Depends(get_current_active_user),
 ) -> None:
     """Deactivate a user's connected account"""
 
-    # 1. Ensure connection exists
-    connection = await institution_repo.retrieve_institution_connection(
-        user_id=authorized_user.user_id,
-        institution_id=institution_id,
+    # 1. Delete institution connection and its assets in one statement
+    teardown = await institution_repo.delete_connections_with_assets(
+        institution_id=institution_id, user_ids=[authorized_user.user_id]
     )
 
-    if not connection:
+    # 2. Ensure connection existed
+    if not teardown.deleted_connections:
         raise await pelleum_errors.PelleumErrors(
             detail=f"There is no active connection associated with user_id, {authorized_user.user_id}, and institution_id, {institution_id}."
         ).resource_not_found()
 
-    # 2. Delete institution connection
-    await institution_repo.delete(
-        connection_id=connection.connection_id,
+
+@institution_router.post(
+    "/connections/teardown",
+    status_code=200,
+    response_model=institutions.ConnectionsTeardown,
+)
+async def teardown_institution_connections(
+    body: institutions.TeardownConnectionsRequest = Body(...),
+    institution_repo: IInstitutionRepo = Depends(get_institution_repo),
+    authorized_user: users.UserInDB = Depends(get_current_active_superuser),
+) -> institutions.ConnectionsTeardown:
+    """Delete many connected accounts, and their assets, by institution and/or users.
+    Superusers only."""
+
+    # 1. Ensure something narrows the teardown
+    if not body.institution_id and not body.user_ids:
+        raise await pelleum_errors.PelleumErrors(
+            detail="Please supply an institution_id, user_ids, or both."
+        ).general_bad_request()
+
+    # 2. Delete in batches, each batch's connections and assets atomically
+    teardown = await institution_repo.delete_connections_with_assets(
+        institution_id=body.institution_id,
+        user_ids=list(dict.fromkeys(body.user_ids)) if body.user_ids else None,
+        batch_size=settings.connections_teardown_batch_size,
     )
 
-    # 3. Delete institution-connection-related assets
-    await portfolio_repo.delete(
-        users_institution=portfolios.UsersInstitutionRepoAdapter(
-            user_id=connection.user_id, institution_id=connection.institution_id
+    logger.info(
+        "Tore down %s account connections and %s assets. Detail: institution_id: %s, user_id count: %s"
+        % (
+            teardown.deleted_connections,
+            teardown.deleted_assets,
+            body.institution_id,
+            len(body.user_ids) if body.user_ids else None,
         )
     )
+    return teardown
+
+
+async def start_login_job(
+    connection: institutions.InstitutionConnection,
+    institution_service: IInstitutionService,
+    institution_repo: IInstitutionRepo,
+    background_tasks: BackgroundTasks,
+) -> institutions.LoginJob:
+    """Import a freshly logged in connection's holdings after the response is sent"""
+
+    login_job = await institution_repo.create_login_job(
+        job_id=str(uuid4()),
+        user_id=connection.user_id,
+        institution_id=connection.institution_id,
+    )
+
+    background_tasks.add_task(
+        ImportHoldingsTask(
+            institution_repo=institution_repo,
+            institution_service=institution_service,
+            job_id=login_job.job_id,
+            connection=connection,
+        ).task
+    )
+    return login_job
 
 
 @institution_router.post(
     "/login/{institution_id}",
     status_code=200,
-    response_model=Union[Mapping[str, Any], institutions.SuccessfulConnectionResponse],
+    response_model=Union[
+        Mapping[str, Any],
+        institutions.SuccessfulConnectionResponse,
+        institutions.LoginJob,
+    ],
 )
 async def login_to_institution(
+    response: Response,
+    background_tasks: BackgroundTasks,
     institution_id: constr(max_length=100) = Path(...),
     body: institutions.LoginRequest = Body(...),
+    asynchronous: bool = Query(
+        False,
+        description="Return 202 with a login job as soon as the login succeeds, and import holdings in the background.",
+    ),
     institution_service: IInstitutionService = Depends(get_institution_service),
+    institution_repo: IInstitutionRepo = Depends(get_institution_repo),
     authorized_user: users.UserInDB = Depends(get_current_active_user),
-) -> Union[Mapping[str, Any], institutions.SuccessfulConnectionResponse]:
+) -> Union[
+    Mapping[str, Any],
+    institutions.SuccessfulConnectionResponse,
+    institutions.LoginJob,
+]:
     """Login to institution"""
 
     try:
-        response = await institution_service.login(
+        login_response = await institution_service.login(
             credentials=body,
             user_id=authorized_user.user_id,
             institution_id=institution_id,
+            defer_holdings_import=asynchronous,
         )
     except (
         institutions.InstitutionApiError,
@@ -139,24 +294,42 @@ async def login_to_institution(
             detail=f"Robinhood API Error: {error}"
         ).robinhood()
 
-    if not response:
+    if isinstance(login_response, institutions.InstitutionConnection):
+        response.status_code = 202
+        return await start_login_job(
+            connection=login_response,
+            institution_service=institution_service,
+            institution_repo=institution_repo,
+            background_tasks=background_tasks,
+        )
+
+    if not login_response:
         return institutions.SuccessfulConnectionResponse(
             account_connection_status="connected", connected_at=datetime.utcnow()
         )
-    return response
+    return login_response
 
 
 @institution_router.post(
     "/login/{institution_id}/verify",
     status_code=201,
-    response_model=institutions.SuccessfulConnectionResponse,
+    response_model=Union[
+        institutions.SuccessfulConnectionResponse, institutions.LoginJob
+    ],
 )
 async def verify_login_with_code(
+    response: Response,
+    background_tasks: BackgroundTasks,
     institution_id: constr(max_length=100) = Path(...),
     body: institutions.MultiFactorAuthCodeRequest = Body(...),
+    asynchronous: bool = Query(
+        False,
+        description="Return 202 with a login job as soon as the login succeeds, and import holdings in the background.",
+    ),
     institution_service: IInstitutionService = Depends(get_institution_service),
+    institution_repo: IInstitutionRepo = Depends(get_institution_repo),
     authorized_user: users.UserInDB = Depends(get_current_active_user),
-) -> institutions.SuccessfulConnectionResponse:
+) -> Union[institutions.SuccessfulConnectionResponse, institutions.LoginJob]:
     """Verify login to institution with verifaction code"""
 
     # 1. Ensure that either with_challenge or without_challenge was supplied
@@ -168,10 +341,11 @@ async def verify_login_with_code(
         raise await pelleum_errors.PelleumErrors().general_bad_request()
 
     try:
-        await institution_service.send_multifactor_auth_code(
+        connection = await institution_service.send_multifactor_auth_code(
             verification_proof=body,
             user_id=authorized_user.user_id,
             institution_id=institution_id,
+            defer_holdings_import=asynchronous,
         )
     except (
         institutions.InstitutionApiError,
@@ -186,6 +360,53 @@ async def verify_login_with_code(
             detail=f"Robinhood API Error: {error}"
         ).robinhood()
 
+    if connection:
+        response.status_code = 202
+        return await start_login_job(
+            connection=connection,
+            institution_service=institution_service,
+            institution_repo=institution_repo,
+            background_tasks=background_tasks,
+        )
+
     return institutions.SuccessfulConnectionResponse(
         account_connection_status="connected", connected_at=datetime.utcnow()
     )
+
+
+@institution_router.get(
+    "/login/jobs/{job_id}",
+    status_code=200,
+    response_model=institutions.LoginJob,
+)
+async def retrieve_login_job(
+    job_id: constr(max_length=100) = Path(...),
+    institution_repo: IInstitutionRepo = Depends(get_institution_repo),
+    authorized_user: users.UserInDB = Depends(get_current_active_user),
+) -> institutions.LoginJob:
+    """Retrieve the progress of a login's holdings import"""
+
+    # 1. Retrieve the job, which must be the user's own
+    login_job = await institution_repo.retrieve_login_job(
+        job_id=job_id, user_id=authorized_user.user_id
+    )
+
+    if not login_job:
+        raise await pelleum_errors.PelleumErrors(
+            detail=f"There is no login job with job_id, {job_id}, for user_id, {authorized_user.user_id}."
+        ).resource_not_found()
+
+    # 2. An import still running this long was lost, e.g. to a restart, so stop polling it
+    if login_job.status == institutions.LoginJobStatus.IMPORTING:
+        stale_login_job = await institution_repo.fail_stale_login_job(
+            job_id=job_id,
+            started_before=timedelta(seconds=settings.login_job_timeout),
+            error="The holdings import did not finish. Please log in again.",
+        )
+        if stale_login_job:
+            logger.warning(
+                "Failed a login job stuck importing. Detail: job_id: %s" % job_id
+            )
+            return stale_login_job
+
+    return login_job
@@ -0,0 +1,49 @@
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from pydantic import constr
+
+from app.dependencies import get_current_active_superuser, get_portfolio_repo
+from app.settings import settings
+from app.usecases.interfaces.repos.portfolio_repo import IPortfolioRepo
+from app.usecases.schemas import users
+
+portfolio_router = APIRouter(tags=["Portfolios"])
+
+
+@portfolio_router.get(
+    "/assets/export",
+    status_code=200,
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def export_assets(
+    institution_id: Optional[constr(max_length=100)] = Query(None),
+    updated_since: Optional[datetime] = Query(
+        None, description="Only export assets updated at or after this time (UTC)."
+    ),
+    portfolio_repo: IPortfolioRepo = Depends(get_portfolio_repo),
+    authorized_user: users.UserInDB = Depends(get_current_active_superuser),
+) -> StreamingResponse:
+    """Export every user's synced assets as newline-delimited JSON, one asset per line.
+    Superusers only."""
+
+    async def assets_ndjson() -> AsyncIterator[str]:
+        # Rows are written in chunks as the cursor yields them, never all held at once
+        chunk = []
+        async for asset in portfolio_repo.stream_assets(
+            institution_id=institution_id,
+            updated_since=updated_since,
+            prefetch=settings.assets_export_batch_size,
+        ):
+            chunk.append(asset.json())
+            if len(chunk) >= settings.assets_export_batch_size:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+
+    return StreamingResponse(assets_ndjson(), media_type="application/x-ndjson")
@@ -1,17 +1,31 @@
+import asyncio
+import os
+import signal
+
 import click
 import uvicorn
 from fastapi import FastAPI
 
 from app.dependencies import get_client_session, get_event_loop
+from app.dependencies.auth import (
+    start_user_changes_listener,
+    stop_user_changes_listener,
+)
 
 # This line must be imported after app.dependencies to avoid a circular import (dependencies calls get_user_repo, which depends on get_or_create_database).
-from app.infrastructure.db.core import get_or_create_database
+from app.infrastructure.db.core import (
+    get_or_create_database,
+    get_or_create_replica_database,
+)
 from app.infrastructure.tasks.events.startup import (
-    start_ongoing_holdings_sync,
-    start_ongoing_token_refresh,
+    run_assets_backfill,
+    start_background_tasks,
+    start_event_loop_monitor,
+    stop_background_tasks,
+    stop_event_loop_monitor,
 )
 from app.infrastructure.web.endpoints import health
-from app.infrastructure.web.endpoints.private import institutions
+from app.infrastructure.web.endpoints.private import institutions, portfolios
 from app.settings import settings
 
 
@@ -22,6 +36,7 @@ def setup_app():
         openapi_url=settings.openapi_url,
     )
     app.include_router(institutions.institution_router, prefix="/private/institutions")
+    app.include_router(portfolios.portfolio_router, prefix="/private/portfolios")
     app.include_router(health.health_router, prefix="/health")
 
     return app
@@ -33,28 +48,36 @@ fastapi_app = setup_app()
 @fastapi_app.on_event("startup")
 async def startup_event():
     await get_event_loop()
+    await start_event_loop_monitor()
     await get_client_session()
     await get_or_create_database()
-    await start_ongoing_holdings_sync()
-    await start_ongoing_token_refresh()
+    await start_user_changes_listener()
+    if settings.run_background_tasks:
+        await start_background_tasks()
 
 
 @fastapi_app.on_event("shutdown")
 async def shutdown_event():
+    await stop_background_tasks()
+    await stop_event_loop_monitor()
+
     # Close client session
     client_session = await get_client_session()
     await client_session.close()
 
-    # Close database connection once db exists
+    await stop_user_changes_listener()
+
+    # Close database connections once dbs exist
+    REPLICA_DATABASE = await get_or_create_replica_database()
+    if REPLICA_DATABASE.is_connected:
+        await REPLICA_DATABASE.disconnect()
+
     DATABASE = await get_or_create_database()
     if DATABASE.is_connected:
         await DATABASE.disconnect()
 
 
-@click.command()
-@click.option("--reload", is_flag=True)
-def main(reload=False):
-
+def serve(reload: bool = False):
     kwargs = {"reload": reload}
 
     uvicorn.run(
@@ -64,3 +87,72 @@ def main(reload=False):
         port=settings.server_port,
         **kwargs,
     )
+
+
+@click.group(invoke_without_command=True)
+@click.option("--reload", is_flag=True)
+@click.pass_context
+def main(ctx, reload=False):
+    # With no subcommand, `python -m app` serves the API and, per RUN_BACKGROUND_TASKS, runs the tasks
+    if ctx.invoked_subcommand is not None:
+        return
+
+    serve(reload=reload)
+
+
+@main.command("web")
+@click.option("--reload", is_flag=True)
+def web(reload=False):
+    """Serve the API without running the background tasks."""
+
+    # Set in the environment too, so reloaded and worker processes inherit it
+    os.environ["RUN_BACKGROUND_TASKS"] = "false"
+    settings.run_background_tasks = False
+    serve(reload=reload)
+
+
+@main.command("worker")
+def worker():
+    """Run the background tasks without serving the API."""
+
+    async def run_worker():
+        loop = await get_event_loop()
+        stopping = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopping.set)
+
+        await start_event_loop_monitor()
+        await get_client_session()
+        await get_or_create_database()
+        await start_background_tasks()
+        try:
+            await stopping.wait()
+        finally:
+            await shutdown_event()
+
+    asyncio.run(run_worker())
+
+
+@main.command("backfill-assets")
+@click.option(
+    "--batch-size",
+    default=500,
+    show_default=True,
+    help="Connections whose holdings are merged into assets in one transaction.",
+)
+@click.option(
+    "--concurrency",
+    default=10,
+    show_default=True,
+    help="Brokerage requests in flight at once.",
+)
+def backfill_assets(batch_size, concurrency):
+    """Re-seed assets for every active connection from its brokerage."""
+
+    async def backfill():
+        try:
+            await run_assets_backfill(batch_size=batch_size, concurrency=concurrency)
+        finally:
+            await shutdown_event()
+
+    asyncio.run(backfill())
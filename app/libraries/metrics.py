@@ -0,0 +1,188 @@
+from collections import deque
+from threading import Lock
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+# Default buckets: seconds for latencies, counts for rows, and bytes for payloads
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024**2, 10 * 1024**2)
+
+
+def format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    """A monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        return [(self.name, "", self.value)]
+
+
+class Summary:
+    """Observations' total and count, plus quantiles over the most recent max_samples"""
+
+    kind = "summary"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        quantiles: Iterable[float] = (0.5, 0.9, 0.99, 1.0),
+        max_samples: int = 1000,
+    ):
+        self.name = name
+        self.description = description
+        self.quantiles = tuple(quantiles)
+        self.sum = 0.0
+        self.count = 0
+        self._recent: "deque[float]" = deque(maxlen=max_samples)
+        self._lock = Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            self._recent.append(value)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            recent = sorted(self._recent)
+            total, count = self.sum, self.count
+
+        samples = []
+        if recent:
+            samples.extend(
+                (
+                    self.name,
+                    f'{{quantile="{quantile}"}}',
+                    recent[min(int(quantile * len(recent)), len(recent) - 1)],
+                )
+                for quantile in self.quantiles
+            )
+        samples.append((f"{self.name}_sum", "", total))
+        samples.append((f"{self.name}_count", "", count))
+        return samples
+
+
+class Histogram:
+    """Cumulative bucket counts, total and count of observations, per label values"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+        label_names: Iterable[str] = (),
+    ):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.label_names = tuple(label_names)
+        # label values -> [bucket counts, sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        label_values = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            series = {
+                label_values: (list(bucket_counts), total, count)
+                for label_values, (bucket_counts, total, count) in self._series.items()
+            }
+
+        samples = []
+        for label_values, (bucket_counts, total, count) in sorted(series.items()):
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        format_labels(labels + [("le", str(upper_bound))]),
+                        cumulative,
+                    )
+                )
+            samples.append(
+                (f"{self.name}_bucket", format_labels(labels + [("le", "+Inf")]), count)
+            )
+            samples.append((f"{self.name}_sum", format_labels(labels), total))
+            samples.append((f"{self.name}_count", format_labels(labels), count))
+        return samples
+
+
+Metric = Union[Counter, Summary, Histogram]
+
+
+class MetricsRegistry:
+    """Named metrics, rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._get_or_create(Counter, name, description)
+
+    def summary(self, name: str, description: str, **kwargs) -> Summary:
+        return self._get_or_create(Summary, name, description, **kwargs)
+
+    def histogram(self, name: str, description: str, **kwargs) -> Histogram:
+        return self._get_or_create(Histogram, name, description, **kwargs)
+
+    def _get_or_create(self, metric_type, name: str, description: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = metric_type(name, description, **kwargs)
+        elif not isinstance(metric, metric_type):
+            raise ValueError(f"Metric {name!r} is already a {metric.kind}.")
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(
+                f"{name}{labels} {value}" for name, labels, value in metric.samples()
+            )
+        return "\n".join(lines) + "\n"
+
+
+# The process-wide registry served by GET /health/metrics
+METRICS = MetricsRegistry()
@@ -14,6 +14,11 @@ invalid_credentials = HTTPException(
 
 inactive_user_error = HTTPException(status_code=400, detail="Inactive user")
 
+insufficient_privileges_error = HTTPException(
+    status_code=status.HTTP_403_FORBIDDEN,
+    detail="The user doesn't have enough privileges",
+)
+
 
 class PelleumErrors:
     def __init__(self, detail: str = None):
@@ -1,4 +1,5 @@
 from os import path
+from typing import Dict, Optional
 
 from pydantic import BaseSettings
 
@@ -15,8 +16,19 @@ class Settings(BaseSettings):
     openapi_url: str = "/openapi.json"
 
     db_url: str
+    db_replica_url: Optional[str] = None
+    db_pool_min_size: int = 5
+    db_pool_max_size: int = 20
+    db_statement_cache_size: int = 1024
+    db_command_timeout: Optional[float] = None
+    db_max_inactive_connection_lifetime: float = 300.0
 
     token_url: str
+    auth_user_cache_ttl: int = 60
+    auth_cache_max_size: int = 10000
+    user_changes_channel: Optional[str] = None
+    user_changes_retry_interval: float = 1
+    user_changes_max_retry_interval: float = 60
     json_web_token_secret: str
     json_web_token_algorithm: str
 
@@ -24,9 +36,48 @@ class Settings(BaseSettings):
     robinhood_device_token: str
 
     encryption_secret_key: str
+    encryption_key_id: str = "0"
+    encryption_retired_keys: Dict[str, str] = {}
+    encryption_rotation_enabled: bool = False
+    encryption_rotation_batch_size: int = 200
+    encryption_rotation_batch_interval: float = 1.0
+    encryption_offload_threshold: int = 64
+    encryption_offload_chunk_size: int = 64
+    encryption_thread_pool_size: int = 4
+    json_web_token_expiry_leeway: int = 60
+
+    supported_institutions_cache_ttl: int = 3600
+    assets_export_batch_size: int = 1000
+    connections_teardown_batch_size: int = 500
+    connections_batch_max_users: int = 500
+    login_job_timeout: int = 60 * 10
+
+    event_loop_monitor_enabled: bool = True
+    event_loop_monitor_interval: float = 0.1
+    event_loop_block_threshold: float = 0.25
+
+    robinhood_slow_request_threshold: float = 2.0
+    db_slow_query_threshold: float = 0.5
+
+    run_background_tasks: bool = True
+    leader_election_lock_key: int = 7163530112
+    leader_election_heartbeat_interval: float = 10
+    leader_election_heartbeat_timeout: float = 5
+    leader_election_retry_interval: float = 15
 
     asset_update_task_frequency: int = 3600 * 24
-    refresh_tokens_task_frequency: int = 3600 * 24
+    holdings_sync_page_size: int = 1000
+    holdings_sync_checkpoint_interval: int = 100
+    holdings_sync_retry_interval: int = 60 * 5
+    background_tasks_drain_timeout: float = 20
+    portfolio_changes_channel: str = "portfolio_changes"
+    fused_connection_sync: bool = False
+    deactivation_batch_size: int = 500
+    refresh_tokens_lead_time: int = 3600
+    refresh_tokens_poll_interval: int = 60 * 15
+    refresh_tokens_retry_interval: int = 60 * 5
+    refresh_tokens_concurrency: int = 10
+    refresh_tokens_write_batch_size: int = 200
 
     class Config:
         env_file = DOTENV_FILE
@@ -12,8 +12,10 @@ class IRobinhoodClient(ABC):
         endpoint: str,
         headers: Optional[Mapping[str, str]] = None,
         json_body: Optional[Mapping[str, Any]] = None,
+        endpoint_template: Optional[str] = None,
     ) -> Mapping[str, Any]:
-        """Facilitate actual API call"""
+        """Facilitate actual API call. The call is timed under endpoint_template, or
+        endpoint without its query string."""
 
     @abstractmethod
     async def login(
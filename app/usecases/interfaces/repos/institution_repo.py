@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
 
 from app.usecases.schemas import institutions
 
@@ -13,12 +14,17 @@ class IInstitutionRepo(ABC):
 
     @abstractmethod
     async def retrieve_institution(
-        self, name: str = None, institution_id: str = None
+        self,
+        name: str = None,
+        institution_id: str = None,
+        use_primary: bool = False,
     ) -> Optional[institutions.Institution]:
         """Retrieve Pelleum supported institution by name or institution_id"""
 
     @abstractmethod
-    async def retrieve_all_institutions(self) -> List[institutions.Institution]:
+    async def retrieve_all_institutions(
+        self, use_primary: bool = False
+    ) -> List[institutions.Institution]:
         """Retrieve all Pelleum supported institutions"""
 
     @abstractmethod
@@ -28,6 +34,7 @@ class IInstitutionRepo(ABC):
         user_id: str = None,
         institution_id: str = None,
         is_active: bool = None,
+        use_primary: bool = False,
     ) -> Optional[institutions.InstitutionConnection]:
         """Retrieve signle user-institution connection"""
 
@@ -36,9 +43,25 @@ class IInstitutionRepo(ABC):
         self,
         connection_id: int,
         updated_connection: institutions.UpdateConnectionRepoAdapter,
-    ) -> institutions.InstitutionConnection:
+    ) -> Optional[institutions.InstitutionConnection]:
         """Update a signle user-institution connection by connection_id"""
 
+    @abstractmethod
+    async def update_many_connection_tokens(
+        self,
+        updated_tokens: List[institutions.UpdateConnectionTokensRepoAdapter],
+        batch_size: int = 500,
+    ) -> None:
+        """Store refreshed tokens for many connections, one statement per batch,
+        without reading the connections back"""
+
+    @abstractmethod
+    async def deactivate_many_institution_connections(
+        self, connection_ids: List[int], batch_size: int = 5000
+    ) -> None:
+        """Set is_active to False for many connections, one statement per batch,
+        without reading the connections back"""
+
     @abstractmethod
     async def retrieve_many_institution_connections(
         self,
@@ -46,21 +69,106 @@ class IInstitutionRepo(ABC):
         skip_locked: int = False,
         page_number: int = 1,
         page_size: int = 10000,
+        use_primary: bool = False,
     ) -> List[institutions.ConnectionJoinInstitutionJoinPortfolio]:
         """Retrieve many institution connections"""
 
+    @abstractmethod
+    def stream_institution_connections(
+        self,
+        query_params: institutions.RetrieveManyConnectionsRepoAdapter,
+        page_size: int = 1000,
+        after_connection_id: int = 0,
+    ) -> AsyncIterator[institutions.ConnectionJoinInstitutionJoinPortfolio]:
+        """Yield many institution connections in connection_id order, starting after
+        after_connection_id and fetching page_size at a time"""
+
+    @abstractmethod
+    def stream_connection_secrets(
+        self, page_size: int = 1000, after_connection_id: int = 0
+    ) -> AsyncIterator[institutions.ConnectionSecrets]:
+        """Yield every connection's encrypted columns, active or not, in connection_id
+        order, starting after after_connection_id and fetching page_size at a time"""
+
+    @abstractmethod
+    async def update_many_connection_secrets(
+        self, rotated_secrets: List[institutions.RotatedConnectionSecretsRepoAdapter]
+    ) -> None:
+        """Store re-encrypted columns for many connections in one statement, leaving
+        any column that changed since it was read untouched"""
+
+    @abstractmethod
+    async def retrieve_users_institution_connections(
+        self, user_ids: List[int], use_primary: bool = False
+    ) -> List[institutions.ConnectionJoinInstitutionJoinPortfolio]:
+        """Retrieve every institution connection belonging to any of user_ids"""
+
+    @abstractmethod
+    async def retrieve_connections_due_for_refresh(
+        self, expires_before: datetime, limit: int = 10000
+    ) -> List[institutions.ConnectionJoinInstitutionJoinPortfolio]:
+        """Retrieve active, refreshable connections whose JSON web token expires
+        before expires_before, soonest first (unknown expiry counts as due)"""
+
+    @abstractmethod
+    async def retrieve_next_token_expiry(self) -> Optional[datetime]:
+        """Retrieve the soonest JSON web token expiry among active, refreshable connections"""
+
     @abstractmethod
     async def create_robinhood_instrument(
         self, instrument_id: str, name: str, symbol: str
-    ) -> None:
+    ) -> institutions.RobinhoodInstrument:
         """Creates Robinhood instrument in our DB for future reference"""
 
     @abstractmethod
     async def retrieve_robinhood_instruments(
-        self, instrument_ids: list
+        self,
+        instrument_ids: list,
+        use_primary: bool = False,
     ) -> List[institutions.RobinhoodInstrument]:
         """Retrieve many instruments by supplied instrument_ids list"""
 
     @abstractmethod
-    async def delete(self, institution_id: int) -> None:
+    async def create_login_job(
+        self, job_id: str, user_id: int, institution_id: str
+    ) -> institutions.LoginJob:
+        """Record that a login's holdings import has started"""
+
+    @abstractmethod
+    async def update_login_job(
+        self,
+        job_id: str,
+        status: institutions.LoginJobStatus,
+        imported_assets: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """Record how a login's holdings import ended"""
+
+    @abstractmethod
+    async def fail_stale_login_job(
+        self, job_id: str, started_before: timedelta, error: str
+    ) -> Optional[institutions.LoginJob]:
+        """Mark a login job failed if it is still importing more than started_before
+        after it was created, and return it; None if it is not stale"""
+
+    @abstractmethod
+    async def retrieve_login_job(
+        self, job_id: str, user_id: int
+    ) -> Optional[institutions.LoginJob]:
+        """Retrieve one of a user's login jobs"""
+
+    @abstractmethod
+    async def delete_connections_with_assets(
+        self,
+        institution_id: Optional[str] = None,
+        user_ids: Optional[List[int]] = None,
+        batch_size: int = 500,
+    ) -> institutions.ConnectionsTeardown:
+        """Delete the connections matching institution_id and/or user_ids, together with
+        their assets. Each batch of batch_size connections is deleted atomically."""
+
+    @abstractmethod
+    async def delete(
+        self, connection_id: int
+    ) -> Optional[institutions.InstitutionConnection]:
         """Delete connection"""
@@ -1,14 +1,39 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
 
 from app.usecases.schemas import portfolios
 
 
 class IPortfolioRepo(ABC):
     @abstractmethod
-    async def upsert_asset(self, new_asset: portfolios.UpsertAssetRepoAdapter) -> None:
+    async def upsert_asset(
+        self, new_asset: portfolios.UpsertAssetRepoAdapter
+    ) -> portfolios.AssetInDB:
         """Creates new asset"""
 
+    @abstractmethod
+    async def upsert_many_assets(
+        self,
+        new_assets: List[portfolios.UpsertAssetRepoAdapter],
+        copy_threshold: int = 1000,
+    ) -> None:
+        """Creates or updates many assets"""
+
+    @abstractmethod
+    async def replace_brokerage_assets(
+        self,
+        users_institutions: List[portfolios.UsersInstitutionRepoAdapter],
+        new_assets: List[portfolios.UpsertAssetRepoAdapter],
+    ) -> None:
+        """Make new_assets the complete holdings of each of users_institutions"""
+
+    @abstractmethod
+    async def publish_portfolio_change(
+        self, portfolio_change: portfolios.PortfolioChange, channel: str
+    ) -> None:
+        """NOTIFY listeners on channel that a user's holdings changed"""
+
     @abstractmethod
     async def update_asset(
         self,
@@ -16,7 +41,7 @@ class IPortfolioRepo(ABC):
         asset_symbol: str,
         institution_id: int,
         updated_asset: portfolios.UpdateAssetRepoAdapter,
-    ) -> None:
+    ) -> Optional[portfolios.AssetInDB]:
         """
         Update an individual asset holding by the composite index, (user_id,
         asset_symbol, and institution_id)
@@ -29,6 +54,7 @@ class IPortfolioRepo(ABC):
         user_id: int = None,
         institution_id: str = None,
         asset_symbol: str = None,
+        use_primary: bool = False,
     ) -> Optional[portfolios.AssetInDB]:
         """Retrieve signle asset"""
 
@@ -37,13 +63,24 @@ class IPortfolioRepo(ABC):
         self,
         user_id: int,
         institution_id: str,
+        use_primary: bool = False,
     ) -> List[portfolios.AssetInDB]:
         """Retrieve all assets in a linked brokerage by user_id"""
 
+    @abstractmethod
+    def stream_assets(
+        self,
+        institution_id: Optional[str] = None,
+        updated_since: Optional[datetime] = None,
+        prefetch: int = 1000,
+    ) -> AsyncIterator[portfolios.AssetInDB]:
+        """Yield every asset, optionally only one institution's or only those updated
+        at or after updated_since, in asset_id order, fetching prefetch at a time"""
+
     @abstractmethod
     async def delete(
         self,
         asset_id: Optional[int] = None,
         users_institution: Optional[portfolios.UsersInstitutionRepoAdapter] = None,
-    ) -> None:
+    ) -> List[portfolios.AssetInDB]:
         """Delete asset(s)"""
@@ -0,0 +1,24 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from app.usecases.schemas import sync_runs
+
+
+class ISyncRunRepo(ABC):
+    @abstractmethod
+    async def create(self, task_name: str) -> sync_runs.SyncRun:
+        """Start a new run of task_name"""
+
+    @abstractmethod
+    async def retrieve_latest_run(self, task_name: str) -> Optional[sync_runs.SyncRun]:
+        """Retrieve task_name's most recent run, finished or not"""
+
+    @abstractmethod
+    async def checkpoint(
+        self, run_id: int, last_connection_id: int, processed_connections: int
+    ) -> None:
+        """Save how far a run has got"""
+
+    @abstractmethod
+    async def complete(self, run_id: int, processed_connections: int) -> None:
+        """Mark a run as finished"""
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import List
 
 
 class IEncryptionService(ABC):
@@ -9,3 +10,16 @@ class IEncryptionService(ABC):
     @abstractmethod
     async def decrypt(self, encrypted_secret: str) -> str:
         """Returns decrypted secret"""
+
+    @abstractmethod
+    async def encrypt_many(self, secrets: List[str]) -> List[str]:
+        """Returns encrypted secrets, in order"""
+
+    @abstractmethod
+    async def decrypt_many(self, encrypted_secrets: List[str]) -> List[str]:
+        """Returns decrypted secrets, in order"""
+
+    @abstractmethod
+    async def rotate_many(self, encrypted_secrets: List[str]) -> List[str]:
+        """Returns encrypted secrets re-encrypted under the current key, in order.
+        Secrets already under the current key are returned unchanged."""
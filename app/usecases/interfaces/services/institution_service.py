@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Any, Mapping
+from typing import Any, Mapping, Optional, Union
 
 from app.usecases.schemas import institutions
 
@@ -11,8 +11,10 @@ class IInstitutionService(ABC):
         credentials: institutions.UserCredentials,
         user_id: int,
         institution_id: str,
-    ) -> Mapping[str, Any]:
-        """Login to Institution"""
+        defer_holdings_import: bool = False,
+    ) -> Union[Mapping[str, Any], institutions.InstitutionConnection]:
+        """Login to Institution. With defer_holdings_import, a successful login returns
+        the connection without importing holdings; call import_holdings() with it."""
 
     @abstractmethod
     async def send_multifactor_auth_code(
@@ -20,17 +22,37 @@ class IInstitutionService(ABC):
         verification_proof: institutions.UserVerificationCredentials,
         user_id: int,
         institution_id: str,
-    ) -> institutions.UserBrokerageHoldings:
-        """Sends multi-factor auth code to institution and returns holdings"""
+        defer_holdings_import: bool = False,
+    ) -> Optional[institutions.InstitutionConnection]:
+        """Sends multi-factor auth code to institution and imports holdings. With
+        defer_holdings_import, returns the connection without importing holdings;
+        call import_holdings() with it."""
+
+    @abstractmethod
+    async def import_holdings(
+        self, connection: institutions.InstitutionConnection
+    ) -> int:
+        """Retrieve a freshly logged in connection's holdings from the institution and
+        save them as assets. Returns how many holdings were imported."""
 
     @abstractmethod
     async def get_recent_holdings(
-        self, encrypted_json_web_token: str
+        self,
+        encrypted_json_web_token: Optional[str] = None,
+        json_web_token: Optional[str] = None,
     ) -> institutions.UserBrokerageHoldings:
-        """Returns most recent holdings directly from institution"""
+        """Returns most recent holdings directly from institution. Pass json_web_token
+        instead of encrypted_json_web_token when the decrypted token is already at hand."""
+
+    @abstractmethod
+    async def json_web_token_is_expired(self, encrypted_json_web_token: str) -> bool:
+        """Returns whether the JSON web token has expired, without calling the institution"""
 
     @abstractmethod
     async def refresh_token(
-        self, encrypted_refresh_token: str
+        self,
+        encrypted_refresh_token: Optional[str] = None,
+        refresh_token: Optional[str] = None,
     ) -> institutions.SuccessfulTokenRefreshResponse:
-        """Request new JSON web token from Robinhood."""
+        """Request new JSON web token from Robinhood. Pass refresh_token instead of
+        encrypted_refresh_token when the decrypted token is already at hand."""
@@ -11,5 +11,6 @@ class IUserRepo(ABC):
         user_id: str = None,
         email: str = None,
         username: str = None,
+        use_primary: bool = False,
     ) -> Union[users.UserInDB, None]:
         """Retrieves user from database"""
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -112,3 +112,24 @@ class UsersInstitutionRepoAdapter(BaseModel):
 
     user_id: int
     institution_id: str
+
+
+class PortfolioChange(BaseModel):
+    """Published on the portfolio changes channel once a user's holdings are saved"""
+
+    user_id: int
+    institution_id: str
+    added: List[str] = Field([], description="Symbols newly held.", example=["TSLA"])
+    removed: List[str] = Field(
+        [], description="Symbols no longer held.", example=["AAPL"]
+    )
+    changed: List[str] = Field(
+        [],
+        description="Symbols still held whose quantity or average buy price changed.",
+        example=["MSFT"],
+    )
+    truncated: bool = Field(
+        False,
+        description="The symbol lists were too long for one notification and were left out, so consumers should re-read all of the user's assets for this institution.",
+        example=False,
+    )
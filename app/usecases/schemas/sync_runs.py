@@ -0,0 +1,28 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class SyncRun(BaseModel):
+    """Database Model"""
+
+    run_id: int = Field(..., description="The unique identifier for a sync run.")
+    task_name: str = Field(
+        ..., description="The background task doing the run.", example="GetHoldingsTask"
+    )
+    last_connection_id: int = Field(
+        ...,
+        description="The checkpoint: every account connection up to and including this one has been processed.",
+        example=1500,
+    )
+    processed_connections: int = Field(
+        ...,
+        description="How many account connections the run has processed so far.",
+        example=1200,
+    )
+    completed_at: Optional[datetime] = Field(
+        None, description="When the run finished, or null while it is unfinished."
+    )
+    created_at: datetime
+    updated_at: datetime
@@ -1,11 +1,136 @@
+import asyncio
 from base64 import b64decode, b64encode
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
 
 from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
+from Crypto.Random import get_random_bytes
+from Crypto.Util.Padding import unpad
 
 from app.settings import settings
 from app.usecases.interfaces.services.encryption_service import IEncryptionService
 
+ENCRYPTION_EXECUTOR: Optional[ThreadPoolExecutor] = None
+
+# Versioned ciphertexts look like "v2:<key id>:<base64 nonce + ciphertext + tag>".
+# Base64 never contains ":", so anything else is a legacy AES-CBC ciphertext
+# (base64 ciphertext with its base64 IV appended), made with key id "0".
+ENVELOPE_VERSION = "v2"
+LEGACY_KEY_ID = "0"
+GCM_NONCE_SIZE = 12
+GCM_TAG_SIZE = 16
+
+
+@lru_cache(maxsize=None)
+def get_encryption_keys() -> Dict[str, bytes]:
+    """Every AES key that can decrypt, by key id, base64-decoded once per process"""
+
+    return {
+        **{
+            key_id: b64decode(key.encode())
+            for key_id, key in settings.encryption_retired_keys.items()
+        },
+        settings.encryption_key_id: b64decode(settings.encryption_secret_key.encode()),
+    }
+
+
+def get_encryption_key(key_id: str) -> bytes:
+    try:
+        return get_encryption_keys()[key_id]
+    except KeyError:
+        raise ValueError(
+            f"No encryption key with id {key_id!r}; add it to ENCRYPTION_RETIRED_KEYS."
+        ) from None
+
+
+def get_encryption_executor() -> ThreadPoolExecutor:
+    global ENCRYPTION_EXECUTOR
+    if ENCRYPTION_EXECUTOR is None:
+        ENCRYPTION_EXECUTOR = ThreadPoolExecutor(
+            max_workers=settings.encryption_thread_pool_size,
+            thread_name_prefix="encryption",
+        )
+    return ENCRYPTION_EXECUTOR
+
+
+def encrypt_secret(secret: str) -> str:
+    """AES-GCM under the current key. The envelope header is authenticated too, so
+    a ciphertext cannot be relabelled with another key id."""
+
+    header = f"{ENVELOPE_VERSION}:{settings.encryption_key_id}:"
+    cipher = AES.new(
+        get_encryption_key(settings.encryption_key_id),
+        AES.MODE_GCM,
+        nonce=get_random_bytes(GCM_NONCE_SIZE),
+    )
+    cipher.update(header.encode())
+    encrypted_bytes, tag = cipher.encrypt_and_digest(secret.encode())
+    return header + b64encode(cipher.nonce + encrypted_bytes + tag).decode("utf-8")
+
+
+def decrypt_secret(encrypted_secret: str) -> str:
+    if ":" not in encrypted_secret:
+        return decrypt_legacy_secret(encrypted_secret)
+
+    version, key_id, payload = encrypted_secret.split(":", 2)
+    if version != ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported ciphertext version {version!r}.")
+
+    sealed = b64decode(payload)
+    cipher = AES.new(
+        get_encryption_key(key_id), AES.MODE_GCM, nonce=sealed[:GCM_NONCE_SIZE]
+    )
+    cipher.update(f"{version}:{key_id}:".encode())
+    return cipher.decrypt_and_verify(
+        sealed[GCM_NONCE_SIZE:-GCM_TAG_SIZE], sealed[-GCM_TAG_SIZE:]
+    ).decode("utf-8")
+
+
+def decrypt_legacy_secret(encrypted_secret: str) -> str:
+    iv = b64decode(encrypted_secret[-24:].encode())
+    encrypted_data = b64decode(encrypted_secret[:-24])
+    cipher = AES.new(get_encryption_key(LEGACY_KEY_ID), AES.MODE_CBC, iv)
+    return unpad(cipher.decrypt(encrypted_data), AES.block_size).decode("utf-8")
+
+
+def is_current(encrypted_secret: str) -> bool:
+    """Whether a ciphertext is already in the current format under the current key"""
+
+    return encrypted_secret.startswith(
+        f"{ENVELOPE_VERSION}:{settings.encryption_key_id}:"
+    )
+
+
+def rotate_secret(encrypted_secret: str) -> str:
+    if is_current(encrypted_secret):
+        return encrypted_secret
+    return encrypt_secret(decrypt_secret(encrypted_secret))
+
+
+async def apply_to_batch(
+    function: Callable[[str], str], values: List[str]
+) -> List[str]:
+    """Run function over values on the event loop, or, for batches of at least
+    settings.encryption_offload_threshold, in chunks on the encryption thread pool"""
+
+    if len(values) < settings.encryption_offload_threshold:
+        return [function(value) for value in values]
+
+    chunk_size = settings.encryption_offload_chunk_size
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(
+        *[
+            loop.run_in_executor(
+                get_encryption_executor(),
+                lambda chunk: [function(value) for value in chunk],
+                values[chunk_start : chunk_start + chunk_size],
+            )
+            for chunk_start in range(0, len(values), chunk_size)
+        ]
+    )
+    return [result for chunk in chunks for result in chunk]
+
 
 class EncryptionService(IEncryptionService):
     def __init__(self):
@@ -14,21 +139,25 @@ class EncryptionService(IEncryptionService):
     async def encrypt(self, secret: str) -> str:
         """Returns encrypted secret"""
 
-        encryption_secret_key = b64decode(settings.encryption_secret_key.encode())
-        cipher = AES.new(encryption_secret_key, AES.MODE_CBC)
-        iv_string = b64encode(cipher.iv).decode("utf-8")
-        encypted_bytes = cipher.encrypt(pad(secret.encode(), AES.block_size))
-        enrypted_secret_string = b64encode(encypted_bytes).decode("utf-8")
-        return enrypted_secret_string + iv_string
+        return encrypt_secret(secret)
 
     async def decrypt(self, encrypted_secret: str) -> str:
         """Returns decrypted secret"""
 
-        encryption_secret_key = b64decode(settings.encryption_secret_key.encode())
-        iv = b64decode(encrypted_secret[-24:].encode())
-        encrypted_data = b64decode(encrypted_secret[:-24])
-        cipher = AES.new(encryption_secret_key, AES.MODE_CBC, iv)
-        decrypted_data = unpad(cipher.decrypt(encrypted_data), AES.block_size).decode(
-            "utf-8"
-        )
-        return decrypted_data
+        return decrypt_secret(encrypted_secret)
+
+    async def encrypt_many(self, secrets: List[str]) -> List[str]:
+        """Returns encrypted secrets, in order"""
+
+        return await apply_to_batch(encrypt_secret, secrets)
+
+    async def decrypt_many(self, encrypted_secrets: List[str]) -> List[str]:
+        """Returns decrypted secrets, in order"""
+
+        return await apply_to_batch(decrypt_secret, encrypted_secrets)
+
+    async def rotate_many(self, encrypted_secrets: List[str]) -> List[str]:
+        """Returns encrypted secrets re-encrypted under the current key, in order.
+        Secrets already under the current key are returned unchanged."""
+
+        return await apply_to_batch(rotate_secret, encrypted_secrets)
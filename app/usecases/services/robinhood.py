@@ -1,5 +1,9 @@
+from datetime import datetime, timedelta
+from time import time
 from typing import Any, List, Mapping, Optional, Union
 
+from jose import JWTError, jwt
+
 from app.libraries import pelleum_errors
 from app.settings import settings
 from app.usecases.interfaces.clients.robinhood import IRobinhoodClient
@@ -8,7 +12,7 @@ from app.usecases.interfaces.repos.portfolio_repo import IPortfolioRepo
 from app.usecases.interfaces.services.encryption_service import IEncryptionService
 from app.usecases.interfaces.services.institution_service import IInstitutionService
 from app.usecases.schemas import institutions, robinhood
-from app.usecases.schemas.portfolios import UpsertAssetRepoAdapter
+from app.usecases.schemas.portfolios import PortfolioChange, UpsertAssetRepoAdapter
 
 
 class RobinhoodService(IInstitutionService):
@@ -31,13 +35,19 @@ class RobinhoodService(IInstitutionService):
         credentials: institutions.UserCredentials,
         user_id: int,
         institution_id: str,
-    ) -> Union[Mapping[str, Any], robinhood.CreateOrUpdateAssetsOnLogin]:
-        """Login to Robinhood"""
+        defer_holdings_import: bool = False,
+    ) -> Union[
+        Mapping[str, Any],
+        robinhood.CreateOrUpdateAssetsOnLogin,
+        institutions.InstitutionConnection,
+    ]:
+        """Login to Robinhood. With defer_holdings_import, a successful login returns
+        the connection without importing holdings; call import_holdings() with it."""
 
         # 1. See if an account-connection is already active
         previous_connection = (
             await self._insitution_repo.retrieve_institution_connection(
-                user_id=user_id, institution_id=institution_id
+                user_id=user_id, institution_id=institution_id, use_primary=True
             )
         )
 
@@ -79,17 +89,12 @@ class RobinhoodService(IInstitutionService):
                     successful_login_response=successful_login_response,
                 )
 
-                # 6. Get most recent holdings
-                recent_holdings = await self.get_recent_holdings(
-                    encrypted_json_web_token=connection.json_web_token
-                )
+                if defer_holdings_import:
+                    return connection
 
-                # 7. Upsert assets in our database
-                return await self.__upsert_assets(
-                    user_id=user_id,
-                    institution_id=institution_id,
-                    holdings=recent_holdings.holdings,
-                )
+                # 6. Get most recent holdings and upsert them in our database
+                await self.import_holdings(connection=connection)
+                return None
 
         # 5. For users with 2FA, save or update credentials and retrun Robinhood response
         _ = await self.__upsert_institution_connection(
@@ -105,12 +110,15 @@ class RobinhoodService(IInstitutionService):
         verification_proof: institutions.UserVerificationCredentials,
         user_id: int,
         institution_id: str,
-    ) -> institutions.UserBrokerageHoldings:
-        """Sends multi-factor auth code to Robinhood and returns holdings"""
+        defer_holdings_import: bool = False,
+    ) -> Optional[institutions.InstitutionConnection]:
+        """Sends multi-factor auth code to Robinhood and imports holdings. With
+        defer_holdings_import, returns the connection without importing holdings;
+        call import_holdings() with it."""
 
         previous_connection = (
             await self._insitution_repo.retrieve_institution_connection(
-                user_id=user_id, institution_id=institution_id
+                user_id=user_id, institution_id=institution_id, use_primary=True
             )
         )
 
@@ -127,11 +135,14 @@ class RobinhoodService(IInstitutionService):
             ).account_exists()
 
         # 3. Decrypt Robinhood credentials
-        decrypted_username = await self.encryption_service.decrypt(
-            encrypted_secret=previous_connection.username
-        )
-        decrypted_password = await self.encryption_service.decrypt(
-            encrypted_secret=previous_connection.password
+        (
+            decrypted_username,
+            decrypted_password,
+        ) = await self.encryption_service.decrypt_many(
+            encrypted_secrets=[
+                previous_connection.username,
+                previous_connection.password,
+            ]
         )
 
         # 4. Construct Robinhood login payload object
@@ -174,27 +185,43 @@ class RobinhoodService(IInstitutionService):
             institution_id=institution_id,
             successful_login_response=successful_login_response,
         )
-        # 7. Retrieve and save our most recent holdings
+        if defer_holdings_import:
+            return connection
+
+        # 7. Retrieve our most recent holdings and upsert them in our database
+        await self.import_holdings(connection=connection)
+        return None
+
+    async def import_holdings(
+        self, connection: institutions.InstitutionConnection
+    ) -> int:
+        """Retrieve a freshly logged in connection's holdings from Robinhood and save
+        them as assets. Returns how many holdings were imported."""
+
         recent_holdings = await self.get_recent_holdings(
             encrypted_json_web_token=connection.json_web_token
         )
 
-        # 8. Upsert holdings in our database
         await self.__upsert_assets(
-            user_id=user_id,
-            institution_id=institution_id,
+            user_id=connection.user_id,
+            institution_id=connection.institution_id,
             holdings=recent_holdings.holdings,
         )
+        return len(recent_holdings.holdings)
 
     async def get_recent_holdings(
-        self, encrypted_json_web_token: str
+        self,
+        encrypted_json_web_token: Optional[str] = None,
+        json_web_token: Optional[str] = None,
     ) -> institutions.UserBrokerageHoldings:
-        """Returns most recent holdings directly from Robinhood"""
+        """Returns most recent holdings directly from Robinhood. Pass json_web_token
+        instead of encrypted_json_web_token when the decrypted token is already at hand."""
 
-        # 1. Decrypt JSON web token
-        json_web_token = await self.encryption_service.decrypt(
-            encrypted_secret=encrypted_json_web_token
-        )
+        # 1. Decrypt JSON web token, unless the caller already has it
+        if not json_web_token:
+            json_web_token = await self.encryption_service.decrypt(
+                encrypted_secret=encrypted_json_web_token
+            )
 
         # 2. Retrieve positions data from Robinhood
         positions_data = await self.robinhood_client.get_positions_data(
@@ -261,9 +288,16 @@ class RobinhoodService(IInstitutionService):
         holdings: institutions.UserBrokerageHoldings,
     ) -> None:
         """Save or update asssets in our database"""
-        for asset in holdings:
-            await self.portfolio_repo.upsert_asset(
-                new_asset=UpsertAssetRepoAdapter(
+        tracked_assets = await self.portfolio_repo.retrieve_brokerage_assets(
+            user_id=user_id, institution_id=institution_id, use_primary=True
+        )
+        tracked_assets_by_symbol = {
+            asset.asset_symbol: asset for asset in tracked_assets
+        }
+
+        await self.portfolio_repo.upsert_many_assets(
+            new_assets=[
+                UpsertAssetRepoAdapter(
                     average_buy_price=asset.average_buy_price
                     if asset.average_buy_price
                     else None,
@@ -273,6 +307,35 @@ class RobinhoodService(IInstitutionService):
                     asset_symbol=asset.asset_symbol,
                     quantity=asset.quantity,
                 )
+                for asset in holdings
+            ]
+        )
+
+        # Let listeners know which holdings the login added or changed
+        portfolio_change = PortfolioChange(
+            user_id=user_id,
+            institution_id=institution_id,
+            added=[
+                asset.asset_symbol
+                for asset in holdings
+                if asset.asset_symbol not in tracked_assets_by_symbol
+            ],
+            changed=[
+                asset.asset_symbol
+                for asset in holdings
+                if asset.asset_symbol in tracked_assets_by_symbol
+                and (
+                    tracked_assets_by_symbol[asset.asset_symbol].quantity
+                    != asset.quantity
+                    or tracked_assets_by_symbol[asset.asset_symbol].average_buy_price
+                    != asset.average_buy_price
+                )
+            ],
+        )
+        if portfolio_change.added or portfolio_change.changed:
+            await self.portfolio_repo.publish_portfolio_change(
+                portfolio_change=portfolio_change,
+                channel=settings.portfolio_changes_channel,
             )
 
     async def __upsert_institution_connection(
@@ -285,19 +348,25 @@ class RobinhoodService(IInstitutionService):
         """Saves or update institution connection in our database."""
 
         if login_credentials:
-            encrypted_username = await self.encryption_service.encrypt(
-                secret=login_credentials.username
-            )
-            encrypted_password = await self.encryption_service.encrypt(
-                secret=login_credentials.password
+            (
+                encrypted_username,
+                encrypted_password,
+            ) = await self.encryption_service.encrypt_many(
+                secrets=[login_credentials.username, login_credentials.password]
             )
 
         if successful_login_response:
-            encrypted_json_web_token = await self.encryption_service.encrypt(
-                secret=successful_login_response.access_token
+            (
+                encrypted_json_web_token,
+                encrypted_refresh_token,
+            ) = await self.encryption_service.encrypt_many(
+                secrets=[
+                    successful_login_response.access_token,
+                    successful_login_response.refresh_token,
+                ]
             )
-            encrypted_refresh_token = await self.encryption_service.encrypt(
-                secret=successful_login_response.refresh_token
+            token_expires_at = datetime.utcnow() + timedelta(
+                seconds=successful_login_response.expires_in
             )
 
         return await self._insitution_repo.upsert(
@@ -312,6 +381,9 @@ class RobinhoodService(IInstitutionService):
                 refresh_token=encrypted_refresh_token
                 if successful_login_response
                 else None,
+                token_expires_at=token_expires_at
+                if successful_login_response
+                else None,
                 is_active=bool(successful_login_response),
             )
         )
@@ -328,8 +400,9 @@ class RobinhoodService(IInstitutionService):
         ]
 
         tracked_instruments = (
+            # Primary, since instruments missing here are inserted right after
             await self._insitution_repo.retrieve_robinhood_instruments(
-                instrument_ids=robinhood_instrument_ids
+                instrument_ids=robinhood_instrument_ids, use_primary=True
             )
         )
 
@@ -343,15 +416,42 @@ class RobinhoodService(IInstitutionService):
             tracked_instruments=tracked_instruments_dict,
         )
 
+    async def json_web_token_is_expired(self, encrypted_json_web_token: str) -> bool:
+        """Returns whether the JSON web token has expired, without calling Robinhood"""
+
+        if not encrypted_json_web_token:
+            return True
+
+        # 1. Decrypt JSON web token
+        json_web_token = await self.encryption_service.decrypt(
+            encrypted_secret=encrypted_json_web_token
+        )
+
+        # 2. Read the exp claim locally (Robinhood verifies the signature, not us)
+        try:
+            expires_at = jwt.get_unverified_claims(json_web_token).get("exp")
+        except JWTError:
+            # Not a JWT we can read, so let Robinhood decide
+            return False
+
+        if not isinstance(expires_at, (int, float)):
+            return False
+
+        return expires_at <= time() + settings.json_web_token_expiry_leeway
+
     async def refresh_token(
-        self, encrypted_refresh_token: str
+        self,
+        encrypted_refresh_token: Optional[str] = None,
+        refresh_token: Optional[str] = None,
     ) -> institutions.SuccessfulTokenRefreshResponse:
-        """Request new JSON web token from Robinhood."""
+        """Request new JSON web token from Robinhood. Pass refresh_token instead of
+        encrypted_refresh_token when the decrypted token is already at hand."""
 
-        # 1. Decrypt the refresh token
-        refresh_token = await self.encryption_service.decrypt(
-            encrypted_secret=encrypted_refresh_token
-        )
+        # 1. Decrypt the refresh token, unless the caller already has it
+        if not refresh_token:
+            refresh_token = await self.encryption_service.decrypt(
+                encrypted_secret=encrypted_refresh_token
+            )
 
         # 2. Construct payload to send to Robhinhood
         payload = robinhood.LoginPayload(
@@ -368,14 +468,24 @@ class RobinhoodService(IInstitutionService):
         robinhood_json_response = await self.robinhood_client.login(payload=payload)
 
         # 4. Encrypt newly refreshed tokens
-        encrypted_json_web_token = await self.encryption_service.encrypt(
-            secret=robinhood_json_response.get("access_token")
-        )
-        encrypted_refresh_token = await self.encryption_service.encrypt(
-            secret=robinhood_json_response.get("refresh_token")
+        (
+            encrypted_json_web_token,
+            encrypted_refresh_token,
+        ) = await self.encryption_service.encrypt_many(
+            secrets=[
+                robinhood_json_response.get("access_token"),
+                robinhood_json_response.get("refresh_token"),
+            ]
         )
 
+        # 5. Work out when the new JSON web token expires
+        expires_in = robinhood_json_response.get("expires_in")
+
         return institutions.SuccessfulTokenRefreshResponse(
             encrypted_json_web_token=encrypted_json_web_token,
             encrypted_refresh_token=encrypted_refresh_token,
+            token_expires_at=datetime.utcnow() + timedelta(seconds=expires_in)
+            if expires_in
+            else None,
+            json_web_token=robinhood_json_response.get("access_token"),
         )
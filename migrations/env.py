@@ -15,7 +15,9 @@ from app.infrastructure.db.metadata import METADATA
 from app.infrastructure.db.models.institutions import (
     INSTITUTION_CONNECTIONS,
     INSTITUTIONS,
+    LOGIN_JOBS,
 )
+from app.infrastructure.db.models.sync_runs import SYNC_RUNS
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
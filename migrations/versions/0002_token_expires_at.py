@@ -0,0 +1,42 @@
+"""token expires at
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 09:12:41.530187
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "institution_connections",
+        sa.Column("token_expires_at", sa.DateTime(), nullable=True),
+        schema="account_connections",
+    )
+    op.create_index(
+        "ix_institution_connections_token_expires_at",
+        "institution_connections",
+        [sa.text("token_expires_at ASC NULLS FIRST")],
+        unique=False,
+        schema="account_connections",
+        postgresql_where=sa.text("is_active AND refresh_token IS NOT NULL"),
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_institution_connections_token_expires_at",
+        table_name="institution_connections",
+        schema="account_connections",
+    )
+    op.drop_column(
+        "institution_connections", "token_expires_at", schema="account_connections"
+    )
@@ -0,0 +1,70 @@
+"""task query indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 14:05:37.118420
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, and a blocking build
+    # would stall the logins and tasks writing institution_connections
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_institution_connections_active_created_at",
+            "institution_connections",
+            [sa.text("created_at DESC")],
+            unique=False,
+            schema="account_connections",
+            postgresql_where=sa.text("is_active"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_institution_connections_refreshable_created_at",
+            "institution_connections",
+            [sa.text("created_at DESC")],
+            unique=False,
+            schema="account_connections",
+            postgresql_where=sa.text("is_active AND refresh_token IS NOT NULL"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_institution_connections_active_connection_id",
+            "institution_connections",
+            ["connection_id"],
+            unique=False,
+            schema="account_connections",
+            postgresql_where=sa.text("is_active"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_institution_connections_active_connection_id",
+            table_name="institution_connections",
+            schema="account_connections",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_institution_connections_refreshable_created_at",
+            table_name="institution_connections",
+            schema="account_connections",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_institution_connections_active_created_at",
+            table_name="institution_connections",
+            schema="account_connections",
+            postgresql_concurrently=True,
+        )
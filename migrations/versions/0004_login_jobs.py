@@ -0,0 +1,59 @@
+"""login jobs
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 16:42:08.305914
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "login_jobs",
+        sa.Column("job_id", sa.String(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("institution_id", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("imported_assets", sa.Integer(), nullable=True),
+        sa.Column("error", sa.String(), nullable=True),
+        sa.Column(
+            "created_at", sa.DateTime(), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.Column(
+            "updated_at", sa.DateTime(), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.ForeignKeyConstraint(
+            ["institution_id"],
+            ["account_connections.institutions.institution_id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"],
+            ["users.user_id"],
+        ),
+        sa.PrimaryKeyConstraint("job_id"),
+        schema="account_connections",
+    )
+    op.create_index(
+        op.f("ix_account_connections_login_jobs_user_id"),
+        "login_jobs",
+        ["user_id"],
+        unique=False,
+        schema="account_connections",
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_account_connections_login_jobs_user_id"),
+        table_name="login_jobs",
+        schema="account_connections",
+    )
+    op.drop_table("login_jobs", schema="account_connections")
@@ -0,0 +1,54 @@
+"""sync runs
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 18:27:51.664093
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "sync_runs",
+        sa.Column("run_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("task_name", sa.String(), nullable=False),
+        sa.Column(
+            "last_connection_id", sa.Integer(), server_default="0", nullable=False
+        ),
+        sa.Column(
+            "processed_connections", sa.Integer(), server_default="0", nullable=False
+        ),
+        sa.Column("completed_at", sa.DateTime(), nullable=True),
+        sa.Column(
+            "created_at", sa.DateTime(), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.Column(
+            "updated_at", sa.DateTime(), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.PrimaryKeyConstraint("run_id"),
+        schema="account_connections",
+    )
+    op.create_index(
+        "ix_sync_runs_task_name_created_at",
+        "sync_runs",
+        ["task_name", sa.text("created_at DESC")],
+        unique=False,
+        schema="account_connections",
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_sync_runs_task_name_created_at",
+        table_name="sync_runs",
+        schema="account_connections",
+    )
+    op.drop_table("sync_runs", schema="account_connections")
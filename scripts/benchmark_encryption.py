@@ -0,0 +1,100 @@
+"""
+Measures how long a token refresh batch's worth of decrypts and encrypts blocks the
+event loop: AES-CBC decoding the key on every call (the original service), the
+batch API inline, and the batch API offloaded to the encryption thread pool.
+No database is needed.
+
+    PYTHONPATH=. python scripts/benchmark_encryption.py
+"""
+import asyncio
+from base64 import b64decode, b64encode
+from time import perf_counter
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+
+from app.settings import settings
+from app.usecases.services.encryption import (
+    EncryptionService,
+    decrypt_secret,
+    encrypt_secret,
+)
+
+BATCH_SIZE = 200
+ROUNDS = 20
+TICK = 0.001
+
+SERVICE = EncryptionService()
+SECRETS = [f"eyJhbGciOiJIUzI1NiJ9.token-{index}" * 20 for index in range(BATCH_SIZE)]
+ENCRYPTED_SECRETS = [encrypt_secret(secret) for secret in SECRETS]
+
+
+def encrypt_per_call(secret: str) -> str:
+    encryption_secret_key = b64decode(settings.encryption_secret_key.encode())
+    cipher = AES.new(encryption_secret_key, AES.MODE_CBC)
+    iv_string = b64encode(cipher.iv).decode("utf-8")
+    encypted_bytes = cipher.encrypt(pad(secret.encode(), AES.block_size))
+    return b64encode(encypted_bytes).decode("utf-8") + iv_string
+
+
+def decrypt_per_call(encrypted_secret: str) -> str:
+    encryption_secret_key = b64decode(settings.encryption_secret_key.encode())
+    iv = b64decode(encrypted_secret[-24:].encode())
+    encrypted_data = b64decode(encrypted_secret[:-24])
+    cipher = AES.new(encryption_secret_key, AES.MODE_CBC, iv)
+    return unpad(cipher.decrypt(encrypted_data), AES.block_size).decode("utf-8")
+
+
+LEGACY_ENCRYPTED_SECRETS = [encrypt_per_call(secret) for secret in SECRETS]
+
+
+async def key_per_call():
+    secrets = [decrypt_per_call(secret) for secret in LEGACY_ENCRYPTED_SECRETS]
+    return [encrypt_per_call(secret) for secret in secrets]
+
+
+async def batch_inline():
+    secrets = [decrypt_secret(secret) for secret in ENCRYPTED_SECRETS]
+    return [encrypt_secret(secret) for secret in secrets]
+
+
+async def batch_offloaded():
+    secrets = await SERVICE.decrypt_many(encrypted_secrets=ENCRYPTED_SECRETS)
+    return await SERVICE.encrypt_many(secrets=secrets)
+
+
+async def measure(work):
+    """Run work while a ticker records how late each of its wake-ups is"""
+
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = perf_counter() + TICK
+            await asyncio.sleep(TICK)
+            lags.append(max(perf_counter() - expected, 0))
+
+    ticker_task = asyncio.ensure_future(ticker())
+    await asyncio.sleep(TICK)
+    start = perf_counter()
+    for _ in range(ROUNDS):
+        await work()
+    elapsed = perf_counter() - start
+    done.set()
+    await ticker_task
+    return elapsed, sum(lags), max(lags)
+
+
+if __name__ == "__main__":
+    print(f"{ROUNDS} rounds of {BATCH_SIZE} decrypts + {BATCH_SIZE} encrypts")
+    for name, work in (
+        ("key per call", key_per_call),
+        ("cached key inline", batch_inline),
+        ("batch offloaded", batch_offloaded),
+    ):
+        elapsed, total_lag, max_lag = asyncio.run(measure(work))
+        print(
+            f"{name:>16}: {elapsed * 1e3:7.1f} ms total, loop blocked "
+            f"{total_lag * 1e3:7.1f} ms, longest stall {max_lag * 1e3:6.2f} ms"
+        )
@@ -0,0 +1,173 @@
+from datetime import datetime
+
+import pytest
+from databases import Database
+
+from app.infrastructure.db.models.institutions import INSTITUTION_CONNECTIONS
+from app.infrastructure.db.repos.institution_repo import InstitutionRepo
+from app.usecases.schemas import institutions
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def institution_repo(test_db) -> InstitutionRepo:
+    return InstitutionRepo(db=test_db)
+
+
+async def retrieve_connections(test_db):
+    rows = await test_db.fetch_all(
+        INSTITUTION_CONNECTIONS.select().order_by(
+            INSTITUTION_CONNECTIONS.c.connection_id
+        )
+    )
+    return {row["connection_id"]: row for row in rows}
+
+
+async def test_update_many_connection_tokens(
+    test_db, institution_repo, create_user, create_connection
+):
+    users = [await create_user() for _ in range(3)]
+    connections = [await create_connection(user_id=user["user_id"]) for user in users]
+    token_expires_at = datetime(2030, 1, 1)
+
+    # Batches smaller than the update list still store every connection's tokens
+    await institution_repo.update_many_connection_tokens(
+        updated_tokens=[
+            institutions.UpdateConnectionTokensRepoAdapter(
+                connection_id=connection["connection_id"],
+                json_web_token=f"new-jwt-{connection['connection_id']}",
+                refresh_token=f"new-refresh-{connection['connection_id']}",
+                token_expires_at=token_expires_at,
+            )
+            for connection in connections[:2]
+        ],
+        batch_size=1,
+    )
+
+    stored = await retrieve_connections(test_db)
+    for connection in connections[:2]:
+        row = stored[connection["connection_id"]]
+        assert row["json_web_token"] == f"new-jwt-{connection['connection_id']}"
+        assert row["refresh_token"] == f"new-refresh-{connection['connection_id']}"
+        assert row["token_expires_at"] == token_expires_at
+
+    untouched = stored[connections[2]["connection_id"]]
+    assert untouched["json_web_token"] == "encrypted-json-web-token"
+    assert untouched["token_expires_at"] is None
+
+
+async def test_update_many_connection_tokens_without_expiry(
+    test_db, institution_repo, create_user, create_connection
+):
+    user = await create_user()
+    token_expires_at = datetime(2030, 1, 1)
+    connection = await create_connection(
+        user_id=user["user_id"], token_expires_at=token_expires_at
+    )
+
+    await institution_repo.update_many_connection_tokens(
+        updated_tokens=[
+            institutions.UpdateConnectionTokensRepoAdapter(
+                connection_id=connection["connection_id"],
+                json_web_token="new-jwt",
+                refresh_token="new-refresh",
+                token_expires_at=None,
+            )
+        ]
+    )
+
+    stored = (await retrieve_connections(test_db))[connection["connection_id"]]
+    assert stored["json_web_token"] == "new-jwt"
+    # An unknown expiry would make the connection due for refresh on every run
+    assert stored["token_expires_at"] == token_expires_at
+
+
+async def test_deactivate_many_institution_connections(
+    test_db, institution_repo, create_user, create_connection
+):
+    users = [await create_user() for _ in range(3)]
+    connections = [await create_connection(user_id=user["user_id"]) for user in users]
+
+    await institution_repo.deactivate_many_institution_connections(
+        connection_ids=[connection["connection_id"] for connection in connections[:2]],
+        batch_size=1,
+    )
+
+    stored = await retrieve_connections(test_db)
+    assert [
+        stored[connection["connection_id"]]["is_active"] for connection in connections
+    ] == [
+        False,
+        False,
+        True,
+    ]
+
+
+async def test_update_many_connection_tokens_with_no_tokens(
+    test_db, institution_repo, create_user, create_connection
+):
+    user = await create_user()
+    connection = await create_connection(user_id=user["user_id"])
+
+    await institution_repo.update_many_connection_tokens(updated_tokens=[])
+    await institution_repo.deactivate_many_institution_connections(connection_ids=[])
+
+    stored = await retrieve_connections(test_db)
+    assert stored[connection["connection_id"]]["is_active"] is True
+
+
+async def test_update_many_connection_secrets(
+    test_db, institution_repo, create_user, create_connection
+):
+    user = await create_user()
+    connection = await create_connection(user_id=user["user_id"])
+    # The token is refreshed after the rotation read it
+    await test_db.execute(
+        INSTITUTION_CONNECTIONS.update()
+        .where(INSTITUTION_CONNECTIONS.c.connection_id == connection["connection_id"])
+        .values(json_web_token="refreshed-json-web-token")
+    )
+
+    await institution_repo.update_many_connection_secrets(
+        rotated_secrets=[
+            institutions.RotatedConnectionSecretsRepoAdapter(
+                connection_id=connection["connection_id"],
+                username="rotated-username",
+                password="rotated-password",
+                json_web_token="rotated-json-web-token",
+                refresh_token="rotated-refresh-token",
+                previous_username=connection["username"],
+                previous_password=connection["password"],
+                previous_json_web_token=connection["json_web_token"],
+                previous_refresh_token=connection["refresh_token"],
+            )
+        ]
+    )
+
+    stored = (await retrieve_connections(test_db))[connection["connection_id"]]
+    assert stored["username"] == "rotated-username"
+    assert stored["password"] == "rotated-password"
+    assert stored["refresh_token"] == "rotated-refresh-token"
+    # Only the column that changed since it was read keeps its newer value
+    assert stored["json_web_token"] == "refreshed-json-web-token"
+
+
+async def test_retrieve_many_institution_connections_locks_on_primary(
+    test_db, create_user, create_connection
+):
+    user = await create_user()
+    connection = await create_connection(user_id=user["user_id"])
+    # Never connected, so any query sent to the replica fails
+    institution_repo = InstitutionRepo(
+        db=test_db, replica_db=Database("postgresql://localhost/unused-replica")
+    )
+
+    connections = await institution_repo.retrieve_many_institution_connections(
+        query_params=institutions.RetrieveManyConnectionsRepoAdapter(is_active=True),
+        skip_locked=True,
+    )
+
+    assert [
+        retrieved_connection.connection_id for retrieved_connection in connections
+    ] == [connection["connection_id"]]
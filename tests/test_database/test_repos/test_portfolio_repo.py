@@ -0,0 +1,82 @@
+import pytest
+
+from app.infrastructure.db.models.portfolio import ASSETS
+from app.infrastructure.db.repos.portfolio_repo import PortfolioRepo
+from app.usecases.schemas import portfolios
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def portfolio_repo(test_db) -> PortfolioRepo:
+    return PortfolioRepo(db=test_db)
+
+
+async def retrieve_assets(test_db):
+    rows = await test_db.fetch_all(ASSETS.select())
+    return {(row["user_id"], row["asset_symbol"]): row for row in rows}
+
+
+def new_asset(user_id: int, asset_symbol: str, quantity: float):
+    return portfolios.UpsertAssetRepoAdapter(
+        user_id=user_id,
+        institution_id="robinhood",
+        asset_symbol=asset_symbol,
+        name=asset_symbol,
+        quantity=quantity,
+        average_buy_price=10,
+    )
+
+
+@pytest.mark.parametrize("copy_threshold", [1000, 1], ids=["executemany", "copy"])
+async def test_upsert_many_assets(
+    test_db, portfolio_repo, create_user, create_asset, copy_threshold
+):
+    user = await create_user()
+    await create_asset(user_id=user["user_id"], asset_symbol="AAPL", quantity=1)
+
+    await portfolio_repo.upsert_many_assets(
+        new_assets=[
+            new_asset(user_id=user["user_id"], asset_symbol="AAPL", quantity=5),
+            new_asset(user_id=user["user_id"], asset_symbol="TSLA", quantity=2),
+            # Repeats of one asset collapse to the last one
+            new_asset(user_id=user["user_id"], asset_symbol="TSLA", quantity=3),
+        ],
+        copy_threshold=copy_threshold,
+    )
+
+    stored = await retrieve_assets(test_db)
+    assert set(stored) == {(user["user_id"], "AAPL"), (user["user_id"], "TSLA")}
+    assert stored[(user["user_id"], "AAPL")]["quantity"] == 5
+    assert stored[(user["user_id"], "TSLA")]["quantity"] == 3
+    assert stored[(user["user_id"], "TSLA")]["is_up_to_date"] is True
+
+
+async def test_replace_brokerage_assets(
+    test_db, portfolio_repo, create_user, create_asset
+):
+    user, other_user = await create_user(), await create_user()
+    await create_asset(user_id=user["user_id"], asset_symbol="AAPL")
+    await create_asset(user_id=user["user_id"], asset_symbol="GME")
+    await create_asset(user_id=other_user["user_id"], asset_symbol="GME")
+
+    await portfolio_repo.replace_brokerage_assets(
+        users_institutions=[
+            portfolios.UsersInstitutionRepoAdapter(
+                user_id=user["user_id"], institution_id="robinhood"
+            )
+        ],
+        new_assets=[
+            new_asset(user_id=user["user_id"], asset_symbol="AAPL", quantity=7),
+            new_asset(user_id=user["user_id"], asset_symbol="MSFT", quantity=1),
+        ],
+    )
+
+    stored = await retrieve_assets(test_db)
+    # GME is gone from the brokerage, so only the other user's GME remains
+    assert set(stored) == {
+        (user["user_id"], "AAPL"),
+        (user["user_id"], "MSFT"),
+        (other_user["user_id"], "GME"),
+    }
+    assert stored[(user["user_id"], "AAPL")]["quantity"] == 7
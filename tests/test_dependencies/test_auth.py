@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from app.dependencies import auth
+from app.settings import settings
+
+pytestmark = pytest.mark.anyio
+
+LISTENER_PIDS = "SELECT pid FROM pg_stat_activity WHERE query LIKE 'LISTEN %'"
+
+
+@pytest.fixture
+async def user_changes_listener(test_db, monkeypatch):
+    monkeypatch.setattr(settings, "user_changes_channel", "user_changes")
+    monkeypatch.setattr(settings, "user_changes_retry_interval", 0.01)
+    await auth.start_user_changes_listener()
+    try:
+        yield
+    finally:
+        await auth.stop_user_changes_listener()
+        auth.USER_CACHE.clear()
+
+
+async def wait_for_listener(test_db, other_than=None) -> int:
+    for _ in range(500):
+        pids = [row["pid"] for row in await test_db.fetch_all(LISTENER_PIDS)]
+        if pids and pids[0] != other_than:
+            return pids[0]
+        await asyncio.sleep(0.01)
+    raise AssertionError("The user changes listener never connected")
+
+
+async def assert_notify_invalidates(test_db) -> None:
+    auth.USER_CACHE.set("user1", "cached user")
+    await test_db.execute("SELECT pg_notify('user_changes', 'user1')")
+    for _ in range(500):
+        if auth.USER_CACHE.get("user1") is None:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("The NOTIFY never reached the user cache")
+
+
+async def test_user_changes_listener_reconnects(test_db, user_changes_listener):
+    listener_pid = await wait_for_listener(test_db)
+    await assert_notify_invalidates(test_db)
+
+    await test_db.execute(f"SELECT pg_terminate_backend({listener_pid})")
+
+    await wait_for_listener(test_db, other_than=listener_pid)
+    await assert_notify_invalidates(test_db)
@@ -0,0 +1,57 @@
+from datetime import datetime
+from typing import Dict, Optional, Union
+
+import pytest
+
+from app.usecases.schemas import institutions
+
+
+class FakeRobinhoodService:
+    """Answers for Robinhood from holdings keyed by JSON web token. A token mapped to
+    an exception raises it instead."""
+
+    institution_name = "Robinhood"
+
+    def __init__(self, holdings: Dict[str, Union[Dict[str, float], Exception]]):
+        self.holdings = holdings
+
+    async def json_web_token_is_expired(self, encrypted_json_web_token: str) -> bool:
+        return False
+
+    async def get_recent_holdings(
+        self,
+        encrypted_json_web_token: Optional[str] = None,
+        json_web_token: Optional[str] = None,
+    ) -> institutions.UserBrokerageHoldings:
+        holdings = self.holdings[encrypted_json_web_token or json_web_token]
+        if isinstance(holdings, Exception):
+            raise holdings
+
+        return institutions.UserBrokerageHoldings(
+            holdings=[
+                institutions.IndividualHoldingData(
+                    asset_symbol=asset_symbol,
+                    asset_name=asset_symbol,
+                    quantity=quantity,
+                    average_buy_price=1,
+                )
+                for asset_symbol, quantity in holdings.items()
+            ],
+            insitution_name=self.institution_name,
+        )
+
+    async def refresh_token(
+        self,
+        encrypted_refresh_token: Optional[str] = None,
+        refresh_token: Optional[str] = None,
+    ) -> institutions.SuccessfulTokenRefreshResponse:
+        return institutions.SuccessfulTokenRefreshResponse(
+            encrypted_json_web_token=f"refreshed-jwt-{refresh_token}",
+            encrypted_refresh_token=f"refreshed-{refresh_token}",
+            token_expires_at=datetime(2030, 1, 1),
+        )
+
+
+@pytest.fixture
+def fake_robinhood_service():
+    return FakeRobinhoodService
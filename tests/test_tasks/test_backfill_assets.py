@@ -0,0 +1,55 @@
+import pytest
+
+from app.infrastructure.db.models.portfolio import ASSETS
+from app.infrastructure.db.repos.institution_repo import InstitutionRepo
+from app.infrastructure.db.repos.portfolio_repo import PortfolioRepo
+from app.infrastructure.tasks.backfill_assets import BackfillAssetsTask
+from app.usecases.schemas import institutions
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_backfill_assets(
+    test_db, create_user, create_connection, create_asset, fake_robinhood_service
+):
+    users = [await create_user() for _ in range(4)]
+    for user in users:
+        await create_connection(
+            user_id=user["user_id"], json_web_token=f"jwt-{user['user_id']}"
+        )
+        await create_asset(user_id=user["user_id"], asset_symbol="GME", quantity=9)
+    inactive_user = await create_user()
+    await create_connection(
+        user_id=inactive_user["user_id"],
+        json_web_token=f"jwt-{inactive_user['user_id']}",
+        is_active=False,
+    )
+
+    service = fake_robinhood_service(
+        holdings={
+            f"jwt-{users[0]['user_id']}": {"AAPL": 1, "GME": 2},
+            f"jwt-{users[1]['user_id']}": {"TSLA": 3},
+            # The brokerage rejects this token, so the user's assets are left alone
+            f"jwt-{users[2]['user_id']}": institutions.UnauthorizedException(),
+            f"jwt-{users[3]['user_id']}": {},
+        }
+    )
+
+    # A batch size of 3 leaves a final partial batch
+    await BackfillAssetsTask(
+        db=test_db,
+        institution_repo=InstitutionRepo(db=test_db),
+        portfolio_repo=PortfolioRepo(db=test_db),
+        institution_services=[service],
+        batch_size=3,
+        concurrency=2,
+    ).task()
+
+    rows = await test_db.fetch_all(ASSETS.select())
+    stored = {(row["user_id"], row["asset_symbol"]): row["quantity"] for row in rows}
+    assert stored == {
+        (users[0]["user_id"], "AAPL"): 1,
+        (users[0]["user_id"], "GME"): 2,
+        (users[1]["user_id"], "TSLA"): 3,
+        (users[2]["user_id"], "GME"): 9,
+    }
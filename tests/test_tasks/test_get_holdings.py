@@ -0,0 +1,47 @@
+import pytest
+
+from app.infrastructure.db.models.portfolio import ASSETS
+from app.infrastructure.db.repos.institution_repo import InstitutionRepo
+from app.infrastructure.db.repos.portfolio_repo import PortfolioRepo
+from app.infrastructure.db.repos.sync_run_repo import SyncRunRepo
+from app.infrastructure.tasks.get_holdings import SYNC_RUN_TASK_NAME, GetHoldingsTask
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_get_holdings_skips_failing_connections(
+    test_db, create_user, create_connection, fake_robinhood_service
+):
+    users = [await create_user() for _ in range(3)]
+    connections = [
+        await create_connection(
+            user_id=user["user_id"], json_web_token=f"jwt-{user['user_id']}"
+        )
+        for user in users
+    ]
+    service = fake_robinhood_service(
+        holdings={
+            f"jwt-{users[0]['user_id']}": {"AAPL": 1},
+            # An unexpected error must not stop the run at this connection
+            f"jwt-{users[1]['user_id']}": RuntimeError("Unexpected response"),
+            f"jwt-{users[2]['user_id']}": {"TSLA": 2},
+        }
+    )
+    sync_run_repo = SyncRunRepo(db=test_db)
+
+    await GetHoldingsTask(
+        db=test_db,
+        institution_repo=InstitutionRepo(db=test_db),
+        portfolio_repo=PortfolioRepo(db=test_db),
+        sync_run_repo=sync_run_repo,
+        institution_services=[service],
+    ).task()
+
+    sync_run = await sync_run_repo.retrieve_latest_run(task_name=SYNC_RUN_TASK_NAME)
+    assert sync_run.completed_at is not None
+    assert sync_run.processed_connections == len(connections)
+    rows = await test_db.fetch_all(ASSETS.select())
+    assert {(row["user_id"], row["asset_symbol"]) for row in rows} == {
+        (users[0]["user_id"], "AAPL"),
+        (users[2]["user_id"], "TSLA"),
+    }
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import pytest
+
+from app.infrastructure.db.models.institutions import INSTITUTION_CONNECTIONS
+from app.infrastructure.db.repos.institution_repo import InstitutionRepo
+from app.infrastructure.tasks.refresh_tokens import RefreshTokensTask
+from app.usecases.services.encryption import EncryptionService, encrypt_secret
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_refresh_tokens_skips_undecryptable_tokens(
+    test_db, create_user, create_connection, fake_robinhood_service
+):
+    users = [await create_user() for _ in range(3)]
+    good_connections = [
+        await create_connection(
+            user_id=user["user_id"], refresh_token=encrypt_secret(f"refresh-{number}")
+        )
+        for number, user in enumerate(users[:2])
+    ]
+    # Encrypted under a key that is no longer configured; due first, as its expiry is unknown
+    bad_connection = await create_connection(
+        user_id=users[2]["user_id"], refresh_token="v2:9:bm90LWRlY3J5cHRhYmxl"
+    )
+
+    await RefreshTokensTask(
+        db=test_db,
+        institution_repo=InstitutionRepo(db=test_db),
+        institution_services=[fake_robinhood_service(holdings={})],
+        encryption_service=EncryptionService(),
+    ).task()
+
+    rows = {
+        row["connection_id"]: row
+        for row in await test_db.fetch_all(INSTITUTION_CONNECTIONS.select())
+    }
+    for number, connection in enumerate(good_connections):
+        row = rows[connection["connection_id"]]
+        assert row["refresh_token"] == f"refreshed-refresh-{number}"
+        assert row["token_expires_at"] == datetime(2030, 1, 1)
+
+    skipped_row = rows[bad_connection["connection_id"]]
+    assert skipped_row["refresh_token"] == bad_connection["refresh_token"]
+    assert skipped_row["is_active"] is True
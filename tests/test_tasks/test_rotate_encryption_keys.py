@@ -0,0 +1,82 @@
+import pytest
+
+from app.infrastructure.db.models.institutions import INSTITUTION_CONNECTIONS
+from app.infrastructure.db.repos.institution_repo import InstitutionRepo
+from app.infrastructure.tasks.rotate_encryption_keys import RotateEncryptionKeysTask
+from app.usecases.services.encryption import (
+    EncryptionService,
+    decrypt_secret,
+    encrypt_secret,
+)
+
+pytestmark = pytest.mark.anyio
+
+OLD_KEY = "MDEyMzQ1Njc4OWFiY2RlZjAxMjM0NTY3ODlhYmNkZWY="
+NEW_KEY = "ZmVkY2JhOTg3NjU0MzIxMGZlZGNiYTk4NzY1NDMyMTA="
+
+
+def encrypted_secrets(user_id: int):
+    return {
+        "username": encrypt_secret(f"username-{user_id}"),
+        "password": encrypt_secret(f"password-{user_id}"),
+        "json_web_token": encrypt_secret(f"jwt-{user_id}"),
+        "refresh_token": None,
+    }
+
+
+async def test_rotate_batch(
+    test_db, create_user, create_connection, use_encryption_keys
+):
+    old_user, current_user = await create_user(), await create_user()
+    use_encryption_keys(key_id="0", secret_key=OLD_KEY)
+    old_connection = await create_connection(
+        user_id=old_user["user_id"], **encrypted_secrets(old_user["user_id"])
+    )
+    use_encryption_keys(key_id="1", secret_key=NEW_KEY, retired_keys={"0": OLD_KEY})
+    current_connection = await create_connection(
+        user_id=current_user["user_id"], **encrypted_secrets(current_user["user_id"])
+    )
+
+    institution_repo = InstitutionRepo(db=test_db)
+    written_connection_ids = []
+    update_many_connection_secrets = institution_repo.update_many_connection_secrets
+
+    async def record_update(rotated_secrets):
+        written_connection_ids.extend(
+            secrets.connection_id for secrets in rotated_secrets
+        )
+        await update_many_connection_secrets(rotated_secrets=rotated_secrets)
+
+    institution_repo.update_many_connection_secrets = record_update
+    batch = [
+        connection_secrets
+        async for connection_secrets in institution_repo.stream_connection_secrets(
+            page_size=10
+        )
+    ]
+
+    rotated_connections = await RotateEncryptionKeysTask(
+        institution_repo=institution_repo,
+        encryption_service=EncryptionService(),
+        batch_interval=0,
+    ).rotate_batch(batch=batch)
+
+    # Only the connection still under the old key is written back
+    assert rotated_connections == 1
+    assert written_connection_ids == [old_connection["connection_id"]]
+
+    rows = {
+        row["connection_id"]: row
+        for row in await test_db.fetch_all(INSTITUTION_CONNECTIONS.select())
+    }
+    rotated_row = rows[old_connection["connection_id"]]
+    assert rotated_row["username"].startswith("v2:1:")
+    assert decrypt_secret(rotated_row["username"]) == f"username-{old_user['user_id']}"
+    assert decrypt_secret(rotated_row["json_web_token"]) == (
+        f"jwt-{old_user['user_id']}"
+    )
+    assert rotated_row["refresh_token"] is None
+    assert (
+        rows[current_connection["connection_id"]]["password"]
+        == current_connection["password"]
+    )
@@ -0,0 +1,107 @@
+from base64 import b64decode, b64encode
+
+import pytest
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from app.settings import settings
+from app.usecases.services.encryption import (
+    EncryptionService,
+    decrypt_secret,
+    encrypt_secret,
+    is_current,
+    rotate_secret,
+)
+
+pytestmark = pytest.mark.anyio
+
+OLD_KEY = "MDEyMzQ1Njc4OWFiY2RlZjAxMjM0NTY3ODlhYmNkZWY="
+NEW_KEY = "ZmVkY2JhOTg3NjU0MzIxMGZlZGNiYTk4NzY1NDMyMTA="
+
+
+def encrypt_legacy_secret(secret: str, key: str) -> str:
+    """The original AES-CBC format: base64 ciphertext with its base64 IV appended"""
+
+    cipher = AES.new(b64decode(key), AES.MODE_CBC)
+    encrypted_bytes = cipher.encrypt(pad(secret.encode(), AES.block_size))
+    return b64encode(encrypted_bytes).decode() + b64encode(cipher.iv).decode()
+
+
+def test_encrypt_decrypt_round_trip(use_encryption_keys):
+    use_encryption_keys(key_id="0", secret_key=OLD_KEY)
+
+    encrypted_secret = encrypt_secret("robinhood-password")
+
+    assert encrypted_secret.startswith("v2:0:")
+    assert decrypt_secret(encrypted_secret) == "robinhood-password"
+    # Every encryption gets a fresh nonce
+    assert encrypt_secret("robinhood-password") != encrypted_secret
+
+
+def test_decrypt_legacy_secret(use_encryption_keys):
+    # Legacy ciphertexts carry no key id; they were all made with key id "0"
+    use_encryption_keys(key_id="1", secret_key=NEW_KEY, retired_keys={"0": OLD_KEY})
+
+    encrypted_secret = encrypt_legacy_secret("robinhood-password", key=OLD_KEY)
+
+    assert not is_current(encrypted_secret)
+    assert decrypt_secret(encrypted_secret) == "robinhood-password"
+
+
+def test_decrypt_rejects_relabelled_key_id(use_encryption_keys):
+    # Both ids hold the same key, so only the authenticated header tells them apart
+    use_encryption_keys(key_id="1", secret_key=OLD_KEY, retired_keys={"0": OLD_KEY})
+    encrypted_secret = encrypt_secret("robinhood-password")
+
+    relabelled_secret = encrypted_secret.replace("v2:1:", "v2:0:", 1)
+
+    with pytest.raises(ValueError):
+        decrypt_secret(relabelled_secret)
+
+
+def test_decrypt_with_unknown_key_id(use_encryption_keys):
+    use_encryption_keys(key_id="1", secret_key=NEW_KEY, retired_keys={"0": OLD_KEY})
+    encrypted_secret = encrypt_secret("robinhood-password")
+    use_encryption_keys(key_id="2", secret_key=OLD_KEY)
+
+    with pytest.raises(ValueError, match="ENCRYPTION_RETIRED_KEYS"):
+        decrypt_secret(encrypted_secret)
+
+
+def test_rotate_secret(use_encryption_keys):
+    use_encryption_keys(key_id="0", secret_key=OLD_KEY)
+    old_secret = encrypt_secret("robinhood-password")
+    legacy_secret = encrypt_legacy_secret("robinhood-username", key=OLD_KEY)
+    use_encryption_keys(key_id="1", secret_key=NEW_KEY, retired_keys={"0": OLD_KEY})
+    current_secret = encrypt_secret("robinhood-token")
+
+    # Ciphertexts under the current key come back untouched
+    assert rotate_secret(current_secret) == current_secret
+
+    for encrypted_secret, secret in [
+        (old_secret, "robinhood-password"),
+        (legacy_secret, "robinhood-username"),
+    ]:
+        rotated_secret = rotate_secret(encrypted_secret)
+        assert rotated_secret.startswith("v2:1:")
+        assert decrypt_secret(rotated_secret) == secret
+
+
+async def test_encryption_service_batches(use_encryption_keys, monkeypatch):
+    use_encryption_keys(key_id="0", secret_key=OLD_KEY)
+    # Small enough that the batch is split across the thread pool
+    monkeypatch.setattr(settings, "encryption_offload_threshold", 2)
+    monkeypatch.setattr(settings, "encryption_offload_chunk_size", 2)
+    encryption_service = EncryptionService()
+    secrets = [f"secret-{number}" for number in range(5)]
+
+    encrypted_secrets = await encryption_service.encrypt_many(secrets=secrets)
+
+    assert (
+        await encryption_service.decrypt_many(encrypted_secrets=encrypted_secrets)
+        == secrets
+    )
+    assert (
+        await encryption_service.rotate_many(encrypted_secrets=encrypted_secrets)
+        == encrypted_secrets
+    )
@@ -0,0 +1,129 @@
+import asyncio
+import json
+from typing import Any, Dict, Mapping, Optional
+from urllib.parse import urlencode
+
+import pytest
+
+from app.dependencies import (
+    get_current_active_user,
+    get_institution_repo,
+    get_portfolio_repo,
+)
+from app.infrastructure.db.repos.institution_repo import InstitutionRepo
+from app.infrastructure.db.repos.portfolio_repo import PortfolioRepo
+from app.infrastructure.web.setup import fastapi_app
+from app.usecases.schemas.users import UserInDB
+
+
+class ASGIResponse:
+    def __init__(self, status_code: int, headers: Dict[str, str], body: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class ASGIClient:
+    """Sends one request at a time straight to an ASGI app, without a server or the
+    app's startup events"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Mapping[str, Any]] = None,
+        json_body: Any = None,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> ASGIResponse:
+        body = b"" if json_body is None else json.dumps(json_body).encode()
+        request_headers = {"host": "testserver", **(headers or {})}
+        if json_body is not None:
+            request_headers["content-type"] = "application/json"
+        request_headers["content-length"] = str(len(body))
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": urlencode(params or {}).encode(),
+            "headers": [
+                (name.lower().encode(), value.encode())
+                for name, value in request_headers.items()
+            ],
+            "client": ("testclient", 50000),
+            "server": ("testserver", 80),
+        }
+        response: Dict[str, Any] = {"body": b""}
+        response_complete = asyncio.Event()
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Streaming responses listen for the client going away until they finish
+            await response_complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status_code"] = message["status"]
+                response["headers"] = {
+                    name.decode(): value.decode()
+                    for name, value in message.get("headers", [])
+                }
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+                if not message.get("more_body", False):
+                    response_complete.set()
+
+        await self.app(scope, receive, send)
+        return ASGIResponse(
+            status_code=response["status_code"],
+            headers=response["headers"],
+            body=response["body"],
+        )
+
+    async def get(self, path: str, **kwargs) -> ASGIResponse:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> ASGIResponse:
+        return await self.request("POST", path, **kwargs)
+
+    async def delete(self, path: str, **kwargs) -> ASGIResponse:
+        return await self.request("DELETE", path, **kwargs)
+
+
+@pytest.fixture
+async def authorized_user(request, create_user) -> UserInDB:
+    """The user every request is authorized as; parametrize indirectly to set columns"""
+
+    user = await create_user(**getattr(request, "param", {}))
+    return UserInDB(**user._mapping)
+
+
+@pytest.fixture
+async def client(test_db, authorized_user):
+    fastapi_app.dependency_overrides.update(
+        {
+            get_institution_repo: lambda: InstitutionRepo(db=test_db),
+            get_portfolio_repo: lambda: PortfolioRepo(db=test_db),
+            get_current_active_user: lambda: authorized_user,
+        }
+    )
+    try:
+        yield ASGIClient(fastapi_app)
+    finally:
+        fastapi_app.dependency_overrides.clear()
@@ -0,0 +1,17 @@
+import pytest
+
+from app.libraries.metrics import METRICS
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_metrics(client):
+    METRICS.counter("test_requests_total", "Requests made by the test suite.").inc()
+
+    response = await client.get("/health/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.body.decode().splitlines()
+    assert "# TYPE test_requests_total counter" in lines
+    assert "test_requests_total 1" in lines
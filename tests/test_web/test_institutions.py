@@ -0,0 +1,287 @@
+from datetime import timedelta
+
+import pytest
+import sqlalchemy as sa
+
+from app.dependencies import get_institution_service
+from app.infrastructure.db.models.institutions import (
+    INSTITUTION_CONNECTIONS,
+    LOGIN_JOBS,
+)
+from app.infrastructure.db.models.portfolio import ASSETS
+from app.infrastructure.web.endpoints.private.institutions import SUPPORTED_INSTITUTIONS
+from app.infrastructure.web.setup import fastapi_app
+from app.settings import settings
+from app.usecases.schemas import institutions
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def supported_institutions_cache():
+    SUPPORTED_INSTITUTIONS.clear()
+    try:
+        yield SUPPORTED_INSTITUTIONS
+    finally:
+        SUPPORTED_INSTITUTIONS.clear()
+
+
+async def test_get_all_supported_institutions(
+    client, robinhood_institution, supported_institutions_cache
+):
+    response = await client.get("/private/institutions")
+
+    assert response.status_code == 200
+    assert [
+        institution["institution_id"]
+        for institution in response.json()["records"]["supported_institutions"]
+    ] == [robinhood_institution["institution_id"]]
+    etag = response.headers["etag"]
+
+    # The client's copy is current, so only the headers come back
+    response = await client.get(
+        "/private/institutions", headers={"if-none-match": f'"stale", W/{etag}'}
+    )
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == etag
+
+    # A stale copy gets the whole list again
+    response = await client.get(
+        "/private/institutions", headers={"if-none-match": '"stale"'}
+    )
+    assert response.status_code == 200
+    assert response.json()["records"]["supported_institutions"]
+    assert response.headers["etag"] == etag
+
+
+@pytest.mark.parametrize("authorized_user", [{"is_superuser": True}], indirect=True)
+async def test_retrieve_users_institution_connections(
+    client, create_user, create_connection
+):
+    user, other_user, user_without_connections = [await create_user() for _ in range(3)]
+    connection = await create_connection(user_id=user["user_id"])
+    other_connection = await create_connection(user_id=other_user["user_id"])
+
+    response = await client.post(
+        "/private/institutions/connections/batch",
+        json_body={
+            "user_ids": [
+                other_user["user_id"],
+                user_without_connections["user_id"],
+                user["user_id"],
+                other_user["user_id"],
+            ]
+        },
+    )
+
+    assert response.status_code == 200
+    users_connections = response.json()["records"]["users_connections"]
+    # In the order requested and once per user, including users without connections
+    assert [
+        (
+            user_connections["user_id"],
+            [
+                active_connection["connection_id"]
+                for active_connection in user_connections["active_connections"]
+            ],
+        )
+        for user_connections in users_connections
+    ] == [
+        (other_user["user_id"], [other_connection["connection_id"]]),
+        (user_without_connections["user_id"], []),
+        (user["user_id"], [connection["connection_id"]]),
+    ]
+
+
+@pytest.mark.parametrize("authorized_user", [{"is_superuser": True}], indirect=True)
+async def test_retrieve_users_institution_connections_limits_user_ids(
+    client, monkeypatch
+):
+    monkeypatch.setattr(settings, "connections_batch_max_users", 2)
+
+    response = await client.post(
+        "/private/institutions/connections/batch",
+        json_body={"user_ids": [1, 2, 3]},
+    )
+
+    assert response.status_code == 400
+
+
+async def test_retrieve_users_institution_connections_requires_superuser(
+    client, create_user, create_connection
+):
+    other_user = await create_user()
+    await create_connection(user_id=other_user["user_id"])
+
+    response = await client.post(
+        "/private/institutions/connections/batch",
+        json_body={"user_ids": [other_user["user_id"]]},
+    )
+
+    assert response.status_code == 403
+    assert b"connection_id" not in response.body
+
+
+@pytest.mark.parametrize(
+    "started_ago, status",
+    [(timedelta(minutes=1), "importing"), (timedelta(hours=1), "failed")],
+    ids=["importing", "stale"],
+)
+async def test_retrieve_login_job(
+    client, test_db, authorized_user, robinhood_institution, started_ago, status
+):
+    await test_db.execute(
+        LOGIN_JOBS.insert().values(
+            job_id="job-1",
+            user_id=authorized_user.user_id,
+            institution_id=robinhood_institution["institution_id"],
+            status="importing",
+            # On the database's clock, like the default
+            created_at=sa.func.now() - sa.cast(started_ago, sa.Interval),
+        )
+    )
+
+    response = await client.get("/private/institutions/login/jobs/job-1")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == status
+    stored_status = await test_db.fetch_val(
+        LOGIN_JOBS.select().with_only_columns([LOGIN_JOBS.c.status])
+    )
+    assert stored_status == status
+
+
+async def test_retrieve_login_job_of_another_user(
+    client, test_db, create_user, robinhood_institution
+):
+    other_user = await create_user()
+    await test_db.execute(
+        LOGIN_JOBS.insert().values(
+            job_id="job-1",
+            user_id=other_user["user_id"],
+            institution_id=robinhood_institution["institution_id"],
+            status="importing",
+        )
+    )
+
+    response = await client.get("/private/institutions/login/jobs/job-1")
+
+    assert response.status_code == 404
+
+
+async def test_delete_institution_connection(
+    client, test_db, authorized_user, create_user, create_connection, create_asset
+):
+    other_user = await create_user()
+    for user_id in (authorized_user.user_id, other_user["user_id"]):
+        await create_connection(user_id=user_id)
+        await create_asset(user_id=user_id, asset_symbol="AAPL")
+
+    response = await client.delete("/private/institutions/robinhood")
+
+    assert response.status_code == 200
+    # The user's connection and assets go together; nobody else's are touched
+    for table in (INSTITUTION_CONNECTIONS, ASSETS):
+        rows = await test_db.fetch_all(table.select())
+        assert [row["user_id"] for row in rows] == [other_user["user_id"]]
+
+    response = await client.delete("/private/institutions/robinhood")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize("authorized_user", [{"is_superuser": True}], indirect=True)
+async def test_teardown_institution_connections(
+    client, test_db, create_user, create_connection, create_asset
+):
+    user, other_user = await create_user(), await create_user()
+    for owner in (user, other_user):
+        await create_connection(user_id=owner["user_id"])
+        await create_asset(user_id=owner["user_id"], asset_symbol="AAPL")
+
+    response = await client.post(
+        "/private/institutions/connections/teardown",
+        json_body={"institution_id": "robinhood", "user_ids": [user["user_id"]]},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"deleted_connections": 1, "deleted_assets": 1}
+    remaining_user_ids = await test_db.fetch_all(
+        INSTITUTION_CONNECTIONS.select().with_only_columns(
+            [INSTITUTION_CONNECTIONS.c.user_id]
+        )
+    )
+    assert [row["user_id"] for row in remaining_user_ids] == [other_user["user_id"]]
+
+
+async def test_teardown_institution_connections_requires_superuser(
+    client, test_db, authorized_user, create_connection
+):
+    await create_connection(user_id=authorized_user.user_id)
+
+    response = await client.post(
+        "/private/institutions/connections/teardown",
+        json_body={"institution_id": "robinhood"},
+    )
+
+    assert response.status_code == 403
+    assert (
+        await test_db.fetch_val(
+            INSTITUTION_CONNECTIONS.select().with_only_columns([sa.func.count()])
+        )
+        == 1
+    )
+
+
+class FakeLoginService:
+    """Logs straight in to an existing connection and imports a fixed outcome"""
+
+    institution_name = "Robinhood"
+
+    def __init__(self, connection, imported_assets):
+        self.connection = connection
+        self.imported_assets = imported_assets
+
+    async def login(self, credentials, user_id, institution_id, defer_holdings_import):
+        assert defer_holdings_import
+        return institutions.InstitutionConnection(**self.connection._mapping)
+
+    async def import_holdings(self, connection):
+        if isinstance(self.imported_assets, Exception):
+            raise self.imported_assets
+        return self.imported_assets
+
+
+@pytest.mark.parametrize(
+    "imported_assets, status",
+    [(3, "succeeded"), (institutions.InstitutionException("Unavailable"), "failed")],
+    ids=["succeeded", "failed"],
+)
+async def test_login_to_institution_asynchronously(
+    client, authorized_user, create_connection, imported_assets, status
+):
+    connection = await create_connection(user_id=authorized_user.user_id)
+    fastapi_app.dependency_overrides[get_institution_service] = lambda: (
+        FakeLoginService(connection=connection, imported_assets=imported_assets)
+    )
+
+    response = await client.post(
+        "/private/institutions/login/robinhood",
+        params={"asynchronous": "true"},
+        json_body={"username": "username", "password": "password"},
+    )
+
+    assert response.status_code == 202
+    assert response.json()["status"] == "importing"
+
+    # The import ran as a background task once the response was sent
+    response = await client.get(
+        f"/private/institutions/login/jobs/{response.json()['job_id']}"
+    )
+    assert response.status_code == 200
+    assert response.json()["status"] == status
+    if status == "succeeded":
+        assert response.json()["imported_assets"] == 3
+    else:
+        assert response.json()["error"] == "Robinhood API Error: Unavailable"
@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("authorized_user", [{"is_superuser": True}], indirect=True)
+async def test_export_assets(client, authorized_user, create_user, create_asset):
+    other_user = await create_user()
+    await create_asset(user_id=authorized_user.user_id, asset_symbol="AAPL")
+    await create_asset(user_id=other_user["user_id"], asset_symbol="GME")
+
+    response = await client.get("/private/portfolios/assets/export")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    exported = [json.loads(line) for line in response.body.decode().splitlines()]
+    assert {(asset["user_id"], asset["asset_symbol"]) for asset in exported} == {
+        (authorized_user.user_id, "AAPL"),
+        (other_user["user_id"], "GME"),
+    }
+
+
+async def test_export_assets_requires_superuser(client, authorized_user, create_asset):
+    await create_asset(user_id=authorized_user.user_id, asset_symbol="AAPL")
+
+    response = await client.get("/private/portfolios/assets/export")
+
+    assert response.status_code == 403
+    assert b"AAPL" not in response.body